@@ -0,0 +1,182 @@
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Sequence
+import hashlib
+import logging
+import os
+import torch
+from embedding import embed_texts
+
+BACKENDS = ("torch", "quantized", "onnx")
+
+
+class OnnxEncoder:
+    """
+    Wraps an ONNX Runtime session of the encoder so it can be called like the
+    PyTorch model: `encoder(**inputs).last_hidden_state`.
+    """
+
+    def __init__(self, onnx_path: str, num_threads: Optional[int] = None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            onnx_path, sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def __call__(self, **inputs: torch.Tensor) -> SimpleNamespace:
+        feed = {name: inputs[name].numpy() for name in self.input_names if name in inputs}
+        (last_hidden_state,) = self.session.run(["last_hidden_state"], feed)
+        return SimpleNamespace(last_hidden_state=torch.from_numpy(last_hidden_state))
+
+
+class _LastHiddenState(torch.nn.Module):
+    """Export wrapper that takes keyword inputs and returns a plain tensor"""
+
+    def __init__(self, model, input_names: List[str]):
+        super().__init__()
+        self.model = model
+        self.input_names = input_names
+
+    def forward(self, *inputs: torch.Tensor) -> torch.Tensor:
+        return self.model(**dict(zip(self.input_names, inputs))).last_hidden_state
+
+
+def export_onnx(model, tokenizer, onnx_path: str) -> None:
+    """Export the encoder to ONNX with dynamic batch and sequence axes"""
+    # A padded sample, so mask handling is not traced as a no-op
+    sample = tokenizer(
+        ["eksport af model", "eksport af model med en længere tekst"],
+        padding=True,
+        return_tensors="pt",
+    )
+    input_names = list(sample.keys())
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    os.makedirs(os.path.dirname(os.path.abspath(onnx_path)), exist_ok=True)
+    # Written next to the final path and renamed into place, so an
+    # interrupted export never leaves a partial graph that later loads reuse
+    partial_path = f"{onnx_path}.{os.getpid()}.partial"
+    try:
+        with torch.no_grad():
+            torch.onnx.export(
+                _LastHiddenState(model, input_names).eval(),
+                tuple(sample[name] for name in input_names),
+                partial_path,
+                input_names=input_names,
+                output_names=["last_hidden_state"],
+                dynamic_axes=dynamic_axes,
+                opset_version=17,
+                dynamo=False,
+            )
+        os.replace(partial_path, onnx_path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+
+def model_fingerprint(model) -> str:
+    """Short hash of the config and weights, so a new model revision gets its own exports"""
+    digest = hashlib.sha256(model.config.to_json_string().encode("utf-8"))
+    for name, tensor in model.state_dict().items():
+        digest.update(name.encode("utf-8"))
+        digest.update(tensor.detach().cpu().contiguous().view(torch.uint8).numpy())
+    return digest.hexdigest()[:12]
+
+
+def versioned_onnx_path(onnx_path: str, model) -> str:
+    """`onnx_path` with the model fingerprint before the extension"""
+    stem, extension = os.path.splitext(onnx_path)
+    return f"{stem}-{model_fingerprint(model)}{extension or '.onnx'}"
+
+
+def load_model(model_name: str, cache_dir: Optional[str] = None):
+    """
+    Load the tokenizer and fp32 model. With `cache_dir`, the first load saves
+    a safetensors snapshot there and later loads read it locally (weights are
+    memory-mapped), so restarts do not touch the network.
+    """
+    from transformers import AutoTokenizer, AutoModel
+
+    if cache_dir and os.path.exists(os.path.join(cache_dir, "config.json")):
+        source = cache_dir
+    else:
+        source = model_name
+
+    tokenizer = AutoTokenizer.from_pretrained(source)
+    model = AutoModel.from_pretrained(source).eval()
+
+    if cache_dir and source != cache_dir:
+        logging.info(f"Saving {model_name} snapshot to {cache_dir}")
+        tokenizer.save_pretrained(cache_dir)
+        model.save_pretrained(cache_dir, safe_serialization=True)
+
+    return tokenizer, model
+
+
+def load_backend(
+    name: str,
+    model,
+    tokenizer,
+    onnx_path: Optional[str] = None,
+    num_threads: Optional[int] = None,
+):
+    """
+    Return an encoder for the selected backend. `model` is the fp32 PyTorch
+    model; "quantized" applies int8 dynamic quantization to its Linear
+    layers, and "onnx" exports it (once per model revision, cached at
+    `onnx_path` with the model fingerprint added to the file name) and runs
+    it with ONNX Runtime.
+    """
+    if name == "torch":
+        return model
+
+    if name == "quantized":
+        return torch.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8, inplace=False
+        )
+
+    if name == "onnx":
+        if not onnx_path:
+            raise ValueError("The onnx backend requires an ONNX model path")
+        onnx_path = versioned_onnx_path(onnx_path, model)
+        if not os.path.exists(onnx_path):
+            logging.info(f"Exporting ONNX model to {onnx_path}")
+            export_onnx(model, tokenizer, onnx_path)
+        return OnnxEncoder(onnx_path, num_threads=num_threads)
+
+    raise ValueError(f"Unknown inference backend: {name} (expected one of {', '.join(BACKENDS)})")
+
+
+def cosine_similarities(a: List[List[float]], b: List[List[float]]) -> List[float]:
+    left = torch.tensor(a)
+    right = torch.tensor(b)
+    return torch.nn.functional.cosine_similarity(left, right, dim=1).tolist()
+
+
+def parity_check(reference, candidate, tokenizer, texts: Sequence[str]) -> Dict[str, float]:
+    """Compare `candidate` against the fp32 `reference` on a fixed sample set"""
+    expected = embed_texts(reference, tokenizer, texts)
+    actual = embed_texts(candidate, tokenizer, texts)
+    similarities = cosine_similarities(expected, actual)
+    return {
+        "min_cosine": min(similarities),
+        "mean_cosine": sum(similarities) / len(similarities),
+    }
+
+
+# Fixed sample set for parity checks
+PARITY_SAMPLES = [
+    "Folketinget vedtog i dag lovforslaget om ændring af skatteloven.",
+    "Ministeren blev spurgt om regeringens plan for den grønne omstilling.",
+    "Udvalget har behandlet beslutningsforslaget og indstiller det til forkastelse.",
+    "Forslag til lov om ændring af lov om social service (L 123).",
+    "Spørgsmålet drejer sig om ventetider i sundhedsvæsenet i Region Syddanmark.",
+    "Afstemningen om B 45 blev udskudt til næste møde i salen.",
+    "Kommunerne skal sikre, at borgerne får hjælp inden for rimelig tid.",
+    "Redegørelsen beskriver udviklingen i forsvarets økonomi frem mod 2030.",
+]
@@ -0,0 +1,147 @@
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+import asyncio
+import logging
+import time
+from observability import QUEUE_BATCH_SIZE
+
+
+class BatcherStopped(Exception):
+    """The batcher was stopped before the request was processed"""
+
+
+class MicroBatcher:
+    """
+    Collects concurrent requests into one batch call. A batch is flushed as
+    soon as it holds `max_batch_size` items or the oldest item has waited
+    `max_wait_ms` milliseconds, whichever comes first. Each caller gets back
+    the result at its own position in the batch. Up to
+    `max_concurrent_batches` batches are processed at the same time.
+    """
+
+    def __init__(
+        self,
+        process_batch: Callable[[List[Any]], Awaitable[List[Any]]],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        max_concurrent_batches: int = 1,
+    ):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_concurrent_batches = max_concurrent_batches
+        self.queue: Optional[asyncio.Queue] = None
+        self.worker: Optional[asyncio.Task] = None
+        self.running: Set[asyncio.Task] = set()
+        self.batch_sizes: Counter = Counter()
+
+    def _ensure_worker(self) -> asyncio.Queue:
+        if self.worker is None or self.worker.done():
+            self.queue = asyncio.Queue()
+            self.worker = asyncio.create_task(self._run())
+        assert self.queue is not None
+        return self.queue
+
+    async def submit(self, item: Any) -> Any:
+        """Queue a single item and wait for its result"""
+        queue = self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await queue.put((item, future))
+        return await future
+
+    async def _collect(self, queue: asyncio.Queue) -> List[Tuple[Any, asyncio.Future]]:
+        batch = [await queue.get()]
+        deadline = time.monotonic() + self.max_wait
+
+        try:
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+        except asyncio.CancelledError:
+            self._fail(batch)
+            raise
+
+        return batch
+
+    async def _run(self) -> None:
+        assert self.queue is not None
+        queue = self.queue
+        slots = asyncio.Semaphore(self.max_concurrent_batches)
+        while True:
+            # Keep collecting while a batch is running, but only flush when a slot is free
+            await slots.acquire()
+            batch = await self._collect(queue)
+            self.batch_sizes[len(batch)] += 1
+            QUEUE_BATCH_SIZE.observe(len(batch))
+            task = asyncio.create_task(self._dispatch(batch))
+            self.running.add(task)
+
+            def finished(task: asyncio.Task) -> None:
+                self.running.discard(task)
+                slots.release()
+
+            task.add_done_callback(finished)
+
+    async def _dispatch(self, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        items = [item for item, _ in batch]
+        try:
+            results = await self.process_batch(items)
+        except asyncio.CancelledError:
+            self._fail(batch)
+            raise
+        except Exception as e:
+            logging.error(f"Error processing batch of {len(batch)}: {str(e)}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    @staticmethod
+    def _fail(batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(BatcherStopped("Batcher stopped before the request was processed"))
+
+    async def stop(self) -> None:
+        """Stop the worker and fail every request that has not been answered"""
+        if self.worker is not None:
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+            self.worker = None
+        running = list(self.running)
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        if self.queue is not None:
+            while not self.queue.empty():
+                self._fail([self.queue.get_nowait()])
+
+    def queue_depth(self) -> int:
+        return self.queue.qsize() if self.queue is not None else 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Summary of the batch sizes achieved so far"""
+        batches = sum(self.batch_sizes.values())
+        items = sum(size * count for size, count in self.batch_sizes.items())
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "queue_depth": self.queue_depth(),
+            "batches_in_flight": len(self.running),
+            "batches": batches,
+            "items": items,
+            "mean_batch_size": items / batches if batches else 0.0,
+            "batch_size_counts": dict(sorted(self.batch_sizes.items())),
+        }
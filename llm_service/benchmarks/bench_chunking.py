@@ -0,0 +1,113 @@
+"""
+Benchmark of the single-pass, offset-based chunker against the previous
+paragraph chunker (tokenize per paragraph, decode long windows, then
+tokenize every chunk again for the model).
+
+    python benchmarks/bench_chunking.py --docs-dir ../assets/data/html
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transformers import AutoTokenizer
+from chunking import chunk_document
+from backends import PARITY_SAMPLES
+
+
+def legacy_split_text_into_chunks(tokenizer, text, chunk_size=512, overlap=50):
+    """The chunker this benchmark replaces, kept as the baseline"""
+    paragraphs = text.split("\n\n")
+    chunks = []
+    current_chunk = []
+    current_length = 0
+
+    for paragraph in paragraphs:
+        tokens = tokenizer.encode(paragraph, add_special_tokens=False)
+
+        if current_length + len(tokens) <= chunk_size:
+            current_chunk.append(paragraph)
+            current_length += len(tokens)
+        else:
+            if current_chunk:
+                chunks.append("\n\n".join(current_chunk))
+
+            if len(tokens) > chunk_size:
+                for i in range(0, len(tokens), chunk_size - overlap):
+                    chunk_tokens = tokens[i : i + chunk_size]
+                    chunks.append(tokenizer.decode(chunk_tokens, skip_special_tokens=True))
+                current_chunk = []
+                current_length = 0
+            else:
+                current_chunk = [paragraph]
+                current_length = len(tokens)
+
+    if current_chunk:
+        chunks.append("\n\n".join(current_chunk))
+
+    return chunks
+
+
+def legacy_pipeline(tokenizer, text):
+    chunks = legacy_split_text_into_chunks(tokenizer, text)
+    # Every chunk was tokenized again before the forward pass
+    return [tokenizer(chunk, truncation=True, max_length=512)["input_ids"] for chunk in chunks]
+
+
+def single_pass_pipeline(tokenizer, text):
+    return [chunk.input_ids for chunk in chunk_document(tokenizer, text)]
+
+
+def load_documents(args):
+    if args.docs_dir:
+        documents = []
+        for root, _, files in os.walk(args.docs_dir):
+            for name in sorted(files):
+                with open(os.path.join(root, name), encoding="utf-8", errors="ignore") as f:
+                    documents.append(f.read())
+        return documents[: args.documents]
+
+    words = " ".join(PARITY_SAMPLES).lower().split()
+    return [
+        " ".join(words[(i + j) % len(words)] for j in range(args.words))
+        for i in range(args.documents)
+    ]
+
+
+def run(pipeline, tokenizer, documents):
+    start = time.perf_counter()
+    chunks = sum(len(pipeline(tokenizer, doc)) for doc in documents)
+    return time.perf_counter() - start, chunks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark document chunking.")
+    parser.add_argument("--model", default="Maltehb/danish-bert-botxo", help="Model name or path")
+    parser.add_argument("--docs-dir", help="Directory of real documents (default: synthetic)")
+    parser.add_argument("--documents", type=int, default=50)
+    parser.add_argument("--words", type=int, default=20000, help="Words per synthetic document")
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    documents = load_documents(args)
+    total_tokens = sum(len(tokenizer(doc, add_special_tokens=False)["input_ids"]) for doc in documents)
+
+    report = {"documents": len(documents), "tokens": total_tokens}
+    for name, pipeline in (("legacy", legacy_pipeline), ("single_pass", single_pass_pipeline)):
+        pipeline(tokenizer, documents[0])  # warm-up
+        seconds, chunks = run(pipeline, tokenizer, documents)
+        report[name] = {
+            "seconds": seconds,
+            "chunks": chunks,
+            "tokens_per_second": total_tokens / seconds,
+        }
+    report["speedup"] = report["legacy"]["seconds"] / report["single_pass"]["seconds"]
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
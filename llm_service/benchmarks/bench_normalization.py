@@ -0,0 +1,103 @@
+"""
+Microbenchmark and parity check of DanishTextNormalizer against the
+previous preprocess_danish_text.
+
+    python benchmarks/bench_normalization.py --docs-dir ../assets/data/html
+
+Exits non-zero if the outputs differ on text without HTML tags (on tagged
+text the new pipeline intentionally differs: tags are removed whole).
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backends import PARITY_SAMPLES
+from text_normalization import DanishTextNormalizer, load_danish_stopwords
+
+
+def legacy_preprocess_danish_text(text, danish_stopwords):
+    """The function this benchmark replaces, kept as the baseline"""
+    text = text.lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    words = text.split()
+    words = [word for word in words if word not in danish_stopwords]
+    text = " ".join(words)
+    text = re.sub(r"<[^>]*>", "", text)
+    return text
+
+
+def load_documents(args):
+    if args.docs_dir:
+        documents = []
+        for root, _, files in os.walk(args.docs_dir):
+            for name in sorted(files):
+                with open(os.path.join(root, name), encoding="utf-8", errors="ignore") as f:
+                    documents.append(f.read())
+        return documents[: args.documents]
+
+    # Synthetic documents of typical report length: paragraphs of mixed
+    # case text with irregular whitespace and the odd HTML tag
+    words = " ".join(PARITY_SAMPLES).split()
+    documents = []
+    for i in range(args.documents):
+        paragraphs = []
+        for p in range(args.words // 100):
+            body = " ".join(words[(i + p + j) % len(words)] for j in range(100))
+            paragraphs.append(f'<p class="tekst">{body}</p>' if p % 5 == 0 else body)
+        documents.append("\n\n  ".join(paragraphs))
+    return documents
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Danish text normalization.")
+    parser.add_argument("--docs-dir", help="Directory of real documents (default: synthetic)")
+    parser.add_argument("--documents", type=int, default=50)
+    parser.add_argument("--words", type=int, default=20000, help="Words per synthetic document")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    stopwords = load_danish_stopwords()
+    normalizer = DanishTextNormalizer(stopwords)
+    documents = load_documents(args)
+    megabytes = sum(len(doc.encode("utf-8")) for doc in documents) / 1e6
+
+    # Parity on tag-free text
+    untagged = [re.sub(r"<[^>]*>", " ", doc) for doc in documents]
+    mismatches = sum(
+        legacy_preprocess_danish_text(doc, stopwords) != normalizer.normalize(doc)
+        for doc in untagged
+    )
+
+    legacy = timed(lambda: [legacy_preprocess_danish_text(d, stopwords) for d in documents], args.repeat)
+    single = timed(lambda: [normalizer.normalize(d) for d in documents], args.repeat)
+    batch = timed(lambda: normalizer.normalize_many(documents), args.repeat)
+
+    report = {
+        "documents": len(documents),
+        "megabytes": megabytes,
+        "parity_mismatches": mismatches,
+        "legacy_mb_per_second": megabytes / legacy,
+        "normalize_mb_per_second": megabytes / single,
+        "normalize_many_mb_per_second": megabytes / batch,
+        "speedup": legacy / single,
+    }
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Parity and throughput comparison of the inference backends against the fp32
+PyTorch model.
+
+    python benchmarks/compare_backends.py --backends quantized onnx
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transformers import AutoTokenizer, AutoModel
+from backends import BACKENDS, PARITY_SAMPLES, load_backend, parity_check
+from embedding import embed_texts
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare inference backends against fp32.")
+    parser.add_argument("--model", default="Maltehb/danish-bert-botxo", help="Model name or path")
+    parser.add_argument("--backends", nargs="+", default=["quantized", "onnx"], choices=BACKENDS)
+    parser.add_argument("--onnx-path", default="/tmp/openparliament-benchmark.onnx")
+    parser.add_argument("--texts", type=int, default=256, help="Number of texts for the throughput run")
+    parser.add_argument("--words", type=int, default=200, help="Words per throughput text")
+    parser.add_argument("--min-cosine", type=float, default=0.99, help="Fail below this parity")
+    return parser.parse_args()
+
+
+def throughput(encoder, tokenizer, texts) -> float:
+    embed_texts(encoder, tokenizer, texts[:8])  # warm-up
+    start = time.perf_counter()
+    embed_texts(encoder, tokenizer, texts)
+    return len(texts) / (time.perf_counter() - start)
+
+
+def main():
+    args = parse_args()
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    model = AutoModel.from_pretrained(args.model).eval()
+
+    words = " ".join(PARITY_SAMPLES).split()
+    texts = [
+        " ".join(words[(i + j) % len(words)] for j in range(args.words))
+        for i in range(args.texts)
+    ]
+
+    report = {"fp32": {"texts_per_second": throughput(model, tokenizer, texts)}}
+    failed = False
+    for name in args.backends:
+        encoder = load_backend(name, model, tokenizer, onnx_path=args.onnx_path)
+        parity = parity_check(model, encoder, tokenizer, PARITY_SAMPLES + texts[:16])
+        speed = throughput(encoder, tokenizer, texts)
+        report[name] = {
+            **parity,
+            "texts_per_second": speed,
+            "speedup": speed / report["fp32"]["texts_per_second"],
+        }
+        failed = failed or parity["min_cosine"] < args.min_cosine
+
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
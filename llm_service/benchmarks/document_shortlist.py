@@ -0,0 +1,129 @@
+"""
+Recall versus vector comparisons of two-stage (document shortlist) search
+on our own corpus.
+
+    DATABASE_URL=postgresql://... python benchmarks/document_shortlist.py
+    python benchmarks/document_shortlist.py --chunks chunks.npz
+
+Reads the stored chunk embeddings of FilContent and taleSegmentChunk (or an
+.npz with `vectors`, `parent_ids` and optionally `weights`), uses
+random stored chunks as queries, and compares the top-k of two-stage search for
+several shortlist sizes, and of cluster probing, against exact search.
+Prints JSON with recall@k, vector comparisons and query time per
+configuration.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from quantization import normalize
+from search_index import METADATA_DTYPE, SOURCES, IvfIndex, chunk_weights, fetch_chunks
+
+
+def load_from_database(database_url, model_name):
+    from sqlalchemy import create_engine
+    from transformers import AutoTokenizer
+
+    engine = create_engine(database_url)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    vectors, metadata, weights = [], [], []
+    for source in SOURCES:
+        for page_vectors, page_metadata, texts in fetch_chunks(engine, source):
+            vectors.append(page_vectors)
+            metadata.append(page_metadata)
+            weights.append(chunk_weights(tokenizer, texts))
+    return np.concatenate(vectors), np.concatenate(metadata), np.concatenate(weights)
+
+
+def load_from_file(path):
+    data = np.load(path)
+    vectors = normalize(data["vectors"])
+    metadata = np.zeros(len(vectors), dtype=METADATA_DTYPE)
+    metadata["row_id"] = np.arange(1, len(vectors) + 1)
+    metadata["parent_id"] = data["parent_ids"]
+    metadata["version"] = 1
+    metadata["periode_id"] = metadata["document_type_id"] = -1
+    weights = data["weights"] if "weights" in data else np.ones(len(vectors), dtype=np.float32)
+    return vectors, metadata, weights
+
+
+def recall(found, expected) -> float:
+    return len(set(found) & set(expected)) / len(expected)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall versus comparisons of two-stage search.")
+    parser.add_argument("--chunks", help=".npz file of chunks instead of the database")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument(
+        "--model", default=os.getenv("MODEL_NAME", "Maltehb/danish-bert-botxo"), help="Tokenizer for chunk weights"
+    )
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--documents", type=int, nargs="+", default=[10, 20, 50, 100, 200])
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[8, 16, 32])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.chunks:
+        vectors, metadata, weights = load_from_file(args.chunks)
+    elif args.database_url:
+        vectors, metadata, weights = load_from_database(args.database_url, args.model)
+    else:
+        parser.error("pass --chunks or set DATABASE_URL")
+
+    rng = np.random.default_rng(args.seed)
+    queries = vectors[rng.choice(len(vectors), min(args.queries, len(vectors)), replace=False)]
+    index = IvfIndex.build(vectors, metadata, seed=args.seed, weights=weights)
+    document_vectors, _, offsets, _ = index.documents
+    chunks_per_document = np.diff(offsets)
+
+    live = ~np.asarray(index.removed)
+    expected = []
+    for query in queries:
+        scores = np.where(live, np.asarray(index.vectors) @ query, -np.inf)
+        expected.append(index.metadata["row_id"][np.argsort(-scores)[: args.k]].tolist())
+
+    def run(name, comparisons, **options):
+        started = time.perf_counter()
+        results = [[int(row["row_id"]) for row, _ in index.search(query, args.k, **options)] for query in queries]
+        elapsed = time.perf_counter() - started
+        report["runs"][name] = {
+            "recall": float(np.mean([recall(f, e) for f, e in zip(results, expected)])),
+            "comparisons": float(np.mean(comparisons)),
+            "ms_per_query": elapsed / len(queries) * 1000,
+        }
+
+    report = {
+        "chunks": int(live.sum()),
+        "documents": len(document_vectors),
+        "chunks_per_document": float(chunks_per_document.mean()),
+        "nlist": index.nlist,
+        "k": args.k,
+        "runs": {},
+    }
+    for documents in args.documents:
+        comparisons = []
+        for query in queries:
+            shortlist = np.argsort(-(np.asarray(document_vectors) @ query))[:documents]
+            comparisons.append(len(document_vectors) + chunks_per_document[shortlist].sum())
+        run(f"documents={documents}", comparisons, documents=documents)
+    cluster_sizes = np.diff(index.offsets)
+    for nprobe in args.nprobe:
+        comparisons = []
+        for query in queries:
+            probed = np.argsort(-(index.centroids @ query))[:nprobe]
+            comparisons.append(index.nlist + cluster_sizes[probed].sum())
+        run(f"nprobe={nprobe}", comparisons, nprobe=nprobe)
+    report["runs"]["exhaustive"] = {"recall": 1.0, "comparisons": float(live.sum())}
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""
+Offline load test of the embedding service. Starts the FastAPI app
+in-process against a tiny randomly initialised BERT (same architecture as
+the production model, with a WordPiece vocabulary trained on the synthetic
+corpus), so nothing is downloaded, and drives /get_embedding and
+/process_document_embeddings with a synthetic Danish corpus.
+
+    python benchmarks/load_test.py --concurrency 16 --requests 500
+    python benchmarks/load_test.py --model /models/danish-bert-botxo --output before.json
+
+Prints p50/p95/p99 latency, requests per second and model tokens per second
+per endpoint as JSON. Service settings (EMBEDDING_MAX_BATCH_SIZE,
+INFERENCE_REPLICAS, INFERENCE_BACKEND, ...) are read from the environment as
+usual, so runs before and after a change can be compared.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+# Words of parliamentary Danish the synthetic corpus is drawn from
+WORDS = """
+folketinget ministeren regeringen udvalget lovforslaget beslutningsforslaget
+forslag til lov om ændring af skatteloven social service sundhedsvæsenet
+kommunerne regionerne borgerne erhvervslivet klimaet den grønne omstilling
+forsvarets økonomi udlændinge integration beskæftigelse dagpenge pension
+uddannelse folkeskolen gymnasiet universiteterne forskning landbruget
+fiskeriet miljøet energi vindmøller transport jernbanen motorvejen
+spørgsmålet besvarelsen redegørelsen betænkningen afstemningen vedtaget
+forkastet udskudt behandlet første anden tredje behandling i salen
+at og i det er en til på som de med han for ikke der var men
+skal kan vil har blev bliver bør må efter under over mellem inden
+frem mod ved fra hvor når hvis fordi derfor dog også meget mere
+mindre større mindre flere færre nye gamle offentlige private lokale
+danske europæiske nordiske økonomiske sociale politiske juridiske
+rimelig tid ventetider hjælp ansvar retningslinjer tilskud afgifter
+budgettet finansloven aftalen partierne oppositionen flertallet
+""".split()
+
+
+def synthetic_text(rng: random.Random, words: int) -> str:
+    sentences = []
+    remaining = words
+    while remaining > 0:
+        length = min(remaining, rng.randint(6, 25))
+        sentence = " ".join(rng.choice(WORDS) for _ in range(length))
+        if rng.random() < 0.1:
+            sentence += f" (L {rng.randint(1, 250)})"
+        sentences.append(sentence.capitalize() + ".")
+        remaining -= length
+    return " ".join(sentences)
+
+
+def document_lengths(rng: random.Random, count: int, median_words: int):
+    # Parliamentary documents are heavy-tailed: mostly a few pages, some reports
+    return [
+        int(min(40000, max(50, rng.lognormvariate(np.log(median_words), 0.9))))
+        for _ in range(count)
+    ]
+
+
+def build_tiny_model(path: str, corpus, args) -> None:
+    """Save a randomly initialised BertModel and a WordPiece tokenizer to `path`"""
+    from tokenizers import Tokenizer, decoders, models, normalizers, pre_tokenizers, processors, trainers
+    from transformers import BertConfig, BertModel, PreTrainedTokenizerFast
+
+    special_tokens = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+    wordpiece = Tokenizer(models.WordPiece(unk_token="[UNK]"))
+    wordpiece.normalizer = normalizers.BertNormalizer(lowercase=True, strip_accents=False)
+    wordpiece.pre_tokenizer = pre_tokenizers.BertPreTokenizer()
+    wordpiece.decoder = decoders.WordPiece()
+    wordpiece.train_from_iterator(
+        corpus, trainers.WordPieceTrainer(vocab_size=args.vocab_size, special_tokens=special_tokens)
+    )
+    cls_id, sep_id = wordpiece.token_to_id("[CLS]"), wordpiece.token_to_id("[SEP]")
+    wordpiece.post_processor = processors.TemplateProcessing(
+        single="[CLS] $A [SEP]",
+        pair="[CLS] $A [SEP] $B:1 [SEP]:1",
+        special_tokens=[("[CLS]", cls_id), ("[SEP]", sep_id)],
+    )
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=wordpiece,
+        unk_token="[UNK]",
+        pad_token="[PAD]",
+        cls_token="[CLS]",
+        sep_token="[SEP]",
+        mask_token="[MASK]",
+        model_max_length=512,
+    )
+
+    config = BertConfig(
+        vocab_size=wordpiece.get_vocab_size(),
+        hidden_size=args.hidden_size,
+        num_hidden_layers=args.layers,
+        num_attention_heads=args.heads,
+        intermediate_size=args.hidden_size * 4,
+        max_position_embeddings=512,
+    )
+    tokenizer.save_pretrained(path)
+    BertModel(config).eval().save_pretrained(path, safe_serialization=True)
+
+
+async def run_scenario(client, path, payloads, concurrency, tokens_total):
+    """Send `payloads` to `path` from `concurrency` concurrent clients"""
+    latencies = []
+    errors = 0
+    pending = iter(payloads)
+
+    async def client_loop():
+        nonlocal errors
+        for payload in pending:
+            started = time.perf_counter()
+            response = await client.post(path, json=payload)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                errors += 1
+
+    tokens_before = tokens_total()
+    started = time.perf_counter()
+    await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    tokens = tokens_total() - tokens_before
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "concurrency": concurrency,
+        "p50_ms": p50,
+        "p95_ms": p95,
+        "p99_ms": p99,
+        "mean_ms": float(np.mean(latencies)) * 1000,
+        "requests_per_second": len(latencies) / elapsed,
+        "tokens_per_second": tokens / elapsed,
+        "seconds": elapsed,
+    }
+
+
+async def run(args, rng):
+    # The app reads its settings at import, so it is imported once the model exists
+    import httpx
+    import main
+    from observability import TOKENS
+
+    await main.startup()
+    await main.service_loaded.wait()
+    if main.load_error is not None:
+        raise SystemExit(f"Model failed to load: {main.load_error}")
+
+    def tokens_total():
+        return sum(TOKENS.values.values())
+
+    queries = [
+        {"text": synthetic_text(rng, rng.randint(args.query_min_words, args.query_max_words))}
+        for _ in range(args.requests)
+    ]
+    documents = [
+        {"text": synthetic_text(rng, words)}
+        for words in document_lengths(rng, args.documents, args.document_median_words)
+    ]
+
+    report = {
+        "model": main.model_name,
+        "backend": main.inference_backend,
+        "replicas": main.inference_replicas,
+        "startup": main.startup_timings,
+    }
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://load-test", timeout=None) as client:
+        report["get_embedding"] = await run_scenario(
+            client, "/get_embedding", queries, args.concurrency, tokens_total
+        )
+        report["process_document_embeddings"] = await run_scenario(
+            client, "/process_document_embeddings", documents, args.document_concurrency, tokens_total
+        )
+        report["process_document_embeddings"]["median_words"] = args.document_median_words
+
+    await main.shutdown()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the embedding service in-process.")
+    parser.add_argument("--model", help="Local model directory (default: a tiny random BERT)")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent /get_embedding clients")
+    parser.add_argument("--requests", type=int, default=500, help="/get_embedding requests")
+    parser.add_argument("--query-min-words", type=int, default=5)
+    parser.add_argument("--query-max-words", type=int, default=60)
+    parser.add_argument("--document-concurrency", type=int, default=4)
+    parser.add_argument("--documents", type=int, default=40, help="/process_document_embeddings requests")
+    parser.add_argument("--document-median-words", type=int, default=1500)
+    parser.add_argument("--hidden-size", type=int, default=128, help="Tiny model hidden size")
+    parser.add_argument("--layers", type=int, default=2, help="Tiny model layers")
+    parser.add_argument("--heads", type=int, default=2, help="Tiny model attention heads")
+    parser.add_argument("--vocab-size", type=int, default=2000, help="Tiny model WordPiece vocabulary")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    # Keep per-request logging out of the measurements
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ.setdefault("LOG_SAMPLE_RATE", "0")
+
+    with tempfile.TemporaryDirectory() as model_dir:
+        if args.model:
+            os.environ["MODEL_NAME"] = args.model
+        else:
+            import torch
+
+            torch.manual_seed(args.seed)
+            corpus = [synthetic_text(random.Random(i), 200) for i in range(500)]
+            build_tiny_model(model_dir, corpus, args)
+            os.environ["MODEL_NAME"] = model_dir
+        # Keep the job database out of the working directory
+        os.environ.setdefault("EMBEDDING_JOBS_PATH", os.path.join(model_dir, "embedding_jobs.db"))
+        report = asyncio.run(run(args, rng))
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+ODA page fetch throughput against a local stand-in for the OData feed.
+
+    python benchmarks/oda_fetch.py --rows 20000 --latency-ms 80
+    python benchmarks/oda_fetch.py --concurrency 1 4 8 16 --page-size 100
+
+Serves `rows` synthetic records from a local HTTP server that answers
+$top/$skip/$inlinecount like oda.ft.dk, adding `latency-ms` to every
+response, and fetches the whole entity with OdaDbSync.fetch_oda_data for
+every concurrency. Prints JSON with rows per second per configuration and
+checks that every run returned the rows in order without gaps.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "database"))
+
+import uvicorn
+from fastapi import FastAPI, Request
+from sync_oda_db import OdaDbSync
+
+
+def stand_in_app(rows: int, latency: float, max_top: int) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/api/{entity}")
+    async def feed(entity: str, request: Request):
+        params = request.query_params
+        skip = int(params.get("$skip", 0))
+        top = min(int(params.get("$top", max_top)), max_top)
+        await asyncio.sleep(latency)
+        values = [
+            {"id": i + 1, "typeid": 1, "opdateringsdato": f"2024-01-01T00:00:{i % 60:02d}"}
+            for i in range(skip, min(skip + top, rows))
+        ]
+        body = {"odata.metadata": f"https://oda.ft.dk/api/$metadata#{entity}", "value": values}
+        if params.get("$inlinecount") == "allpages":
+            body["odata.count"] = str(rows)
+        if skip + top < rows:
+            body["odata.nextLink"] = f"https://oda.ft.dk/api/{entity}?$skip={skip + top}"
+        return body
+
+    return app
+
+
+def start_server(app: FastAPI) -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return port
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="ODA page fetch throughput against a local stand-in.")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--latency-ms", type=float, default=80.0, help="Added to every response")
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--max-top", type=int, default=100, help="Largest page the stand-in serves, as ODA")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    port = start_server(stand_in_app(args.rows, args.latency_ms / 1000, args.max_top))
+    report = {"rows": args.rows, "latency_ms": args.latency_ms, "page_size": args.page_size, "runs": {}}
+    for concurrency in args.concurrency:
+        sync = OdaDbSync(
+            "sqlite://",
+            oda_base_url=f"http://127.0.0.1:{port}/api",
+            page_size=args.page_size,
+            fetch_concurrency=concurrency,
+        )
+        async with sync:
+            started = time.perf_counter()
+            items = await sync.fetch_oda_data("Stemme")
+            elapsed = time.perf_counter() - started
+        report["runs"][f"concurrency={concurrency}"] = {
+            "seconds": elapsed,
+            "rows_per_second": len(items) / elapsed,
+            "complete_and_ordered": [item["id"] for item in items] == list(range(1, args.rows + 1)),
+            "requests": sync.http_stats["requests"],
+            "connections_opened": sync.http_stats["connections_opened"],
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
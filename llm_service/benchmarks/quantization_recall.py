@@ -0,0 +1,106 @@
+"""
+Recall versus memory of the compact embedding codes on our own corpus.
+
+    DATABASE_URL=postgresql://... python benchmarks/quantization_recall.py --limit 50000
+    python benchmarks/quantization_recall.py --vectors embeddings.npy
+
+Samples stored chunk embeddings from FilContent and taleSegmentChunk (or
+reads an .npy array), holds some of them out as queries, and compares the
+top-k of every quantized search (screen `candidates` by code, rescore with
+the full vectors) against exact float32 search. Prints JSON with recall@k,
+bytes per vector and query time per configuration.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from quantization import KINDS, QuantizedVectors, code_bytes, normalize
+
+
+def load_from_database(database_url, tables, limit):
+    from sqlalchemy import create_engine, text
+
+    engine = create_engine(database_url)
+    vectors = []
+    with engine.connect() as conn:
+        for table in tables:
+            rows = conn.execute(
+                text(f'SELECT embedding::text FROM "{table}" ORDER BY random() LIMIT :limit'),
+                {"limit": limit},
+            )
+            vectors.extend(np.fromstring(row[0].strip("[]"), sep=",", dtype=np.float32) for row in rows)
+    return np.vstack(vectors)
+
+
+def recall(found, expected) -> float:
+    return len(set(found.tolist()) & set(expected.tolist())) / len(expected)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall versus memory of quantized embeddings.")
+    parser.add_argument("--vectors", help=".npy file of embeddings instead of the database")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--tables", nargs="+", default=["FilContent", "taleSegmentChunk"])
+    parser.add_argument("--limit", type=int, default=20000, help="Rows sampled per table")
+    parser.add_argument("--queries", type=int, default=200, help="Vectors held out as queries")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--candidates", type=int, nargs="+", default=[10, 20, 50, 100, 200])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.vectors:
+        vectors = np.load(args.vectors).astype(np.float32)
+    elif args.database_url:
+        vectors = load_from_database(args.database_url, args.tables, args.limit)
+    else:
+        parser.error("pass --vectors or set DATABASE_URL")
+
+    rng = np.random.default_rng(args.seed)
+    order = rng.permutation(len(vectors))
+    queries = normalize(vectors[order[: args.queries]])
+    corpus = vectors[order[args.queries :]]
+    dim = corpus.shape[1]
+
+    exact = normalize(corpus)
+    expected = [np.argsort(-(exact @ query))[: args.k] for query in queries]
+
+    report = {
+        "vectors": len(corpus),
+        "queries": len(queries),
+        "dim": dim,
+        "k": args.k,
+        "float32": {
+            "bytes_per_vector": code_bytes("float32", dim),
+            "megabytes": exact.nbytes / 1e6,
+        },
+    }
+    for kind in KINDS:
+        index = QuantizedVectors(corpus, kind)
+        runs = {}
+        for candidates in [args.k] + [c for c in args.candidates if c > args.k]:
+            for rescore in (False, True) if candidates == args.k else (True,):
+                started = time.perf_counter()
+                results = [index.search(query, args.k, candidates, rescore)[0] for query in queries]
+                elapsed = time.perf_counter() - started
+                name = f"candidates={candidates}" + ("" if rescore else ",no_rescore")
+                runs[name] = {
+                    "recall": float(np.mean([recall(f, e) for f, e in zip(results, expected)])),
+                    "ms_per_query": elapsed / len(queries) * 1000,
+                }
+        report[kind] = {
+            "bytes_per_vector": code_bytes(kind, dim),
+            "megabytes": index.code_nbytes / 1e6,
+            "compression": exact.nbytes / index.code_nbytes,
+            "runs": runs,
+        }
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Per-row cost of preparing OdaDbSync upserts with and without the schema
+and statement caches.
+
+    DATABASE_URL=postgresql://... python benchmarks/sync_upsert_prep.py --entity Stemme --rows 100000
+    python benchmarks/sync_upsert_prep.py --rows 100000
+
+Prepares `rows` synthetic records of an entity (column lookup, casting and
+the INSERT ... ON CONFLICT statement) once with the caches warm, and once
+with the caches dropped before every row, which is what the sync used to
+do: one INFORMATION_SCHEMA query for the row's table and one statement
+build per row. Nothing is written. Without DATABASE_URL the catalog is
+replaced by the columns of Stemme, so only statement building and casting
+are measured.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "database"))
+
+from sqlalchemy import text
+from sync_oda_db import OdaDbSync
+
+# The per-table lookup the sync ran for every row before the schema cache
+BASELINE_COLUMNS_QUERY = text("""
+    SELECT COLUMN_NAME, DATA_TYPE
+    FROM INFORMATION_SCHEMA.COLUMNS
+    WHERE TABLE_NAME ILIKE :table_name
+""")
+
+STEMME_COLUMNS = [
+    ("id", "integer"),
+    ("typeid", "integer"),
+    ("afstemningid", "integer"),
+    ("aktørid", "integer"),
+    ("opdateringsdato", "timestamp without time zone"),
+]
+
+
+def synthetic_record(columns, i):
+    record = {}
+    for column, data_type in columns:
+        if column == "opdateringsdato" or "timestamp" in data_type:
+            record[column] = "2024-01-01T00:00:00"
+        elif data_type in ("integer", "bigint", "smallint"):
+            record[column] = i
+        else:
+            record[column] = f"{column} {i}"
+    return record
+
+
+def baseline_columns(sync, table_name):
+    with sync.engine.connect() as conn:
+        return conn.execute(BASELINE_COLUMNS_QUERY, {"table_name": table_name.replace('"', '')}).fetchall()
+
+
+async def time_prepare(sync, entity, records, drop_caches, offline_columns):
+    table_name = sync.entity_mappings[entity]
+    started = time.perf_counter()
+    for record in records:
+        if drop_caches:
+            # Filling the cache with the baseline's lookup keeps prepare_upsert
+            # from loading the whole catalog
+            sync.upsert_statements.clear()
+            columns = offline_columns if offline_columns is not None else baseline_columns(sync, table_name)
+            sync.cache_columns(table_name, columns)
+        await sync.prepare_upsert(entity, record)
+    return time.perf_counter() - started
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Upsert preparation cost with and without caches.")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--entity", default="Stemme")
+    parser.add_argument("--rows", type=int, default=100000)
+    args = parser.parse_args()
+
+    offline_columns = None
+    if args.database_url:
+        sync = OdaDbSync(args.database_url)
+        columns = await sync.get_columns_info(sync.entity_mappings[args.entity])
+    else:
+        sync = OdaDbSync("sqlite://")
+        offline_columns = columns = STEMME_COLUMNS
+        sync.cache_columns(sync.entity_mappings[args.entity], columns)
+    records = [synthetic_record(columns, i) for i in range(args.rows)]
+
+    cached = await time_prepare(sync, args.entity, records, False, offline_columns)
+    uncached = await time_prepare(sync, args.entity, records, True, offline_columns)
+    print(
+        json.dumps(
+            {
+                "entity": args.entity,
+                "rows": args.rows,
+                "catalog": "database" if offline_columns is None else "offline",
+                "uncached_seconds": uncached,
+                "cached_seconds": cached,
+                "saved_seconds": uncached - cached,
+                "uncached_us_per_row": uncached / args.rows * 1e6,
+                "cached_us_per_row": cached / args.rows * 1e6,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,71 @@
+from typing import List, NamedTuple
+
+
+class Chunk(NamedTuple):
+    text: str
+    start_char: int
+    end_char: int
+    input_ids: List[int]
+
+
+def chunk_document(tokenizer, text: str, chunk_size: int = 512, overlap: int = 50) -> List[Chunk]:
+    """
+    Tokenizes `text` once and cuts the token ids into overlapping windows.
+    Each window holds at most `chunk_size` tokens including [CLS] and [SEP],
+    so it never exceeds the model's 512-token limit, and consecutive windows
+    share about `overlap` tokens. Chunk text is the span of `text` covered by
+    the window, taken from the tokenizer's character offsets, and the
+    window's token ids are kept so the model does not tokenize the chunk
+    again.
+
+    Windows start and end on word boundaries, never inside a word split
+    into word pieces, so tokenizing a chunk's text again gives its token
+    ids. The chunk text is also the embedding cache key shared with
+    /get_embedding, so it must map to the same vector there.
+    """
+    encoding = tokenizer(
+        text, add_special_tokens=False, return_offsets_mapping=True, verbose=False
+    )
+    ids = encoding["input_ids"]
+    offsets = encoding["offset_mapping"]
+
+    if not ids:
+        # Keep one (empty) chunk so callers always get an embedding back
+        return [Chunk(text="", start_char=0, end_char=0, input_ids=[])]
+
+    word_ids = encoding.word_ids()
+    word_starts = [i for i in range(len(ids)) if i == 0 or word_ids[i] != word_ids[i - 1]]
+    is_word_start = [False] * (len(ids) + 1)
+    for i in word_starts:
+        is_word_start[i] = True
+    is_word_start[len(ids)] = True
+
+    def snap_back(position: int, lowest: int) -> int:
+        """The last word start in (lowest, position], or `position` if there is none"""
+        for i in range(position, lowest, -1):
+            if is_word_start[i]:
+                return i
+        return position
+
+    window = chunk_size - 2  # room for [CLS] and [SEP]
+    chunks = []
+    start = 0
+
+    while True:
+        # A single word longer than the window is still cut inside the word
+        end = snap_back(min(start + window, len(ids)), start)
+        start_char = offsets[start][0]
+        end_char = offsets[end - 1][1]
+        chunks.append(
+            Chunk(
+                text=text[start_char:end_char],
+                start_char=start_char,
+                end_char=end_char,
+                input_ids=ids[start:end],
+            )
+        )
+        if end == len(ids):
+            break
+        start = snap_back(max(start + 1, end - overlap), start)
+
+    return chunks
@@ -12,6 +12,12 @@ def parse_args():
     parser = argparse.ArgumentParser(description='Sync ODA data to database.')
     parser.add_argument('--entity', type=str, help='Name of the entity to sync.')
     parser.add_argument('--list-tables', action='store_true', help='List all tables in the database')
+    parser.add_argument('--batch-size', type=int, default=5000, help='Rows merged per staging table and transaction')
+    parser.add_argument('--page-size', type=int, default=100, help='Rows per ODA API request')
+    parser.add_argument('--concurrency', type=int, default=8, help='ODA API requests in flight per entity')
+    parser.add_argument('--queue-pages', type=int, default=50, help='Fetched pages buffered ahead of the database writer')
+    parser.add_argument('--max-connections', type=int, default=32, help='Pooled connections to the ODA API')
+    parser.add_argument('--http2', action='store_true', help='Use HTTP/2 to the ODA API (needs httpx[http2])')
     return parser.parse_args()
 
 async def list_tables(db_url):
@@ -41,18 +47,23 @@ async def main():
         await list_tables(db_url)
         return
         
-    sync = OdaDbSync(db_url)
+    sync = OdaDbSync(
+        db_url,
+        write_batch_size=args.batch_size,
+        page_size=args.page_size,
+        fetch_concurrency=args.concurrency,
+        queue_pages=args.queue_pages,
+        max_connections=args.max_connections,
+        http2=args.http2,
+    )
     try:
         if args.entity:
             entity_name = args.entity
             since_date = await sync.get_last_sync_date(entity_name)
             logging.info(f"Last sync date for {entity_name}: {since_date}")
             
-            items = await sync.fetch_oda_data(entity_name, since_date)
-            logging.info(f"Fetched {len(items)} items for {entity_name}")
-            
-            for item in items:
-                await sync.upsert_entity(entity_name, item)
+            synced = await sync.stream_entity(entity_name, since_date)
+            logging.info(f"Fetched and wrote {synced} items for {entity_name}")
             
             logging.info(f"Successfully synced {entity_name}")
         else:
@@ -61,6 +72,8 @@ async def main():
             
     except Exception as e:
         logging.error(f"Error during synchronization: {str(e)}")
+    finally:
+        await sync.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
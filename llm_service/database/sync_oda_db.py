@@ -2,13 +2,56 @@ from sqlalchemy import create_engine, text
 from datetime import datetime
 import logging
 import httpx
-from typing import List, Dict, Any, Optional
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple
+from collections import deque
+from contextvars import ContextVar
 import asyncio
+import io
+import time
+
+# HTTP counters of the entity sync running in the current task, next to the
+# client-wide ones; concurrent entity syncs share one client
+entity_http_stats: ContextVar[Optional[Dict[str, int]]] = ContextVar("entity_http_stats", default=None)
+
+
+def new_http_stats() -> Dict[str, int]:
+    return {"requests": 0, "connections_opened": 0, "tls_handshakes": 0}
+
+
+def copy_field(value: Any) -> str:
+    """A value in COPY's CSV format; NULL is the only unquoted empty field"""
+    if value is None:
+        return ''
+    return '"' + str(value).replace('"', '""') + '"'
+
 
 class OdaDbSync:
-    def __init__(self, db_url: str, oda_base_url: str = "https://oda.ft.dk/api"):
+    def __init__(
+        self,
+        db_url: str,
+        oda_base_url: str = "https://oda.ft.dk/api",
+        write_batch_size: int = 5000,
+        page_size: int = 100,
+        fetch_concurrency: int = 8,
+        queue_pages: int = 50,
+        max_connections: int = 32,
+        http2: bool = False,
+    ):
         self.engine = create_engine(db_url)
         self.oda_base_url = oda_base_url
+        # ODA serves at most 100 rows per request; pages are fetched with
+        # up to fetch_concurrency requests in flight
+        self.page_size = page_size
+        self.fetch_concurrency = max(1, fetch_concurrency)
+        # Fetched pages waiting for the database writer in stream_entity
+        self.queue_pages = max(1, queue_pages)
+        # One pooled keep-alive client for all API calls of the run, see client
+        self.max_connections = max_connections
+        self.http2 = http2
+        self._client: Optional[httpx.AsyncClient] = None
+        self.http_stats = new_http_stats()
+        # Rows merged per staging table and transaction by upsert_entities
+        self.write_batch_size = write_batch_size
         # Define foreign key relationships
         self.foreign_key_mappings = {
             'MødeAktør': {
@@ -77,6 +120,17 @@ class OdaDbSync:
             # Final level
             'Sambehandlinger': 'sambehandlinger'
         }
+        # Column names and types per table, loaded once per run, and one
+        # compiled upsert statement per table and column set
+        self.columns_cache: Dict[str, List[tuple]] = {}
+        self.column_lookup: Dict[str, Dict[str, Tuple[str, str]]] = {}
+        self.upsert_statements: Dict[Tuple[str, Tuple[str, ...]], Any] = {}
+        self.schema_stats = {
+            "catalog_queries": 0,
+            "catalog_seconds": 0.0,
+            "statements_compiled": 0,
+            "statements_reused": 0,
+        }
 
     async def get_last_sync_date(self, entity_name: str) -> Optional[datetime]:
         table_name = self.entity_mappings.get(entity_name)
@@ -92,57 +146,173 @@ class OdaDbSync:
             result = conn.execute(query).scalar()
             return result
 
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """The HTTP client shared by all entity syncs, created on first use and closed by close()"""
+        if self._client is None:
+            http2 = self.http2
+            if http2:
+                try:
+                    import h2  # noqa: F401
+                except ImportError:
+                    logging.warning("HTTP/2 needs the h2 package (httpx[http2]); using HTTP/1.1")
+                    http2 = False
+            self._client = httpx.AsyncClient(
+                timeout=30.0,
+                http2=http2,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                    keepalive_expiry=60.0,
+                ),
+                headers={"Accept-Encoding": "gzip"},
+            )
+        return self._client
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        logging.info(self.http_summary())
+
+    async def __aenter__(self) -> "OdaDbSync":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    def count_http(self, counter: str) -> None:
+        self.http_stats[counter] += 1
+        stats = entity_http_stats.get()
+        if stats is not None:
+            stats[counter] += 1
+
+    async def trace_http(self, event_name: str, info: Dict[str, Any]) -> None:
+        # httpcore reports connection setup only for requests that open a connection
+        if event_name == "connection.connect_tcp.complete":
+            self.count_http("connections_opened")
+        elif event_name == "connection.start_tls.complete":
+            self.count_http("tls_handshakes")
+
+    async def get(self, url: str, params: Optional[Dict[str, Any]] = None) -> httpx.Response:
+        self.count_http("requests")
+        return await self.client.get(url, params=params, extensions={"trace": self.trace_http})
+
+    def http_summary(self, stats: Optional[Dict[str, int]] = None) -> str:
+        """Client-wide HTTP counters, or `stats` of one entity sync"""
+        stats = stats if stats is not None else self.http_stats
+        return (
+            f"HTTP requests: {stats['requests']}, connections opened: {stats['connections_opened']}, "
+            f"TLS handshakes: {stats['tls_handshakes']}, "
+            f"requests on reused connections: {stats['requests'] - stats['connections_opened']}"
+        )
+
     async def fetch_oda_data(self, entity_name: str, since_date: Optional[datetime] = None) -> List[Dict[str, Any]]:
         """Fetch data from ODA API"""
         all_items = []
-        batch_size = 100
-        skip = 0
-        
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            while True:
-                try:
-                    # First try without any filtering
-                    params = {
-                        "$top": batch_size,
-                        "$skip": skip,
-                        "$orderby": "opdateringsdato"
-                    }
-                    
-                    if since_date:
-                        formatted_date = since_date.strftime('%Y-%m-%dT%H:%M:%S')
-                        params["$filter"] = f"opdateringsdato gt datetime'{formatted_date}'"
-                    
-                    url = f"{self.oda_base_url}/{entity_name}"
-                    response = await client.get(url, params=params)
-                    response.raise_for_status()
-                    
-                    # Get the response content
-                    content = response.json()
-                    
-                    # Handle both possible response formats
-                    if 'value' in content:
-                        items = content['value']
-                    elif 'd' in content:
-                        items = content['d']
-                    else:
-                        items = []
-                    
-                    all_items.extend(items)
-                    
-                    # Check if there's a next page
-                    if 'odata.nextLink' in content:
-                        skip += batch_size
-                    else:
-                        break
-                        
-                except Exception as e:
-                    logging.error(f"Error fetching {entity_name} from ODA API: {str(e)}")
-                    raise
-
+        async for items in self.iter_oda_pages(entity_name, since_date):
+            all_items.extend(items)
         return all_items
 
+    async def fetch_page(self, url: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        response = await self.get(url, params=params)
+        response.raise_for_status()
+        return response.json()
+
+    @staticmethod
+    def page_items(content: Dict[str, Any]) -> List[Dict[str, Any]]:
+        # Handle both possible response formats
+        if 'value' in content:
+            return content['value']
+        elif 'd' in content:
+            return content['d']
+        return []
+
+    async def iter_oda_pages(
+        self, entity_name: str, since_date: Optional[datetime] = None
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Yield the pages of an entity in order. The first page also asks for
+        the total count ($inlinecount); the remaining pages are then
+        requested with up to fetch_concurrency requests in flight. Pages
+        beyond the count, for rows added during the sync, are followed
+        one at a time through odata.nextLink.
+        """
+        url = f"{self.oda_base_url}/{entity_name}"
+        # id breaks ties so that $skip pages neither overlap nor leave gaps
+        base_params = {"$top": self.page_size, "$orderby": "opdateringsdato,id"}
+        if since_date:
+            formatted_date = since_date.strftime('%Y-%m-%dT%H:%M:%S')
+            base_params["$filter"] = f"opdateringsdato gt datetime'{formatted_date}'"
+
+        pending: deque = deque()
+        try:
+            content = await self.fetch_page(url, {**base_params, "$skip": 0, "$inlinecount": "allpages"})
+            yield self.page_items(content)
+            total = int(content.get('odata.count', 0))
+
+            skips = iter(range(self.page_size, total, self.page_size))
+            skip = 0
+            for skip in skips:
+                pending.append(asyncio.create_task(
+                    self.fetch_page(url, {**base_params, "$skip": skip})
+                ))
+                if len(pending) >= self.fetch_concurrency:
+                    break
+            while pending:
+                content = await pending.popleft()
+                next_skip = next(skips, None)
+                if next_skip is not None:
+                    pending.append(asyncio.create_task(
+                        self.fetch_page(url, {**base_params, "$skip": next_skip})
+                    ))
+                    skip = next_skip
+                yield self.page_items(content)
+
+            while 'odata.nextLink' in content:
+                skip += self.page_size
+                content = await self.fetch_page(url, {**base_params, "$skip": skip})
+                yield self.page_items(content)
+        except Exception as e:
+            logging.error(f"Error fetching {entity_name} from ODA API: {str(e)}")
+            raise
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def load_schema(self) -> None:
+        """Load column names and types of all tables in entity_mappings with one catalog query"""
+        query = text("""
+            SELECT TABLE_NAME, COLUMN_NAME, DATA_TYPE
+            FROM INFORMATION_SCHEMA.COLUMNS
+            ORDER BY TABLE_NAME, ORDINAL_POSITION
+        """)
+
+        started = time.perf_counter()
+        with self.engine.connect() as conn:
+            result = conn.execute(query).fetchall()
+        self.schema_stats["catalog_queries"] += 1
+        self.schema_stats["catalog_seconds"] += time.perf_counter() - started
+
+        # Table names are matched case-insensitively, as with ILIKE
+        columns_by_table: Dict[str, List[tuple]] = {}
+        for table, column, data_type in result:
+            columns_by_table.setdefault(table.lower(), []).append((column, data_type))
+        for table_name in self.entity_mappings.values():
+            self.cache_columns(table_name, columns_by_table.get(table_name.replace('"', '').lower(), []))
+        logging.debug(f"Loaded columns of {len(self.columns_cache)} tables")
+
+    def cache_columns(self, table_name: str, columns: List[tuple]) -> None:
+        self.columns_cache[table_name] = columns
+        self.column_lookup[table_name] = {column.lower(): (column, data_type) for column, data_type in columns}
+
     async def get_columns_info(self, table_name: str) -> List[tuple]:
-        """Get column information from the database schema"""
+        """Get column information from the database schema, cached for the run"""
+        if not self.columns_cache:
+            await self.load_schema()
+        if table_name in self.columns_cache:
+            return self.columns_cache[table_name]
+
         # Remove quotes from table_name for the query
         clean_table_name = table_name.replace('"', '')
         
@@ -152,10 +322,89 @@ class OdaDbSync:
             WHERE TABLE_NAME ILIKE :table_name
         """)
         
+        started = time.perf_counter()
         with self.engine.connect() as conn:
             result = conn.execute(query, {"table_name": clean_table_name}).fetchall()
             logging.debug(f"Columns for {table_name}: {result}")
-            return result
+        self.schema_stats["catalog_queries"] += 1
+        self.schema_stats["catalog_seconds"] += time.perf_counter() - started
+        self.cache_columns(table_name, result)
+        return result
+
+    def upsert_statement(self, table_name: str, columns: Tuple[str, ...]):
+        """The INSERT ... ON CONFLICT statement for a table and column set, compiled once"""
+        key = (table_name, columns)
+        statement = self.upsert_statements.get(key)
+        if statement is not None:
+            self.schema_stats["statements_reused"] += 1
+            return statement
+
+        insert_columns = ', '.join([f'"{col}"' for col in columns])
+        insert_values = ', '.join([f":{col}" for col in columns])
+        statement = text(f"""
+            INSERT INTO {table_name} ({insert_columns})
+            VALUES ({insert_values})
+            {self.conflict_clause(table_name, columns)};
+        """)
+        self.upsert_statements[key] = statement
+        self.schema_stats["statements_compiled"] += 1
+        return statement
+
+    def schema_summary(self, rows: int) -> str:
+        """What the schema and statement caches saved, estimated from the catalog queries made"""
+        stats = self.schema_stats
+        per_query = stats["catalog_seconds"] / max(1, stats["catalog_queries"])
+        return (
+            f"Catalog queries so far: {stats['catalog_queries']} "
+            f"(~{per_query * rows:.1f}s saved over one per row); "
+            f"upsert statements compiled: {stats['statements_compiled']}, reused: {stats['statements_reused']}"
+        )
+
+    def conflict_clause(self, table_name: str, columns: Tuple[str, ...]) -> str:
+        """ON CONFLICT clause under which a stored row only takes values from a record that is not older"""
+        update_columns = ', '.join([f'"{col}" = EXCLUDED."{col}"' 
+                                  for col in columns 
+                                  if col.lower() != 'id'])
+        
+        # Ensure we have update columns
+        if not update_columns:
+            update_columns = '"opdateringsdato" = EXCLUDED."opdateringsdato"'  # Fallback update
+        
+        # Add condition to only update if the new opdateringsdato is later
+        update_condition = (
+            f'{table_name}."opdateringsdato" IS NULL '
+            f'OR EXCLUDED."opdateringsdato" >= {table_name}."opdateringsdato"'
+        )
+        
+        return f"""ON CONFLICT (id) DO UPDATE SET
+            {update_columns}
+            WHERE {update_condition}"""
+
+    async def prepare_upsert(self, entity_name: str, data: Dict[str, Any]) -> Tuple[Any, Dict[str, Any]]:
+        """The upsert statement and cast parameters for one API record"""
+        table_name = self.entity_mappings.get(entity_name)
+        if not table_name:
+            raise ValueError(f"Unknown entity: {entity_name}")
+
+        columns_info = await self.get_columns_info(table_name)
+        column_lookup = self.column_lookup[table_name]
+
+        # Look up the API field names in a case-insensitive way and cast
+        # values to their corresponding data types, in column order
+        values = {}
+        for api_field, value in data.items():
+            column = column_lookup.get(api_field.lower())
+            if column is not None and value is not None:
+                values[column[0]] = value
+        casted_data = {
+            col: self.cast_value(col_type, values[col]) for col, col_type in columns_info if col in values
+        }
+
+        # Validate that we have data to insert
+        if not casted_data:
+            raise ValueError(f"No valid data to insert for {entity_name}")
+
+        return self.upsert_statement(table_name, tuple(casted_data)), casted_data
 
     async def has_identity_column(self, table_name: str) -> Optional[str]:
         """Check if table has an identity column in PostgreSQL"""
@@ -182,20 +431,19 @@ class OdaDbSync:
 
     async def fetch_single_entity(self, entity_name: str, entity_id: int) -> Optional[Dict[str, Any]]:
         """Fetch a single entity by ID from ODA API"""
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            try:
-                url = f"{self.oda_base_url}/{entity_name}({entity_id})"
-                response = await client.get(url)
-                response.raise_for_status()
-                
-                content = response.json()
-                if 'd' in content:
-                    return content['d']
-                return content
-                
-            except Exception as e:
-                logging.error(f"Error fetching single {entity_name} with ID {entity_id}: {str(e)}")
-                return None
+        try:
+            url = f"{self.oda_base_url}/{entity_name}({entity_id})"
+            response = await self.get(url)
+            response.raise_for_status()
+            
+            content = response.json()
+            if 'd' in content:
+                return content['d']
+            return content
+            
+        except Exception as e:
+            logging.error(f"Error fetching single {entity_name} with ID {entity_id}: {str(e)}")
+            return None
 
     async def ensure_foreign_key_exists(self, foreign_table: str, foreign_key: str, foreign_id: int) -> bool:
         """Ensure a foreign key exists, fetching it from the API if necessary"""
@@ -230,6 +478,19 @@ class OdaDbSync:
                     f"(required for {entity_name}.{fk_column})"
                 )
 
+    async def ensure_dependencies(self, entity_name: str, data: Dict[str, Any]) -> None:
+        """Handle foreign key dependencies"""
+        if entity_name == "MødeAktør":
+            aktørid = data.get("aktørid")
+            if not await self.ensure_foreign_key_exists("Aktør", "id", aktørid):
+                logging.error(f"Could not ensure Aktør with ID {aktørid} exists")
+                raise ValueError(f"Required Aktør with ID {aktørid} could not be fetched")
+            
+            mødeid = data.get("mødeid")
+            if not await self.ensure_foreign_key_exists("Møde", "id", mødeid):
+                logging.error(f"Could not ensure Møde with ID {mødeid} exists")
+                raise ValueError(f"Required Møde with ID {mødeid} could not be fetched")
+
     async def upsert_entity(self, entity_name: str, data: Dict[str, Any]) -> None:
         """Upsert an entity into the database using INSERT ... ON CONFLICT"""
         try:
@@ -237,69 +498,13 @@ class OdaDbSync:
             if not table_name:
                 raise ValueError(f"Unknown entity: {entity_name}")
 
-            # Handle foreign key dependencies
-            if entity_name == "MødeAktør":
-                aktørid = data.get("aktørid")
-                if not await self.ensure_foreign_key_exists("Aktør", "id", aktørid):
-                    logging.error(f"Could not ensure Aktør with ID {aktørid} exists")
-                    raise ValueError(f"Required Aktør with ID {aktørid} could not be fetched")
-                
-                mødeid = data.get("mødeid")
-                if not await self.ensure_foreign_key_exists("Møde", "id", mødeid):
-                    logging.error(f"Could not ensure Møde with ID {mødeid} exists")
-                    raise ValueError(f"Required Møde with ID {mødeid} could not be fetched")
+            await self.ensure_dependencies(entity_name, data)
 
             # Debug log the incoming data
             logging.debug(f"Upserting data for {entity_name}: {data}")
 
-            columns_info = await self.get_columns_info(table_name)
-            logging.debug(f"Columns for {table_name}: {columns_info}")
-            
-            # Create a case-insensitive mapping of API fields to DB columns
-            column_mapping = {col[0].lower(): col[0] for col in columns_info}
-            
-            # Cast values to their corresponding data types
-            casted_data = {}
-            for col, col_type in columns_info:
-                # Look up the API field name in a case-insensitive way
-                api_value = None
-                for api_field, value in data.items():
-                    if api_field.lower() == col.lower():
-                        api_value = value
-                        break
-                
-                if api_value is not None:
-                    casted_data[col] = self.cast_value(col_type, api_value)
-            
-            # Validate that we have data to insert
-            if not casted_data:
-                raise ValueError(f"No valid data to insert for {entity_name}")
-            
-            # Debug log the processed data
-            logging.debug(f"Processed data for {entity_name}: {casted_data}")
-            
-            # Generate the INSERT ... ON CONFLICT query components
-            insert_columns = ', '.join([f'"{col}"' for col in casted_data.keys()])
-            insert_values = ', '.join([f":{col}" for col in casted_data.keys()])
-            update_columns = ', '.join([f'"{col}" = EXCLUDED."{col}"' 
-                                      for col in casted_data.keys() 
-                                      if col.lower() not in ['id', 'opdateringsdato']])
-            
-            # Ensure we have update columns
-            if not update_columns:
-                update_columns = '"opdateringsdato" = EXCLUDED."opdateringsdato"'  # Fallback update
-            
-            # Add condition to only update if the new opdateringsdato is later
-            update_condition = f'{table_name}."opdateringsdato" = GREATEST(EXCLUDED."opdateringsdato", {table_name}."opdateringsdato")'
-            
-            upsert_query = text(f"""
-                INSERT INTO {table_name} ({insert_columns})
-                VALUES ({insert_values})
-                ON CONFLICT (id) DO UPDATE SET
-                {update_columns}
-                WHERE {update_condition};
-            """)
-            
+            upsert_query, casted_data = await self.prepare_upsert(entity_name, data)
+
             # Debug log the SQL query
             logging.debug(f"Executing query: {upsert_query}\nWith parameters: {casted_data}")
             
@@ -311,6 +516,125 @@ class OdaDbSync:
             logging.error(f"Error upserting to {entity_name}: {str(e)}")
             raise
 
+    async def upsert_entities(self, entity_name: str, items: List[Dict[str, Any]]) -> None:
+        """
+        Upsert many records, write_batch_size at a time: each batch is
+        COPY'd into a temporary staging table and merged into the table with
+        one INSERT ... SELECT ... ON CONFLICT, in one transaction. Stored
+        rows only take values from records that are not older, as with
+        upsert_entity.
+        """
+        for start in range(0, len(items), self.write_batch_size):
+            await self.merge_batch(entity_name, items[start:start + self.write_batch_size])
+
+    async def merge_batch(self, entity_name: str, items: List[Dict[str, Any]]) -> None:
+        table_name = self.entity_mappings.get(entity_name)
+        if not table_name:
+            raise ValueError(f"Unknown entity: {entity_name}")
+
+        # Records with the same set of non-null fields share a staging table.
+        # One statement cannot update a row twice, so only the newest record
+        # of every id is kept.
+        groups: Dict[Tuple[str, ...], Dict[Any, Dict[str, Any]]] = {}
+        for item in items:
+            await self.ensure_dependencies(entity_name, item)
+            _, casted_data = await self.prepare_upsert(entity_name, item)
+            rows = groups.setdefault(tuple(casted_data), {})
+            previous = rows.get(casted_data.get('id'))
+            if previous is None or str(previous.get('opdateringsdato') or '') <= str(
+                casted_data.get('opdateringsdato') or ''
+            ):
+                rows[casted_data.get('id')] = casted_data
+
+        try:
+            # In a thread, so that pages keep being fetched during the write
+            await asyncio.to_thread(self.write_groups, table_name, groups)
+        except Exception as e:
+            logging.error(f"Error merging {len(items)} records into {entity_name}: {str(e)}")
+            raise
+
+    def write_groups(self, table_name: str, groups: Dict[Tuple[str, ...], Dict[Any, Dict[str, Any]]]) -> None:
+        with self.engine.begin() as conn:
+            for number, (columns, rows) in enumerate(groups.items()):
+                self.merge_rows(conn, table_name, f"staging_{number}", columns, list(rows.values()))
+
+    def merge_rows(self, conn, table_name: str, staging: str, columns: Tuple[str, ...],
+                   rows: List[Dict[str, Any]]) -> None:
+        column_list = ', '.join([f'"{col}"' for col in columns])
+        # Only the needed columns, with the table's types and without its constraints
+        conn.execute(text(
+            f"CREATE TEMPORARY TABLE {staging} ON COMMIT DROP AS "
+            f"SELECT {column_list} FROM {table_name} WITH NO DATA"
+        ))
+
+        cursor = conn.connection.cursor()
+        try:
+            if hasattr(cursor, 'copy_expert'):
+                buffer = io.StringIO()
+                for row in rows:
+                    buffer.write(','.join([copy_field(row[col]) for col in columns]))
+                    buffer.write('\n')
+                buffer.seek(0)
+                cursor.copy_expert(f"COPY {staging} ({column_list}) FROM STDIN WITH (FORMAT csv)", buffer)
+            else:
+                # Drivers without COPY insert the rows with executemany
+                values = ', '.join([f":{col}" for col in columns])
+                conn.execute(text(f"INSERT INTO {staging} ({column_list}) VALUES ({values})"), rows)
+        finally:
+            cursor.close()
+
+        conn.execute(text(f"""
+            INSERT INTO {table_name} ({column_list})
+            SELECT {column_list} FROM {staging}
+            {self.conflict_clause(table_name, columns)}
+        """))
+
+    async def stream_entity(self, entity_name: str, since_date: Optional[datetime] = None) -> int:
+        """
+        Fetch and write an entity page by page; returns the number of
+        records written. Pages go from the fetcher to the writer through a
+        queue of at most queue_pages, and are merged write_batch_size
+        records at a time, so memory stays bounded however large the
+        entity is, and fetching overlaps writing.
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_pages)
+        end = None
+
+        async def fetch():
+            # No end marker when cancelled: the writer has stopped and the queue may be full
+            try:
+                async for items in self.iter_oda_pages(entity_name, since_date):
+                    await queue.put(items)
+            except Exception:
+                await queue.put(end)
+                raise
+            await queue.put(end)
+
+        fetcher = asyncio.create_task(fetch())
+        written = 0
+        batch: List[Dict[str, Any]] = []
+        try:
+            while True:
+                items = await queue.get()
+                if items is end:
+                    break
+                batch.extend(items)
+                if len(batch) >= self.write_batch_size:
+                    await self.merge_batch(entity_name, batch)
+                    written += len(batch)
+                    batch = []
+                    logging.debug(f"Wrote {written} {entity_name} records, {queue.qsize()} pages queued")
+            if batch:
+                await self.merge_batch(entity_name, batch)
+                written += len(batch)
+            # Raises if fetching failed
+            await fetcher
+        finally:
+            # The writer may have failed or been cancelled with the fetcher blocked on a full queue
+            fetcher.cancel()
+            await asyncio.gather(fetcher, return_exceptions=True)
+        return written
+
     async def sync_entity(self, entity_name: str, since_date: Optional[datetime] = None) -> None:
         """Synchronize a single entity from ODA API to local database"""
         table_name = self.entity_mappings.get(entity_name)
@@ -323,12 +647,21 @@ class OdaDbSync:
 
             logging.info(f"Starting sync for {entity_name} since {since_date}")
             
-            items = await self.fetch_oda_data(entity_name, since_date)
-            
-            for item in items:
-                await self.upsert_entity(entity_name, item)
+            started = time.perf_counter()
+            # Counted for this entity only; its fetch tasks inherit the context
+            http_stats = new_http_stats()
+            token = entity_http_stats.set(http_stats)
+            try:
+                synced = await self.stream_entity(entity_name, since_date)
+            finally:
+                entity_http_stats.reset(token)
+            elapsed = time.perf_counter() - started
             
-            logging.info(f"Completed sync for {entity_name}. Synced {len(items)} items.")
+            logging.info(
+                f"Completed sync for {entity_name}. Synced {synced} items in {elapsed:.1f}s "
+                f"({synced / max(elapsed, 1e-9):.0f}/s). "
+                f"{self.schema_summary(synced)}. {self.http_summary(http_stats)}"
+            )
             
         except Exception as e:
             logging.error(f"Error during sync of {entity_name}: {str(e)}")
@@ -0,0 +1,128 @@
+from typing import Dict, List, Optional, Sequence
+import time
+import torch
+
+
+def mean_pool(last_hidden_state: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+    """Mean-pool token embeddings, ignoring padding positions"""
+    mask = attention_mask.unsqueeze(-1).to(last_hidden_state.dtype)
+    summed = (last_hidden_state * mask).sum(dim=1)
+    counts = mask.sum(dim=1).clamp(min=1e-9)
+    return summed / counts
+
+
+def bucket_batches(
+    lengths: Sequence[int], max_batch_size: int, max_batch_tokens: int
+) -> List[List[int]]:
+    """
+    Group sequence indices into mini-batches of similar length. Indices are
+    sorted by token count so each batch pads to a tight maximum, and a batch
+    is closed once it would exceed `max_batch_size` sequences or
+    `max_batch_tokens` padded tokens.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    batches = []
+    current: List[int] = []
+
+    for idx in order:
+        # Lengths are ascending, so this sequence sets the padded width
+        padded_tokens = lengths[idx] * (len(current) + 1)
+        if current and (
+            len(current) >= max_batch_size or padded_tokens > max_batch_tokens
+        ):
+            batches.append(current)
+            current = []
+        current.append(idx)
+
+    if current:
+        batches.append(current)
+
+    return batches
+
+
+def embed_features(
+    model,
+    tokenizer,
+    features: Sequence[Dict[str, List[int]]],
+    max_batch_size: int = 16,
+    max_batch_tokens: int = 8192,
+    profile: Optional[Dict] = None,
+) -> List[List[float]]:
+    """
+    Embed already tokenized inputs (one dict of model inputs per sequence)
+    with length-bucketed, padded forward passes and return one mean-pooled
+    vector per sequence, in input order. If `profile` is given, forward and
+    pooling time, token count and batch sizes are accumulated into it.
+    """
+    lengths = [len(f["input_ids"]) for f in features]
+    embeddings: List[List[float]] = [[] for _ in features]
+    if profile is None:
+        profile = {}
+
+    for batch in bucket_batches(lengths, max_batch_size, max_batch_tokens):
+        started = time.perf_counter()
+        inputs = tokenizer.pad([features[i] for i in batch], return_tensors="pt")
+        with torch.no_grad():
+            outputs = model(**inputs)
+        pooling_started = time.perf_counter()
+
+        pooled = mean_pool(outputs.last_hidden_state, inputs["attention_mask"])
+        for idx, vector in zip(batch, pooled.tolist()):
+            embeddings[idx] = vector
+
+        finished = time.perf_counter()
+        profile["forward"] = profile.get("forward", 0.0) + pooling_started - started
+        profile["pooling"] = profile.get("pooling", 0.0) + finished - pooling_started
+        profile["tokens"] = profile.get("tokens", 0) + sum(lengths[i] for i in batch)
+        profile.setdefault("batch_sizes", []).append(len(batch))
+
+    return embeddings
+
+
+def embed_texts(
+    model,
+    tokenizer,
+    texts: Sequence[str],
+    max_batch_size: int = 16,
+    max_batch_tokens: int = 8192,
+    max_length: int = 512,
+    profile: Optional[Dict] = None,
+) -> List[List[float]]:
+    """Tokenize `texts` in one call and embed them, in input order"""
+    if not texts:
+        return []
+
+    # Tokenize everything in one call without padding; padding is per batch
+    started = time.perf_counter()
+    encodings = tokenizer(list(texts), truncation=True, max_length=max_length)
+    features = [
+        {key: encodings[key][i] for key in encodings.keys()} for i in range(len(texts))
+    ]
+    if profile is not None:
+        profile["tokenize"] = profile.get("tokenize", 0.0) + time.perf_counter() - started
+    return embed_features(model, tokenizer, features, max_batch_size, max_batch_tokens, profile)
+
+
+def embed_token_ids(
+    model,
+    tokenizer,
+    token_ids: Sequence[List[int]],
+    max_batch_size: int = 16,
+    max_batch_tokens: int = 8192,
+    profile: Optional[Dict] = None,
+) -> List[List[float]]:
+    """
+    Embed sequences given as token ids without special tokens (e.g. chunks
+    from `chunk_document`), so the text is not tokenized a second time.
+    """
+    features = []
+    for ids in token_ids:
+        input_ids = [tokenizer.cls_token_id] + list(ids) + [tokenizer.sep_token_id]
+        features.append(
+            {
+                "input_ids": input_ids,
+                "token_type_ids": [0] * len(input_ids),
+                "attention_mask": [1] * len(input_ids),
+            }
+        )
+    return embed_features(model, tokenizer, features, max_batch_size, max_batch_tokens, profile)
@@ -0,0 +1,214 @@
+from array import array
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+
+Vector = List[float]
+
+# SQLite's default limit on host parameters in one statement is 999
+DISK_LOOKUP_BATCH = 500
+
+
+class OwnerCancelled(Exception):
+    """The request computing a shared entry was cancelled before it finished"""
+
+
+class EmbeddingCache:
+    """
+    Content-addressed cache of embeddings keyed by a hash of the model name
+    and the preprocessed text. Lookups go through a bounded in-memory LRU
+    and, when `db_path` is set, a persistent SQLite tier that survives
+    restarts. Concurrent requests for the same key share one computation.
+    The disk tier is read and written in batches off the event loop.
+    """
+
+    def __init__(self, model_name: str, max_entries: int = 10000, db_path: Optional[str] = None):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.memory: "OrderedDict[str, Vector]" = OrderedDict()
+        self.in_flight: Dict[str, asyncio.Future] = {}
+        self.counters = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "in_flight_waits": 0,
+        }
+
+        self.db: Optional[sqlite3.Connection] = None
+        self.db_lock = threading.Lock()
+        if db_path:
+            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+            self.db.commit()
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, vector: Vector) -> None:
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def get(self, key: str) -> Optional[Vector]:
+        """Look up the in-memory tier"""
+        vector = self.memory.get(key)
+        if vector is not None:
+            self.memory.move_to_end(key)
+            self.counters["hits"] += 1
+        return vector
+
+    def put(self, key: str, vector: Vector) -> None:
+        """Remember in the in-memory tier; see store_many for the disk tier"""
+        self._remember(key, vector)
+
+    def load_many(self, keys: Sequence[str]) -> Dict[str, Vector]:
+        """Read keys from the disk tier; blocking, run it in a thread"""
+        found: Dict[str, Vector] = {}
+        if self.db is None:
+            return found
+        with self.db_lock:
+            for start in range(0, len(keys), DISK_LOOKUP_BATCH):
+                batch = list(keys[start : start + DISK_LOOKUP_BATCH])
+                rows = self.db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+        return found
+
+    def store_many(self, items: Sequence[Tuple[str, Vector]]) -> None:
+        """Write entries to the disk tier in one transaction; blocking, run it in a thread"""
+        if self.db is None or not items:
+            return
+        with self.db_lock:
+            try:
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                    [(key, array("f", vector).tobytes()) for key, vector in items],
+                )
+                self.db.commit()
+            except sqlite3.Error as e:
+                logging.error(f"Error writing embedding cache: {str(e)}")
+
+    async def get_or_compute(self, text: str, compute: Callable[[str], Awaitable[Vector]]) -> Vector:
+        """Return the cached embedding for `text`, computing it at most once"""
+        vectors = await self.get_or_compute_many([text], lambda texts: _single(compute, texts))
+        return vectors[0]
+
+    async def get_or_compute_many(
+        self,
+        texts: Sequence[str],
+        compute_many: Callable[[List[str]], Awaitable[List[Vector]]],
+    ) -> List[Vector]:
+        """
+        Return embeddings for `texts` in order. Cached entries are served
+        directly, entries already being computed are awaited, and only the
+        remaining unique texts are passed to `compute_many` in one call.
+        """
+        results: List[Optional[Vector]] = [None] * len(texts)
+        waiting: Dict[int, asyncio.Future] = {}
+        owned: Dict[str, asyncio.Future] = {}
+
+        loop = asyncio.get_running_loop()
+        for i, text in enumerate(texts):
+            key = self.key(text)
+            vector = self.get(key)
+            if vector is not None:
+                results[i] = vector
+                continue
+
+            future = self.in_flight.get(key)
+            if future is None:
+                future = loop.create_future()
+                self.in_flight[key] = future
+                owned[key] = future
+            elif key not in owned:
+                self.counters["in_flight_waits"] += 1
+            waiting[i] = future
+
+        if owned:
+            try:
+                await self._resolve(texts, owned, compute_many)
+            except BaseException as e:
+                # Waiters of the same keys must not hang on futures nobody resolves
+                error = OwnerCancelled() if isinstance(e, asyncio.CancelledError) else e
+                for future in owned.values():
+                    if not future.done():
+                        future.set_exception(error)
+                        # Retrieve so waiters that never await do not log warnings
+                        future.exception()
+                raise
+            finally:
+                for key in owned:
+                    self.in_flight.pop(key, None)
+
+        retry: List[int] = []
+        for i, future in waiting.items():
+            try:
+                # Shielded, so cancelling this caller does not cancel the shared entry
+                results[i] = await asyncio.shield(future)
+            except OwnerCancelled:
+                retry.append(i)
+        if retry:
+            vectors = await self.get_or_compute_many([texts[i] for i in retry], compute_many)
+            for i, vector in zip(retry, vectors):
+                results[i] = vector
+
+        return results  # type: ignore[return-value]
+
+    async def _resolve(
+        self,
+        texts: Sequence[str],
+        owned: Dict[str, asyncio.Future],
+        compute_many: Callable[[List[str]], Awaitable[List[Vector]]],
+    ) -> None:
+        """Resolve owned entries from the disk tier, computing the rest"""
+        if self.db is not None:
+            for key, vector in (await asyncio.to_thread(self.load_many, list(owned))).items():
+                self._remember(key, vector)
+                self.counters["disk_hits"] += 1
+                owned[key].set_result(vector)
+
+        to_compute: Dict[str, str] = {}
+        for text in texts:
+            key = self.key(text)
+            if key in owned and not owned[key].done():
+                to_compute.setdefault(key, text)
+        if not to_compute:
+            return
+
+        self.counters["misses"] += len(to_compute)
+        vectors = await compute_many(list(to_compute.values()))
+        computed = list(zip(to_compute, vectors))
+        for key, vector in computed:
+            self._remember(key, vector)
+            owned[key].set_result(vector)
+        if self.db is not None:
+            await asyncio.to_thread(self.store_many, computed)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            **self.counters,
+            "entries": len(self.memory),
+            "max_entries": self.max_entries,
+            "in_flight": len(self.in_flight),
+        }
+
+    def close(self) -> None:
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+
+async def _single(compute: Callable[[str], Awaitable[Vector]], texts: List[str]) -> List[Vector]:
+    return [await compute(texts[0])]
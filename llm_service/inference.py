@@ -0,0 +1,173 @@
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import asyncio
+import logging
+import multiprocessing
+import os
+import torch
+from embedding import embed_texts, embed_token_ids
+from observability import record_profile
+from scheduler import INTERACTIVE, LaneScheduler
+
+# Set in the parent before the replica processes are forked, so every
+# replica inherits the same (shared-memory) weights instead of loading a copy
+_worker_model = None
+_worker_tokenizer = None
+_worker_limits = (16, 8192)
+
+
+def _init_replica(num_threads: Optional[int]) -> None:
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    # Tokenizer thread pools do not survive a fork; tokenize serially per replica
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+
+def _replica_ready() -> int:
+    return os.getpid()
+
+
+def _replica_embed(embed_fn: Callable, items: list) -> Tuple[List[List[float]], Dict]:
+    # Metrics live in the parent, so the stage timings travel back with the vectors
+    max_batch_size, max_batch_tokens = _worker_limits
+    profile: Dict = {}
+    vectors = embed_fn(
+        _worker_model,
+        _worker_tokenizer,
+        items,
+        max_batch_size=max_batch_size,
+        max_batch_tokens=max_batch_tokens,
+        profile=profile,
+    )
+    return vectors, profile
+
+
+class InferencePool:
+    """
+    Runs model inference off the event loop. With one replica inference runs
+    on a dedicated thread; with more, each replica is a forked worker process
+    that maps the parent's read-only weights from shared memory.
+
+    Inputs are cut into jobs of at most `max_batch_size` items, and each job
+    waits for a replica in its priority lane (see LaneScheduler), so
+    interactive requests get the next free replica even while a large bulk
+    document is being embedded, and bulk work holds at most
+    `bulk_max_workers` replicas.
+    """
+
+    def __init__(
+        self,
+        model,
+        tokenizer,
+        replicas: int = 1,
+        threads_per_replica: Optional[int] = None,
+        max_batch_size: int = 16,
+        max_batch_tokens: int = 8192,
+        bulk_max_workers: Optional[int] = None,
+    ):
+        global _worker_model, _worker_tokenizer, _worker_limits
+
+        self.model = model
+        self.tokenizer = tokenizer
+        self.replicas = max(1, replicas)
+        self.threads_per_replica = threads_per_replica
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.executor: Executor
+        self.scheduler = LaneScheduler(
+            self.replicas,
+            bulk_max_workers if bulk_max_workers is not None else max(1, self.replicas // 2),
+        )
+
+        if self.replicas == 1:
+            if threads_per_replica:
+                torch.set_num_threads(threads_per_replica)
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+            return
+
+        if isinstance(model, torch.nn.Module):
+            model.share_memory()
+        _worker_model = model
+        _worker_tokenizer = tokenizer
+        _worker_limits = (max_batch_size, max_batch_tokens)
+
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.replicas,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_replica,
+            initargs=(threads_per_replica,),
+        )
+        # A fork-context pool starts all replicas on the first submit; do that
+        # now, before the parent has run any inference on its own threads
+        self.executor.submit(_replica_ready).result()
+        logging.info(f"Started {self.replicas} inference replicas")
+
+    def _embed_sync(self, embed_fn: Callable, items: list) -> Tuple[List[List[float]], Dict]:
+        profile: Dict = {}
+        vectors = embed_fn(
+            self.model,
+            self.tokenizer,
+            items,
+            max_batch_size=self.max_batch_size,
+            max_batch_tokens=self.max_batch_tokens,
+            profile=profile,
+        )
+        return vectors, profile
+
+    async def _submit(self, lane: str, embed_fn: Callable, items: list) -> Tuple[List[List[float]], Dict]:
+        await self.scheduler.acquire(lane)
+        loop = asyncio.get_running_loop()
+        try:
+            if self.replicas == 1:
+                job = self.executor.submit(self._embed_sync, embed_fn, items)
+            else:
+                job = self.executor.submit(_replica_embed, embed_fn, items)
+        except BaseException:
+            self.scheduler.release(lane)
+            raise
+        # Free the slot when the job has really finished, not when the caller
+        # stops waiting: a started job keeps its replica busy either way
+        def finished(_) -> None:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(self.scheduler.release, lane)
+
+        job.add_done_callback(finished)
+        return await asyncio.wrap_future(job)
+
+    async def _run(self, embed_fn: Callable, items: Sequence, lane: str) -> List[List[float]]:
+        if not items:
+            return []
+
+        # Jobs of similar length pad little; they run on whichever replica is free
+        order = sorted(range(len(items)), key=lambda i: len(items[i]))
+        jobs = [order[i : i + self.max_batch_size] for i in range(0, len(order), self.max_batch_size)]
+        results = await asyncio.gather(
+            *[self._submit(lane, embed_fn, [items[i] for i in job]) for job in jobs]
+        )
+
+        vectors: List = [None] * len(items)
+        for job, (job_vectors, profile) in zip(jobs, results):
+            record_profile(profile)
+            for i, vector in zip(job, job_vectors):
+                vectors[i] = vector
+        return vectors
+
+    async def embed(self, texts: Sequence[str], lane: str = INTERACTIVE) -> List[List[float]]:
+        """Embed `texts` on the executor without blocking the event loop"""
+        return await self._run(embed_texts, texts, lane)
+
+    async def embed_token_ids(self, token_ids: Sequence[List[int]], lane: str = INTERACTIVE) -> List[List[float]]:
+        """Embed pre-tokenized sequences (without special tokens) on the executor"""
+        return await self._run(embed_token_ids, token_ids, lane)
+
+    def warm_up(self, embed_fn: Callable, items: list) -> None:
+        """Run `items` through the model once per replica before serving"""
+        if self.replicas == 1:
+            self._embed_sync(embed_fn, items)
+            return
+        futures = [self.executor.submit(_replica_embed, embed_fn, items) for _ in range(self.replicas)]
+        for future in futures:
+            future.result()
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
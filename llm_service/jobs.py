@@ -0,0 +1,338 @@
+from array import array
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple
+import asyncio
+import contextlib
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class DocumentJobs:
+    """
+    Background document embedding jobs. Submitted documents are stored in a
+    SQLite database at `db_path` and embedded by `workers` background tasks;
+    each finished mini-batch of chunks is written to disk at once, so
+    progress can be polled and results outlive the request and restarts.
+    Jobs are keyed by a hash of the model name and the document text, and
+    submitting a document that already has a queued, running or finished
+    job returns that job. Results are kept until they are collected: a
+    result is deleted `collected_retention_hours` after it was first
+    fetched (so a retried fetch still finds it), or on DELETE. As a safety
+    net against results nobody collects, finished and failed jobs are also
+    deleted `max_retention_days` after they finished. Job statuses report
+    the resulting `expires_at`. SQLite is only accessed from worker
+    threads, so the event loop never waits on disk.
+
+    `prepare(text)` cuts a document into chunks (with `text`, `start_char`,
+    `end_char` and `input_ids`) and runs in a thread; `embed_batches(chunks)`
+    yields (chunk indices, embeddings) per mini-batch.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        db_path: str,
+        prepare: Callable[[str], Sequence[Any]],
+        embed_batches: Callable[[Sequence[Any]], AsyncIterator[Tuple[List[int], List[List[float]]]]],
+        workers: int = 2,
+        max_queued: int = 100,
+        collected_retention_hours: float = 1.0,
+        max_retention_days: float = 30.0,
+    ):
+        self.model_name = model_name
+        self.prepare = prepare
+        self.embed_batches = embed_batches
+        self.workers = max(1, workers)
+        self.max_queued = max_queued
+        self.collected_retention_seconds = collected_retention_hours * 3600.0
+        self.max_retention_seconds = max_retention_days * 86400.0
+        self.queue: Optional[asyncio.Queue] = None
+        self.tasks: List[asyncio.Task] = []
+
+        self.db_lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                status TEXT NOT NULL,
+                text TEXT NOT NULL,
+                total_chunks INTEGER,
+                done_chunks INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                created_at REAL NOT NULL,
+                finished_at REAL,
+                collected_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_content_hash ON jobs (content_hash);
+            CREATE TABLE IF NOT EXISTS job_chunks (
+                job_id TEXT NOT NULL,
+                chunk_index INTEGER NOT NULL,
+                start_char INTEGER NOT NULL,
+                end_char INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                token_count INTEGER,
+                PRIMARY KEY (job_id, chunk_index)
+            );
+            """
+        )
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(job_chunks)")}
+        if "token_count" not in columns:
+            self.db.execute("ALTER TABLE job_chunks ADD COLUMN token_count INTEGER")
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(jobs)")}
+        if "collected_at" not in columns:
+            self.db.execute("ALTER TABLE jobs ADD COLUMN collected_at REAL")
+        self.db.commit()
+
+    def content_hash(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    async def _call(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run a function using the connection in a thread, one at a time"""
+
+        def locked():
+            with self.db_lock:
+                return fn(*args)
+
+        return await asyncio.to_thread(locked)
+
+    async def start(self) -> None:
+        """Start the workers and pick up jobs left unfinished by a previous run"""
+        self.queue = asyncio.Queue()
+        unfinished = await self._call(self._recover)
+        for job_id in unfinished:
+            self.queue.put_nowait(job_id)
+        if unfinished:
+            logging.info(f"Resuming {len(unfinished)} unfinished embedding jobs")
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        await self._call(self.db.close)
+
+    async def submit(self, text: str) -> Tuple[Dict[str, Any], bool]:
+        """Queue `text` for embedding; returns (job status, whether it already existed)"""
+        assert self.queue is not None, "DocumentJobs.start() has not been called"
+        job, duplicate = await self._call(self._find_or_insert, self.content_hash(text), text, self.queue.qsize())
+        if not duplicate:
+            self.queue.put_nowait(job["job_id"])
+        return job, duplicate
+
+    async def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await self._call(self._status, job_id)
+
+    async def result(self, job_id: str) -> Tuple[str, List[str], List[List[float]], List[Optional[int]]]:
+        """
+        Original text, chunk texts, embeddings and token counts of a finished
+        job, in chunk order; the first fetch marks the result collected
+        """
+        return await self._call(self._result, job_id)
+
+    async def delete(self, job_id: str) -> bool:
+        return await self._call(self._delete, job_id)
+
+    async def stats(self) -> Dict[str, Any]:
+        counts = await self._call(
+            lambda: dict(self.db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        )
+        return {
+            "workers": self.workers,
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+            "max_queued": self.max_queued,
+            "jobs": counts,
+        }
+
+    # The methods below block on SQLite; they are run through _call
+
+    def _recover(self) -> List[str]:
+        self._prune()
+        unfinished = [
+            row[0]
+            for row in self.db.execute(
+                "SELECT id FROM jobs WHERE status IN (?, ?) ORDER BY created_at", (QUEUED, RUNNING)
+            )
+        ]
+        for job_id in unfinished:
+            self._reset(job_id)
+        return unfinished
+
+    def _find_or_insert(self, content_hash: str, text: str, queued: int) -> Tuple[Dict[str, Any], bool]:
+        row = self.db.execute(
+            "SELECT id FROM jobs WHERE content_hash = ? AND status != ? ORDER BY created_at DESC LIMIT 1",
+            (content_hash, FAILED),
+        ).fetchone()
+        if row is not None:
+            return self._status(row[0]), True  # type: ignore[return-value]
+
+        if queued >= self.max_queued:
+            raise JobQueueFull(f"{queued} jobs are already queued")
+
+        job_id = uuid.uuid4().hex
+        self.db.execute(
+            "INSERT INTO jobs (id, content_hash, status, text, created_at) VALUES (?, ?, ?, ?, ?)",
+            (job_id, content_hash, QUEUED, text, time.time()),
+        )
+        self.db.commit()
+        return self._status(job_id), False  # type: ignore[return-value]
+
+    def _status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self.db.execute(
+            "SELECT status, total_chunks, done_chunks, error, created_at, finished_at, collected_at"
+            " FROM jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        status, total_chunks, done_chunks, error, created_at, finished_at, collected_at = row
+        expires_at = None
+        if finished_at is not None:
+            expires_at = finished_at + self.max_retention_seconds
+            if collected_at is not None:
+                expires_at = min(expires_at, collected_at + self.collected_retention_seconds)
+        return {
+            "job_id": job_id,
+            "status": status,
+            "total_chunks": total_chunks,
+            "done_chunks": done_chunks,
+            "progress": done_chunks / total_chunks if total_chunks else 0.0,
+            "error": error,
+            "created_at": created_at,
+            "finished_at": finished_at,
+            "collected_at": collected_at,
+            "expires_at": expires_at,
+        }
+
+    def _result(self, job_id: str) -> Tuple[str, List[str], List[List[float]], List[Optional[int]]]:
+        (text,) = self.db.execute("SELECT text FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        rows = self.db.execute(
+            "SELECT text, vector, token_count FROM job_chunks WHERE job_id = ? ORDER BY chunk_index", (job_id,)
+        ).fetchall()
+        self.db.execute(
+            "UPDATE jobs SET collected_at = COALESCE(collected_at, ?) WHERE id = ?", (time.time(), job_id)
+        )
+        self.db.commit()
+        return (
+            text,
+            [row[0] for row in rows],
+            [array("f", row[1]).tolist() for row in rows],
+            [row[2] for row in rows],
+        )
+
+    def _delete(self, job_id: str) -> bool:
+        deleted = self.db.execute("DELETE FROM jobs WHERE id = ?", (job_id,)).rowcount
+        self.db.execute("DELETE FROM job_chunks WHERE job_id = ?", (job_id,))
+        self.db.commit()
+        return deleted > 0
+
+    def _prune(self) -> None:
+        """Drop collected results once retried fetches are unlikely, and anything past the safety net"""
+        now = time.time()
+        expired = [
+            row[0]
+            for row in self.db.execute(
+                "SELECT id FROM jobs WHERE collected_at < ? OR (status IN (?, ?) AND finished_at < ?)",
+                (now - self.collected_retention_seconds, DONE, FAILED, now - self.max_retention_seconds),
+            )
+        ]
+        for job_id in expired:
+            self._delete(job_id)
+
+    def _reset(self, job_id: str) -> None:
+        self.db.execute("DELETE FROM job_chunks WHERE job_id = ?", (job_id,))
+        self.db.execute(
+            "UPDATE jobs SET status = ?, total_chunks = NULL, done_chunks = 0 WHERE id = ?", (QUEUED, job_id)
+        )
+        self.db.commit()
+
+    async def _worker(self) -> None:
+        assert self.queue is not None
+        while True:
+            job_id = await self.queue.get()
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Embedding job {job_id} failed: {str(e)}")
+                await self._call(self._finish, job_id, FAILED, str(e))
+            await self._call(self._prune)
+
+    async def _run(self, job_id: str) -> None:
+        text = await self._call(self._begin, job_id)
+        if text is None:
+            return  # deleted while queued
+
+        chunks = await asyncio.to_thread(self.prepare, text)
+        await self._call(self._set_total, job_id, len(chunks))
+
+        # Closed on return, so the batches already started are cancelled at once
+        async with contextlib.aclosing(self.embed_batches(chunks)) as batches:
+            async for indices, embeddings in batches:
+                if not await self._call(self._write_batch, job_id, chunks, indices, embeddings):
+                    return  # deleted while running
+
+        await self._call(self._finish, job_id, DONE, None)
+
+    def _begin(self, job_id: str) -> Optional[str]:
+        row = self.db.execute("SELECT text FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def _set_total(self, job_id: str, total_chunks: int) -> None:
+        self.db.execute(
+            "UPDATE jobs SET status = ?, total_chunks = ? WHERE id = ?", (RUNNING, total_chunks, job_id)
+        )
+        self.db.commit()
+
+    def _write_batch(
+        self, job_id: str, chunks: Sequence[Any], indices: List[int], embeddings: List[List[float]]
+    ) -> bool:
+        """Store a finished mini-batch; False if the job has been deleted"""
+        self.db.executemany(
+            "INSERT OR REPLACE INTO job_chunks"
+            " (job_id, chunk_index, start_char, end_char, text, vector, token_count)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    job_id,
+                    i,
+                    chunks[i].start_char,
+                    chunks[i].end_char,
+                    chunks[i].text,
+                    array("f", embedding).tobytes(),
+                    len(chunks[i].input_ids),
+                )
+                for i, embedding in zip(indices, embeddings)
+            ],
+        )
+        updated = self.db.execute(
+            "UPDATE jobs SET done_chunks = done_chunks + ? WHERE id = ?", (len(indices), job_id)
+        ).rowcount
+        if not updated:
+            self.db.execute("DELETE FROM job_chunks WHERE job_id = ?", (job_id,))
+        self.db.commit()
+        return bool(updated)
+
+    def _finish(self, job_id: str, status: str, error: Optional[str]) -> None:
+        self.db.execute(
+            "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+            (status, error, time.time(), job_id),
+        )
+        self.db.commit()
@@ -0,0 +1,229 @@
+"""
+BM25 keyword index over the stored chunk texts, and reciprocal rank fusion
+of keyword and dense results.
+
+Chunk text is tokenized with the same normalization as
+preprocess_danish_text (tags stripped, lowercased, stopwords dropped) and
+split into words. Case numbers ("L 123", "B 45") and paragraph references
+("§ 5") additionally become single terms, so an exact reference outranks
+documents that merely contain the number.
+"""
+from array import array
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+import numpy as np
+from search_index import METADATA_DTYPE, SOURCES, fetch_chunks, save_snapshot, superseded, watermarks
+
+WORD_PATTERN = re.compile(r"\w+")
+# Case number prefixes used by Folketinget (lovforslag, beslutningsforslag, ...)
+CASE_NUMBER_PATTERN = re.compile(r"\b(l|b|f|r|v|s|us|ub)\s?(\d+)\b")
+PARAGRAPH_PATTERN = re.compile(r"§+\s?(\d+\s?[a-z]?)\b")
+
+
+def search_terms(normalized_text: str) -> List[str]:
+    """Terms of text that has already been through the Danish normalizer"""
+    terms = WORD_PATTERN.findall(normalized_text)
+    terms.extend(f"{prefix} {number}" for prefix, number in CASE_NUMBER_PATTERN.findall(normalized_text))
+    terms.extend(f"§ {number.replace(' ', '')}" for number in PARAGRAPH_PATTERN.findall(normalized_text))
+    return terms
+
+
+class Bm25Index:
+    """
+    Inverted index of chunk texts scored with Okapi BM25. Each term keeps
+    compact postings (document numbers and term frequencies in typed
+    arrays), so documents can be added one page at a time as rows arrive.
+    Queries only touch the postings of their terms.
+    """
+
+    def __init__(self, normalize: Callable[[str], str], k1: float = 1.2, b: float = 0.75):
+        self.normalize = normalize
+        self.k1 = k1
+        self.b = b
+        self.terms: Dict[str, int] = {}
+        self.postings: List[Tuple[array, array]] = []
+        self.doc_lengths = array("I")
+        self.total_length = 0
+        self.metadata_pages: List[np.ndarray] = []
+        self._metadata: Optional[np.ndarray] = None
+        self.removed = bytearray()
+        self.added_since_save = 0
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths) - sum(self.removed)
+
+    @property
+    def metadata(self) -> np.ndarray:
+        if self._metadata is None:
+            self._metadata = (
+                np.concatenate(self.metadata_pages) if self.metadata_pages else np.empty(0, dtype=METADATA_DTYPE)
+            )
+            self.metadata_pages = [self._metadata]
+        return self._metadata
+
+    def add(self, texts: Sequence[str], metadata: np.ndarray) -> None:
+        """Index a page of chunks; older versions of the same files are removed"""
+        tokenized = [search_terms(self.normalize(text)) for text in texts]
+        with self.lock:
+            for i in superseded(metadata, self.metadata):
+                self.removed[i] = 1
+            for terms in tokenized:
+                doc = len(self.doc_lengths)
+                counts: Dict[str, int] = {}
+                for term in terms:
+                    counts[term] = counts.get(term, 0) + 1
+                for term, count in counts.items():
+                    term_id = self.terms.get(term)
+                    if term_id is None:
+                        term_id = self.terms[term] = len(self.postings)
+                        self.postings.append((array("I"), array("H")))
+                    docs, frequencies = self.postings[term_id]
+                    docs.append(doc)
+                    frequencies.append(min(count, 65535))
+                self.doc_lengths.append(len(terms))
+                self.total_length += len(terms)
+            self.metadata_pages.append(metadata)
+            self._metadata = None
+            self.removed.extend(bytes(len(texts)))
+            self.added_since_save += len(texts)
+
+    def watermarks(self) -> Dict[str, int]:
+        return watermarks([self.metadata])
+
+    def search(
+        self,
+        query: str,
+        k: int = 10,
+        sources: Optional[Sequence[str]] = None,
+        periode_ids: Optional[Sequence[int]] = None,
+        document_type_ids: Optional[Sequence[int]] = None,
+    ) -> List[Tuple[np.void, float]]:
+        """(metadata, BM25 score) of the best `k` chunks matching the filters"""
+        terms = set(search_terms(self.normalize(query)))
+        with self.lock:
+            count = len(self.doc_lengths)
+            if not count:
+                return []
+            average_length = self.total_length / count
+            doc_lengths = np.frombuffer(self.doc_lengths, dtype=np.uint32)[:count].astype(np.float32)
+            docs_parts, score_parts = [], []
+            for term in terms:
+                term_id = self.terms.get(term)
+                if term_id is None:
+                    continue
+                docs = np.array(self.postings[term_id][0], dtype=np.int64)
+                frequencies = np.array(self.postings[term_id][1], dtype=np.float32)
+                idf = math.log(1.0 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+                norm = self.k1 * (1.0 - self.b + self.b * doc_lengths[docs] / average_length)
+                docs_parts.append(docs)
+                score_parts.append(idf * frequencies * (self.k1 + 1.0) / (frequencies + norm))
+            removed = np.frombuffer(bytes(self.removed), dtype=np.uint8).astype(bool)
+            metadata = self.metadata
+        if not docs_parts:
+            return []
+
+        docs, inverse = np.unique(np.concatenate(docs_parts), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(score_parts)).astype(np.float32)
+        rows = metadata[docs]
+        mask = ~removed[docs]
+        if sources:
+            mask &= np.isin(rows["source"], [SOURCES.index(s) for s in sources])
+        if periode_ids:
+            mask &= np.isin(rows["periode_id"], periode_ids)
+        if document_type_ids:
+            mask &= np.isin(rows["document_type_id"], document_type_ids)
+        rows, scores = rows[mask], scores[mask]
+        top = np.argsort(-scores)[:k]
+        return [(rows[i], float(scores[i])) for i in top]
+
+    def save(self, path: str, manifest: Optional[Dict[str, Any]] = None) -> None:
+        """Write a snapshot with the postings of all terms laid end to end"""
+        # Copy under the lock, write without it so searches are not blocked
+        with self.lock:
+            offsets = np.zeros(len(self.postings) + 1, dtype=np.int64)
+            np.cumsum([len(docs) for docs, _ in self.postings], out=offsets[1:])
+            arrays = {
+                "offsets": offsets,
+                "docs": np.concatenate([np.frombuffer(docs, dtype=np.uint32) for docs, _ in self.postings])
+                if self.postings
+                else np.empty(0, dtype=np.uint32),
+                "frequencies": np.concatenate([np.frombuffer(f, dtype=np.uint16) for _, f in self.postings])
+                if self.postings
+                else np.empty(0, dtype=np.uint16),
+                "doc_lengths": np.frombuffer(self.doc_lengths, dtype=np.uint32).copy(),
+                "metadata": self.metadata,
+                "removed": np.frombuffer(bytes(self.removed), dtype=np.uint8),
+            }
+            terms = sorted(self.terms, key=self.terms.get)
+            stats = self.stats()
+            added = self.added_since_save
+        save_snapshot(path, arrays, {**(manifest or {}), **stats}, json_files={"terms": terms})
+        with self.lock:
+            self.added_since_save -= added
+
+    @classmethod
+    def load(cls, path: str, normalize: Callable[[str], str]) -> "Bm25Index":
+        def load_array(name):
+            return np.load(os.path.join(path, f"{name}.npy"))
+
+        index = cls(normalize)
+        with open(os.path.join(path, "terms.json"), encoding="utf-8") as f:
+            terms = json.load(f)
+        offsets, docs, frequencies = load_array("offsets"), load_array("docs"), load_array("frequencies")
+        index.terms = {term: i for i, term in enumerate(terms)}
+        index.postings = [
+            (array("I", docs[start:end].tobytes()), array("H", frequencies[start:end].tobytes()))
+            for start, end in zip(offsets[:-1], offsets[1:])
+        ]
+        index.doc_lengths = array("I", load_array("doc_lengths").tobytes())
+        index.total_length = int(sum(index.doc_lengths))
+        index.metadata_pages = [load_array("metadata")]
+        index.removed = bytearray(load_array("removed").tobytes())
+        return index
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "documents": len(self),
+            "terms": len(self.terms),
+            "postings": int(sum(len(docs) for docs, _ in self.postings)),
+            "removed": int(sum(self.removed)),
+        }
+
+
+def refresh_from_database(index: Bm25Index, engine) -> int:
+    """Index chunk texts stored since the index was last updated; returns the number added"""
+    added = 0
+    for source, after_id in index.watermarks().items():
+        for _, metadata, texts in fetch_chunks(engine, source, after_id, with_vectors=False):
+            index.add(texts, metadata)
+            added += len(texts)
+    return added
+
+
+def build_from_database(engine, normalize: Callable[[str], str]) -> Bm25Index:
+    started = time.perf_counter()
+    index = Bm25Index(normalize)
+    refresh_from_database(index, engine)
+    logging.info(f"Built keyword index of {len(index)} chunks in {time.perf_counter() - started:.1f}s")
+    return index
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Sequence[Tuple[Hashable, Any]]], k: int, constant: float = 60.0
+) -> List[Tuple[Hashable, float]]:
+    """
+    Fuse ranked lists of (key, ...) by summing 1 / (constant + rank) per key;
+    returns the best `k` (key, fused score), best first.
+    """
+    fused: Dict[Hashable, float] = {}
+    for ranking in rankings:
+        for rank, (key, _) in enumerate(ranking, start=1):
+            fused[key] = fused.get(key, 0.0) + 1.0 / (constant + rank)
+    return sorted(fused.items(), key=lambda item: -item[1])[:k]
@@ -1,107 +1,439 @@
-from fastapi import FastAPI, HTTPException
+import time
+
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, Header, Request
 from pydantic import BaseModel
-from transformers import AutoTokenizer, AutoModel
-import torch
 import uvicorn
 from fastapi.middleware.cors import CORSMiddleware
-from mlx_lm import load, generate
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 import os
-from typing import List
-import re
-import nltk
-from nltk.corpus import stopwords
+import asyncio
+import json
+import logging
+import numpy as np
+from typing import Dict, List, Literal, Optional, Sequence
+from inference import InferencePool
+from embedding import bucket_batches, embed_texts
+from text_normalization import DanishTextNormalizer, load_danish_stopwords
+from chunking import Chunk, chunk_document
+from backends import load_backend, load_model, parity_check, PARITY_SAMPLES
+from batcher import MicroBatcher
+from embedding_cache import EmbeddingCache
+from jobs import DocumentJobs, JobQueueFull, DONE
+from search_index import SOURCES, IvfIndex, build_from_database, document_vectors, refresh_from_database
+import keyword_index
+from keyword_index import Bm25Index, reciprocal_rank_fusion
+from reembed import SETTLING, SWITCHED, ReembeddingMigration, live_model
+from wire_format import (
+    binary_document_response,
+    binary_dtype,
+    binary_response,
+    check_encoding,
+    parse_quantize,
+    quantized_codes,
+    to_base64,
+)
+from scheduler import BULK, INTERACTIVE
+from observability import REGISTRY, REQUEST_SECONDS, IN_FLIGHT, Gauge, log_event, stage
+
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(asctime)s - %(levelname)s - %(message)s")
 
 app = FastAPI()
 
-# Download Danish stopwords
-nltk.download("stopwords")
-danish_stopwords = set(stopwords.words("danish"))
-
-# Add parliamentary-specific stopwords
-parliamentary_stopwords = {
-    "folketinget",
-    "minister",
-    "lovforslag",
-    "beslutningsforslag",
-    "udvalg",
-    "afstemning",
-    "paragraf",
-    "stk",
-    "behandling",
-    "møde",
-    "dagsorden",
-}
-danish_stopwords.update(parliamentary_stopwords)
-
-# Load the Danish BERT model
-model_name = "Maltehb/danish-bert-botxo"
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-model = AutoModel.from_pretrained(model_name)
+# Danish and parliamentary stopwords (bundled list), and the normalizer applied before embedding
+danish_stopwords = load_danish_stopwords()
+text_normalizer = DanishTextNormalizer(danish_stopwords)
 
+# The Danish BERT model; MODEL_CACHE_DIR keeps a local safetensors snapshot
+model_name = os.getenv("MODEL_NAME", "Maltehb/danish-bert-botxo")
+model_cache_dir = os.getenv("MODEL_CACHE_DIR")
+
+# Bounds for a single padded forward pass when embedding document chunks
+max_batch_size = int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "16"))
+max_batch_tokens = int(os.getenv("EMBEDDING_MAX_BATCH_TOKENS", "8192"))
+
+# Inference runs off the event loop; INFERENCE_REPLICAS > 1 forks worker
+# processes that share the model weights
+inference_replicas = int(os.getenv("INFERENCE_REPLICAS", "1"))
+inference_threads = os.getenv("INFERENCE_THREADS_PER_REPLICA")
+
+# Bulk document embedding may occupy at most this many replicas at once, and
+# always yields to /get_embedding requests waiting for one
+bulk_max_workers = int(os.getenv("BULK_MAX_WORKERS", str(max(1, inference_replicas // 2))))
+
+# Select the inference backend: fp32 "torch", int8 "quantized" or "onnx"
+inference_backend = os.getenv("INFERENCE_BACKEND", "torch")
+
+# Largest number of texts accepted by one /embed_batch request
+embed_batch_max_items = int(os.getenv("EMBED_BATCH_MAX_ITEMS", "1024"))
+
+# Number of sample texts run through every replica before reporting ready
+warmup_batch_size = int(os.getenv("WARMUP_BATCH_SIZE", "8"))
+
+# Set by load_service() at startup
+tokenizer = None
+model = None
+inference_pool: Optional[InferencePool] = None
+service_loaded = asyncio.Event()
+load_error: Optional[Exception] = None
+startup_timings: Dict[str, float] = {}
 
-def preprocess_danish_text(text):
-    # Convert to lowercase
-    text = text.lower()
 
-    # Remove extra whitespace
-    text = re.sub(r"\s+", " ", text).strip()
+def load_service() -> None:
+    """Load the model and backend, start the inference pool and warm it up"""
+    global tokenizer, model, inference_pool
 
-    # Remove stopwords
-    words = text.split()
-    words = [word for word in words if word not in danish_stopwords]
+    started = time.perf_counter()
+    tokenizer, model = load_model(model_name, model_cache_dir)
+    startup_timings["model_load_seconds"] = time.perf_counter() - started
 
-    # # Join words back into a string
-    text = " ".join(words)
+    started = time.perf_counter()
+    encoder = load_backend(
+        inference_backend,
+        model,
+        tokenizer,
+        onnx_path=os.getenv(
+            "ONNX_MODEL_PATH",
+            os.path.expanduser(f"~/.cache/openparliament/{model_name.replace('/', '--')}.onnx"),
+        ),
+        num_threads=int(inference_threads) if inference_threads else None,
+    )
+    if inference_backend != "torch" and os.getenv("INFERENCE_PARITY_CHECK") == "1":
+        parity = parity_check(model, encoder, tokenizer, PARITY_SAMPLES)
+        log_event("backend_parity", sampled=False, backend=inference_backend, **parity)
+    startup_timings["backend_load_seconds"] = time.perf_counter() - started
 
-    # Remove any HTML tags or script tags and other non-text content and their contents
-    text = re.sub(r"<[^>]*>", "", text)
+    started = time.perf_counter()
+    pool = InferencePool(
+        encoder,
+        tokenizer,
+        replicas=inference_replicas,
+        threads_per_replica=int(inference_threads) if inference_threads else None,
+        max_batch_size=max_batch_size,
+        max_batch_tokens=max_batch_tokens,
+        bulk_max_workers=bulk_max_workers,
+    )
+    if warmup_batch_size > 0:
+        samples = (PARITY_SAMPLES * warmup_batch_size)[:warmup_batch_size]
+        pool.warm_up(embed_texts, [preprocess_danish_text(text) for text in samples])
+    startup_timings["warmup_seconds"] = time.perf_counter() - started
 
-    return text
+    inference_pool = pool
+    log_event("service_ready", sampled=False, model=model_name, backend=inference_backend, **startup_timings)
 
 
-def split_text_into_chunks(text, chunk_size=512, overlap=50) -> List[str]:
+async def wait_until_loaded() -> InferencePool:
+    await service_loaded.wait()
+    if inference_pool is None:
+        raise RuntimeError(f"Model failed to load: {load_error}")
+    return inference_pool
+
+
+async def embed_queued_texts(texts: List[str]) -> List[List[float]]:
+    pool = await wait_until_loaded()
+    return await pool.embed(texts, lane=INTERACTIVE)
+
+
+# Concurrent /get_embedding requests are grouped into one forward pass
+embedding_batcher = MicroBatcher(
+    embed_queued_texts,
+    max_batch_size=int(os.getenv("EMBEDDING_QUEUE_MAX_BATCH_SIZE", "32")),
+    max_wait_ms=float(os.getenv("EMBEDDING_QUEUE_MAX_WAIT_MS", "5")),
+    max_concurrent_batches=inference_replicas,
+)
+
+REGISTRY.register(
+    Gauge(
+        "embedding_queue_depth",
+        "Requests waiting in the /get_embedding micro-batch queue",
+        callback=embedding_batcher.queue_depth,
+    )
+)
+
+# Embeddings of previously seen text; EMBEDDING_CACHE_PATH enables the on-disk tier
+embedding_cache = EmbeddingCache(
+    f"{model_name}:{inference_backend}",
+    max_entries=int(os.getenv("EMBEDDING_CACHE_SIZE", "10000")),
+    db_path=os.getenv("EMBEDDING_CACHE_PATH"),
+)
+
+
+def preprocess_danish_text(text):
+    # Strip HTML tags, lowercase, collapse whitespace and remove stopwords
+    with stage("preprocess"):
+        return text_normalizer.normalize(text)
+
+
+def prepare_chunks(text: str) -> List[Chunk]:
+    # Tokenize once and cut into windows of ≤512 tokens, keeping the token ids
+    preprocessed_text = preprocess_danish_text(text)
+    with stage("chunking"):
+        return chunk_document(tokenizer, preprocessed_text, chunk_size=512, overlap=50)
+
+
+async def embed_chunks(chunks: List[Chunk]) -> List[List[float]]:
     """
-    Splits the input text into sub-chunks of at most `chunk_size` tokens,
-    allowing for a given token overlap between consecutive chunks. This
-    ensures we never exceed the model's 512-token limit. 
+    Embed chunks in order. Only chunks missing from the cache go through the
+    model, fed with the token ids from chunking in length-bucketed, padded
+    mini-batches.
     """
-    paragraphs = text.split("\n\n")  # attempt to split on paragraph boundaries
-    chunks = []
-    current_chunk = []
-    current_length = 0
+    pool = await wait_until_loaded()
+    token_ids = {chunk.text: chunk.input_ids for chunk in chunks}
+    return await embedding_cache.get_or_compute_many(
+        [chunk.text for chunk in chunks],
+        lambda texts: pool.embed_token_ids([token_ids[t] for t in texts], lane=BULK),
+    )
 
-    for paragraph in paragraphs:
-        tokens = tokenizer.encode(paragraph, add_special_tokens=False)
-        
-        # If adding this paragraph to the current chunk stays under the limit, do it
-        if current_length + len(tokens) <= chunk_size:
-            current_chunk.append(paragraph)
-            current_length += len(tokens)
+
+async def embed_chunk_batches(chunks: List[Chunk]):
+    """Yield (chunk indices, embeddings) for each mini-batch as it finishes"""
+    groups = bucket_batches(
+        [len(chunk.input_ids) + 2 for chunk in chunks], max_batch_size, max_batch_tokens
+    )
+
+    async def run(group: List[int]):
+        return group, await embed_chunks([chunks[i] for i in group])
+
+    tasks = [asyncio.ensure_future(run(group)) for group in groups]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # The client may disconnect mid-stream
+        for task in tasks:
+            task.cancel()
+
+
+# Very large documents can be embedded as background jobs, persisted on
+# disk; the job database is opened by the startup hook
+document_jobs: Optional[DocumentJobs] = None
+
+
+def open_document_jobs() -> DocumentJobs:
+    return DocumentJobs(
+        f"{model_name}:{inference_backend}",
+        db_path=os.getenv("EMBEDDING_JOBS_PATH", "embedding_jobs.db"),
+        prepare=prepare_chunks,
+        embed_batches=embed_chunk_batches,
+        workers=int(os.getenv("EMBEDDING_JOB_WORKERS", "2")),
+        max_queued=int(os.getenv("EMBEDDING_JOB_MAX_QUEUED", "100")),
+        collected_retention_hours=float(os.getenv("EMBEDDING_JOB_COLLECTED_RETENTION_HOURS", "1")),
+        max_retention_days=float(os.getenv("EMBEDDING_JOB_MAX_RETENTION_DAYS", "30")),
+    )
+
+
+def started_document_jobs() -> DocumentJobs:
+    if document_jobs is None:
+        raise HTTPException(status_code=503, detail="Job store is not open yet")
+    return document_jobs
+
+
+# Semantic search over the stored chunk embeddings, from a memory-mapped
+# snapshot at SEARCH_INDEX_PATH, and BM25 keyword search over the chunk
+# texts, from a snapshot at KEYWORD_INDEX_PATH; both are built from and
+# kept up to date with the database at DATABASE_URL
+database_url = os.getenv("DATABASE_URL")
+search_index_path = os.getenv("SEARCH_INDEX_PATH", "search_index")
+keyword_index_path = os.getenv("KEYWORD_INDEX_PATH", "keyword_index")
+search_index_refresh_seconds = float(os.getenv("SEARCH_INDEX_REFRESH_SECONDS", "300"))
+search_index_max_delta = int(os.getenv("SEARCH_INDEX_MAX_DELTA", "50000"))
+search_nprobe = int(os.getenv("SEARCH_INDEX_NPROBE", "16"))
+search_documents = int(os.getenv("SEARCH_DOCUMENT_SHORTLIST", "0"))  # 0 probes clusters instead
+# Rows kept by int8 code score and rescored with the full vectors; 0 is 10 * k
+search_rescore_candidates = int(os.getenv("SEARCH_RESCORE_CANDIDATES", "0"))
+search_fusion_candidates = int(os.getenv("SEARCH_FUSION_CANDIDATES", "50"))
+search_index: Optional[IvfIndex] = None
+search_index_stale = False
+keyword_search_index: Optional[Bm25Index] = None
+search_index_task: Optional[asyncio.Task] = None
+
+
+# Document vectors in the snapshot are token-weighted means of their chunks
+search_index_manifest = {"model": model_name, "weights": "tokens"}
+
+
+def snapshot_current(path: str) -> bool:
+    manifest = os.path.join(path, "manifest.json")
+    if not os.path.exists(manifest):
+        return False
+    with open(manifest) as f:
+        saved = json.load(f)
+    return all(saved.get(key) == value for key, value in search_index_manifest.items())
+
+
+def load_search_index(engine, rebuild: bool = False) -> Optional[IvfIndex]:
+    # A snapshot of another model's vectors (or weighted otherwise) is never
+    # searched; it is rebuilt from the database
+    if snapshot_current(search_index_path) and not rebuild:
+        started = time.perf_counter()
+        index = IvfIndex.load(search_index_path)
+        log_event("search_index_loaded", sampled=False, seconds=time.perf_counter() - started, **index.stats())
+        return index
+    if engine is None:
+        return None
+    index = build_from_database(engine, tokenizer)
+    index.save(search_index_path, search_index_manifest)
+    return IvfIndex.load(search_index_path)
+
+
+def refresh_search_index(index: IvfIndex, engine) -> IvfIndex:
+    """Add new rows; once the in-memory delta is large, write a new snapshot"""
+    added = refresh_from_database(index, engine, tokenizer)
+    if added:
+        log_event("search_index_refreshed", sampled=False, added=added, **index.stats())
+    if index.stats()["delta"] >= search_index_max_delta:
+        index.save(search_index_path, search_index_manifest)
+        return IvfIndex.load(search_index_path)
+    return index
+
+
+def load_keyword_index(engine) -> Optional[Bm25Index]:
+    if os.path.exists(os.path.join(keyword_index_path, "manifest.json")):
+        started = time.perf_counter()
+        try:
+            index = Bm25Index.load(keyword_index_path, text_normalizer.normalize)
+        except (OSError, ValueError) as e:
+            # An incomplete snapshot is rebuilt rather than leaving keyword search down
+            logging.error(f"Keyword index snapshot unreadable, rebuilding: {str(e)}")
         else:
-            # Finish the current chunk
-            if current_chunk:
-                chunks.append("\n\n".join(current_chunk))
-            
-            # Handle paragraphs that exceed the chunk size individually
-            if len(tokens) > chunk_size:
-                for i in range(0, len(tokens), chunk_size - overlap):
-                    chunk_tokens = tokens[i : i + chunk_size]
-                    chunk_text = tokenizer.decode(chunk_tokens, skip_special_tokens=True)
-                    chunks.append(chunk_text)
-                current_chunk = []
-                current_length = 0
+            log_event("keyword_index_loaded", sampled=False, seconds=time.perf_counter() - started, **index.stats())
+            return index
+    if engine is None:
+        return None
+    index = keyword_index.build_from_database(engine, text_normalizer.normalize)
+    index.save(keyword_index_path, {"model": model_name})
+    return index
+
+
+def refresh_keyword_index(index: Bm25Index, engine) -> Bm25Index:
+    """Add new rows; write a new snapshot once enough have been added since the last one"""
+    added = keyword_index.refresh_from_database(index, engine)
+    if added:
+        log_event("keyword_index_refreshed", sampled=False, added=added, **index.stats())
+    if index.added_since_save >= search_index_max_delta:
+        index.save(keyword_index_path, {"model": model_name})
+    return index
+
+
+async def maintain_search_index() -> None:
+    global search_index, search_index_stale, keyword_search_index
+    engine = None
+    if database_url:
+        from sqlalchemy import create_engine
+
+        engine = create_engine(database_url)
+        if not snapshot_current(search_index_path):
+            # Building from the database weighs chunks with the service tokenizer
+            await service_loaded.wait()
+    try:
+        search_index = await asyncio.to_thread(load_search_index, engine)
+    except Exception as e:
+        log_event("search_index_error", sampled=False, level=logging.ERROR, error=str(e))
+    try:
+        keyword_search_index = await asyncio.to_thread(load_keyword_index, engine)
+    except Exception as e:
+        log_event("keyword_index_error", sampled=False, level=logging.ERROR, error=str(e))
+    if engine is None:
+        return
+
+    await service_loaded.wait()
+    while True:
+        try:
+            if search_index is None or search_index_stale:
+                rebuild, search_index_stale = search_index_stale, False
+                search_index = await asyncio.to_thread(load_search_index, engine, rebuild)
+            else:
+                search_index = await asyncio.to_thread(refresh_search_index, search_index, engine)
+        except Exception as e:
+            log_event("search_index_error", sampled=False, level=logging.ERROR, error=str(e))
+        try:
+            if keyword_search_index is None:
+                keyword_search_index = await asyncio.to_thread(load_keyword_index, engine)
             else:
-                current_chunk = [paragraph]
-                current_length = len(tokens)
+                keyword_search_index = await asyncio.to_thread(refresh_keyword_index, keyword_search_index, engine)
+        except Exception as e:
+            log_event("keyword_index_error", sampled=False, level=logging.ERROR, error=str(e))
+        await asyncio.sleep(search_index_refresh_seconds)
+
+
+# Re-embedding of the stored chunks with this service's model, enabled
+# with REEMBED_MIGRATION=1 on an instance started with the new MODEL_NAME
+# (see reembed.py for the rollout)
+reembed_enabled = os.getenv("REEMBED_MIGRATION", "0") == "1"
+reembed_rows_per_second = float(os.getenv("REEMBED_ROWS_PER_SECOND", "50"))
+reembed_batch_size = int(os.getenv("REEMBED_BATCH_SIZE", "64"))
+reembed_settle_seconds = float(os.getenv("REEMBED_SETTLE_SECONDS", "120"))
+reembedding: Optional[ReembeddingMigration] = None
+reembed_task: Optional[asyncio.Task] = None
+
+# Model of the stored embeddings after the latest switch, checked every
+# EMBEDDING_MODEL_CHECK_SECONDS; an instance running another model serves
+# no embeddings
+model_check_seconds = float(os.getenv("EMBEDDING_MODEL_CHECK_SECONDS", "15"))
+live_embedding_model: Optional[str] = None
+model_check_task: Optional[asyncio.Task] = None
+
+
+def model_mismatch() -> Optional[str]:
+    """Why this instance must not serve embeddings, or None"""
+    migrating = reembed_enabled and database_url
+    if migrating and (reembedding is None or reembedding.status not in (SETTLING, SWITCHED)):
+        return f"Re-embedding stored chunks with {model_name}; embeddings are served after the switch"
+    if live_embedding_model is not None and live_embedding_model != model_name:
+        return (
+            f"Stored embeddings are from {live_embedding_model}, this instance runs {model_name}; "
+            f"restart it with MODEL_NAME={live_embedding_model}"
+        )
+    return None
+
+
+def require_live_model() -> None:
+    mismatch = model_mismatch()
+    if mismatch is not None:
+        raise HTTPException(status_code=503, detail=mismatch)
+
 
-    # Add the final partial chunk (if any)
-    if current_chunk:
-        chunks.append("\n\n".join(current_chunk))
+async def watch_live_model() -> None:
+    global live_embedding_model
+    from sqlalchemy import create_engine
 
-    return chunks
+    engine = create_engine(database_url)
+    while True:
+        try:
+            model = await asyncio.to_thread(live_model, engine)
+            if model != live_embedding_model:
+                log_event("live_model_changed", sampled=False, model=model, loaded=model_name)
+            live_embedding_model = model
+        except Exception as e:
+            log_event("live_model_error", sampled=False, level=logging.ERROR, error=str(e))
+        await asyncio.sleep(model_check_seconds)
+
+
+async def reembed_texts(texts: List[str]) -> List[List[float]]:
+    # Stored chunk texts are already normalized
+    pool = await wait_until_loaded()
+    return await embedding_cache.get_or_compute_many(texts, lambda missing: pool.embed(missing, lane=BULK))
+
+
+def reembedding_switched() -> None:
+    global search_index, search_index_stale, live_embedding_model
+    # The snapshot holds the previous model's vectors; dense search waits for the rebuild
+    search_index, search_index_stale = None, True
+    live_embedding_model = model_name
+    log_event("reembed_switched", sampled=False, model=model_name)
+
+
+async def run_reembedding() -> None:
+    try:
+        await reembedding.run()
+    except Exception as e:
+        reembedding.status = "failed"
+        log_event("reembed_error", sampled=False, level=logging.ERROR, error=str(e))
 
 
 # # Load Ministral 8B
+# from mlx_lm import load, generate
 # llm_model, llm_tokenizer = load("mlx-community/Ministral-8B-Instruct-2410-8bit")
 
 
@@ -115,6 +447,13 @@ class DocumentResponse(BaseModel):
     chunks: List[str]
     embeddings: List[List[float]]
     original_text: str
+    # Token-weighted mean of the chunk embeddings, unit length
+    document_embedding: Optional[List[float]] = None
+
+
+class DocumentStreamRequest(BaseModel):
+    text: str
+    include_original_text: bool = False
 
 
 class TextEmbeddingRequest(BaseModel):
@@ -125,6 +464,56 @@ class TextEmbeddingResponse(BaseModel):
     embedding: List[float]
 
 
+class BatchEmbeddingItem(BaseModel):
+    text: str
+    id: Optional[str] = None
+
+
+class BatchEmbeddingRequest(BaseModel):
+    items: List[BatchEmbeddingItem]
+
+
+class BatchEmbeddingResult(BaseModel):
+    index: int
+    id: Optional[str] = None
+    embedding: Optional[List[float]] = None
+    error: Optional[str] = None
+
+
+class BatchEmbeddingResponse(BaseModel):
+    results: List[BatchEmbeddingResult]
+
+
+class SearchRequest(BaseModel):
+    query: str
+    k: int = 10
+    mode: Literal["hybrid", "dense", "keyword"] = "hybrid"
+    sources: Optional[List[str]] = None
+    periode_ids: Optional[List[int]] = None
+    document_type_ids: Optional[List[int]] = None
+    nprobe: Optional[int] = None
+    # Two-stage dense search: rank documents by their document vector and
+    # only score the chunks of this many best documents
+    documents: Optional[int] = None
+
+
+class SearchResult(BaseModel):
+    source: str
+    id: int
+    fil_id: Optional[int] = None
+    tale_segment_id: Optional[int] = None
+    chunk_index: int
+    score: float
+    dense_score: Optional[float] = None
+    keyword_score: Optional[float] = None
+    periode_id: Optional[int] = None
+    document_type_id: Optional[int] = None
+
+
+class SearchResponse(BaseModel):
+    results: List[SearchResult]
+
+
 class QuestionRequest(BaseModel):
     text: str
 
@@ -133,73 +522,396 @@ class QuestionResponse(BaseModel):
     question: str
 
 
+def document_response(
+    original_text: str,
+    chunk_texts: List[str],
+    embeddings: List[List[float]],
+    token_counts: Sequence[int],
+    encoding: Optional[str],
+    dtype: str,
+    accept: Optional[str],
+    quantize: Sequence[str] = (),
+):
+    document_embedding = None
+    if embeddings:
+        weights = np.asarray(token_counts, dtype=np.float32)
+        document_embedding = document_vectors(np.asarray(embeddings), weights, np.array([0]))[0].tolist()
+    with stage("serialization"):
+        # Chunk metadata as a JSON header before the packed float32/float16 vectors, if negotiated
+        raw_dtype = binary_dtype(accept)
+        if raw_dtype:
+            fields = {
+                "status": "success",
+                "chunks": chunk_texts,
+                "original_text": original_text,
+                "document_embedding": document_embedding,
+            }
+            if quantize:
+                fields["quantized"] = quantized_codes(embeddings, quantize)
+            return binary_document_response(fields, embeddings, raw_dtype)
+        if encoding == "base64":
+            data, shape = to_base64(embeddings, dtype)
+            body = {
+                "status": "success",
+                "chunks": chunk_texts,
+                "embeddings": data,
+                "dtype": dtype,
+                "shape": shape,
+                "original_text": original_text,
+                "document_embedding": document_embedding,
+            }
+        else:
+            body = DocumentResponse(
+                status="success",
+                chunks=chunk_texts,
+                embeddings=embeddings,
+                original_text=original_text,
+                document_embedding=document_embedding,
+            ).model_dump()
+        if quantize:
+            body["quantized"] = quantized_codes(embeddings, quantize)
+        return JSONResponse(body)
+
+
 @app.post("/process_document_embeddings", response_model=DocumentResponse)
-async def process_document(request: DocumentRequest):
+async def process_document(
+    request: DocumentRequest,
+    encoding: Optional[str] = None,
+    dtype: str = "float32",
+    quantize: Optional[str] = None,
+    accept: Optional[str] = Header(None),
+):
+    check_encoding(encoding, dtype)
+    require_live_model()
+    quantize_kinds = parse_quantize(quantize)
     try:
         # Store original content
         original_text = request.text
         
-        # Preprocess for embedding
-        preprocessed_text = preprocess_danish_text(original_text)
-        
-        # Split into chunks of ≤512 tokens
-        chunks = split_text_into_chunks(preprocessed_text, chunk_size=512, overlap=50)
-        
-        embeddings = []
-        for chunk in chunks:
-            # Make sure each chunk is still ≤512 tokens; truncation=True ensures no indexing error
-            inputs = tokenizer(
-                chunk,
-                return_tensors="pt",
-                truncation=True,
-                max_length=512,
-                padding=True
-            )
-            with torch.no_grad():
-                outputs = model(**inputs)
-            
-            # Mean-pool the token embeddings across dimension 1
-            pooled_embedding = outputs.last_hidden_state.mean(dim=1)[0].tolist()
-            embeddings.append(pooled_embedding)
-            
-        return DocumentResponse(
-            status="success",
-            chunks=chunks,
-            embeddings=embeddings,
-            original_text=original_text
+        # Preprocess and split into chunks of ≤512 tokens off the event loop
+        await wait_until_loaded()
+        chunks = await asyncio.to_thread(prepare_chunks, original_text)
+        embeddings = await embed_chunks(chunks)
+
+        return document_response(
+            original_text,
+            [chunk.text for chunk in chunks],
+            embeddings,
+            [len(chunk.input_ids) for chunk in chunks],
+            encoding,
+            dtype,
+            accept,
+            quantize_kinds,
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/get_embedding", response_model=TextEmbeddingResponse)
-async def get_embedding(request: TextEmbeddingRequest):
+@app.post("/process_document_embeddings/stream")
+async def process_document_stream(
+    request: DocumentStreamRequest, encoding: Optional[str] = None, dtype: str = "float32"
+):
+    """
+    Streams the document embedding as NDJSON: a header line with the chunk
+    count (and the original text if requested), then one line per chunk as
+    soon as the mini-batch containing it finishes. Chunk lines may arrive
+    out of order; use `chunk_index` to place them.
+    """
+    check_encoding(encoding, dtype)
+    require_live_model()
     try:
-        print(f"Received request: {request.text}")  # Add logging
+        await wait_until_loaded()
+        chunks = await asyncio.to_thread(prepare_chunks, request.text)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def lines():
+        header = {"status": "success", "total_chunks": len(chunks)}
+        if request.include_original_text:
+            header["original_text"] = request.text
+        yield json.dumps(header, ensure_ascii=False) + "\n"
+
+        try:
+            async for indices, embeddings in embed_chunk_batches(chunks):
+                for index, embedding in zip(indices, embeddings):
+                    chunk = chunks[index]
+                    line = {
+                        "chunk_index": index,
+                        "start_char": chunk.start_char,
+                        "end_char": chunk.end_char,
+                        "text": chunk.text,
+                        "embedding": embedding,
+                    }
+                    with stage("serialization"):
+                        if encoding == "base64":
+                            line["embedding"], line["shape"] = to_base64(embedding, dtype)
+                            line["dtype"] = dtype
+                        encoded = json.dumps(line, ensure_ascii=False) + "\n"
+                    yield encoded
+        except Exception as e:
+            log_event("stream_error", sampled=False, level=logging.ERROR, error=str(e))
+            yield json.dumps({"status": "error", "detail": str(e)}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
+
+@app.post("/jobs/document_embeddings", status_code=202)
+async def submit_document_job(request: DocumentRequest):
+    """
+    Embed a document in the background. Returns the job to poll at
+    /jobs/{job_id}; submitting the same text again returns the existing job.
+    Results are kept until collected: they are deleted
+    EMBEDDING_JOB_COLLECTED_RETENTION_HOURS after the first fetch of
+    /jobs/{job_id}/result, or EMBEDDING_JOB_MAX_RETENTION_DAYS after the job
+    finished if never fetched. The job's `expires_at` gives the time.
+    """
+    require_live_model()
+    jobs = started_document_jobs()
+    try:
+        await wait_until_loaded()
+        job, duplicate = await jobs.submit(request.text)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {**job, "duplicate": duplicate}
+
+
+@app.get("/jobs/{job_id}")
+async def get_document_job(job_id: str):
+    job = await started_document_jobs().status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/jobs/{job_id}/result", response_model=DocumentResponse)
+async def get_document_job_result(
+    job_id: str,
+    encoding: Optional[str] = None,
+    dtype: str = "float32",
+    quantize: Optional[str] = None,
+    accept: Optional[str] = Header(None),
+):
+    """
+    The same response as /process_document_embeddings, once the job is
+    done. The first fetch marks the result collected, see `expires_at`.
+    """
+    check_encoding(encoding, dtype)
+    require_live_model()
+    quantize_kinds = parse_quantize(quantize)
+    jobs = started_document_jobs()
+    job = await jobs.status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] != DONE:
+        detail = f"Job is {job['status']}" + (f": {job['error']}" if job["error"] else "")
+        raise HTTPException(status_code=409, detail=detail)
+    original_text, chunk_texts, embeddings, token_counts = await jobs.result(job_id)
+    if None in token_counts:
+        # Jobs stored before token counts were kept
+        token_counts = await asyncio.to_thread(
+            lambda: [len(ids) for ids in tokenizer(chunk_texts, add_special_tokens=False)["input_ids"]]
+        )
+    return document_response(
+        original_text, chunk_texts, embeddings, token_counts, encoding, dtype, accept, quantize_kinds
+    )
+
+
+@app.delete("/jobs/{job_id}")
+async def delete_document_job(job_id: str):
+    """Delete a job and its results once collected"""
+    if not await started_document_jobs().delete(job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"status": "deleted", "job_id": job_id}
+
+
+@app.post("/get_embedding", response_model=TextEmbeddingResponse)
+async def get_embedding(
+    request: TextEmbeddingRequest,
+    encoding: Optional[str] = None,
+    dtype: str = "float32",
+    quantize: Optional[str] = None,
+    accept: Optional[str] = Header(None),
+):
+    check_encoding(encoding, dtype)
+    require_live_model()
+    quantize_kinds = parse_quantize(quantize)
+    try:
         # Preprocess the text before generating embedding
         preprocessed_text = preprocess_danish_text(request.text)
 
-        # Tokenize and generate embedding; truncation will avoid out-of-range errors
-        inputs = tokenizer(
-            preprocessed_text,
-            return_tensors="pt",
-            truncation=True,
-            max_length=512,
-            padding=True
+        # Queue the text on a cache miss; it is embedded together with concurrent requests
+        pooled_embedding = await embedding_cache.get_or_compute(
+            preprocessed_text, embedding_batcher.submit
         )
-        with torch.no_grad():
-            outputs = model(**inputs)
 
-        # Mean-pool the token embeddings across dimension 1
-        pooled_embedding = outputs.last_hidden_state.mean(dim=1)[0].tolist()
+        # Request text is not logged, only its size
+        log_event("get_embedding", chars=len(request.text), preprocessed_chars=len(preprocessed_text))
+
+        with stage("serialization"):
+            # Packed float32/float16 instead of a JSON float list, if negotiated
+            raw_dtype = binary_dtype(accept)
+            if raw_dtype:
+                return binary_response(pooled_embedding, raw_dtype)
+            if encoding == "base64":
+                data, shape = to_base64(pooled_embedding, dtype)
+                body = {"embedding": data, "dtype": dtype, "shape": shape}
+            else:
+                body = TextEmbeddingResponse(embedding=pooled_embedding).model_dump()
+            if quantize_kinds:
+                body["quantized"] = quantized_codes(pooled_embedding, quantize_kinds)
+            return JSONResponse(body)
+    except Exception as e:
+        log_event("get_embedding_error", sampled=False, level=logging.ERROR, error=str(e))
+        raise HTTPException(status_code=500, detail=str(e))
+
 
-        print(f"Generated embedding (mean-pooled): {pooled_embedding[:5]}...")  # Log part of the embedding
-        return TextEmbeddingResponse(embedding=pooled_embedding)
+@app.post("/search", response_model=SearchResponse)
+async def search(request: SearchRequest):
+    """
+    Returns the `k` stored chunks that best match the query, optionally
+    restricted to sources, periodes or document types. "dense" ranks by
+    embedding similarity, "keyword" by BM25 over the chunk texts, and
+    "hybrid" fuses both rankings with reciprocal rank fusion; if only one
+    of the indexes is available, hybrid search uses that one.
+    """
+    # Stored vectors of another model are not ranked against this model's queries
+    mismatch = model_mismatch()
+    use_dense = request.mode != "keyword" and search_index is not None and mismatch is None
+    use_keyword = request.mode != "dense" and keyword_search_index is not None
+    if not (use_dense or use_keyword):
+        raise HTTPException(status_code=503, detail=mismatch or "Search index is not available")
+    if not 1 <= request.k <= 1000:
+        raise HTTPException(status_code=400, detail="k must be between 1 and 1000")
+    if request.documents is not None and request.documents < 1:
+        raise HTTPException(status_code=400, detail="documents must be at least 1")
+    for source in request.sources or []:
+        if source not in SOURCES:
+            raise HTTPException(status_code=400, detail=f"Unknown source: {source}")
+
+    # Fusion needs more than the top k of each ranking to find agreement
+    depth = max(request.k, search_fusion_candidates) if use_dense and use_keyword else request.k
+    filters = (request.sources, request.periode_ids, request.document_type_ids)
+    rankings = {}
+    try:
+        if use_dense:
+            query = await embedding_cache.get_or_compute(
+                preprocess_danish_text(request.query), embedding_batcher.submit
+            )
+            with stage("search"):
+                rankings["dense"] = await asyncio.to_thread(
+                    search_index.search,
+                    np.asarray(query, dtype=np.float32),
+                    depth,
+                    request.nprobe or search_nprobe,
+                    *filters,
+                    request.documents or search_documents,
+                    search_rescore_candidates or None,
+                )
+        if use_keyword:
+            with stage("keyword_search"):
+                rankings["keyword"] = await asyncio.to_thread(
+                    keyword_search_index.search, request.query, depth, *filters
+                )
     except Exception as e:
-        print(f"Error in get_embedding: {str(e)}")  # Log any errors
+        log_event("search_error", sampled=False, level=logging.ERROR, error=str(e))
         raise HTTPException(status_code=500, detail=str(e))
 
+    rows, scores = {}, {name: {} for name in rankings}
+    keyed = {}
+    for name, hits in rankings.items():
+        keyed[name] = []
+        for row, score in hits:
+            key = (int(row["source"]), int(row["row_id"]))
+            rows[key] = row
+            scores[name][key] = score
+            keyed[name].append((key, score))
+    if len(keyed) > 1:
+        ranked = reciprocal_rank_fusion(list(keyed.values()), request.k)
+    else:
+        (ranked,) = keyed.values()
+
+    results = []
+    for key, score in ranked:
+        row = rows[key]
+        source = SOURCES[int(row["source"])]
+        parent_id = int(row["parent_id"])
+        results.append(
+            SearchResult(
+                source=source,
+                id=int(row["row_id"]),
+                fil_id=parent_id if source == "FilContent" else None,
+                tale_segment_id=parent_id if source == "taleSegmentChunk" else None,
+                chunk_index=int(row["chunk_index"]),
+                score=score,
+                dense_score=scores.get("dense", {}).get(key),
+                keyword_score=scores.get("keyword", {}).get(key),
+                periode_id=int(row["periode_id"]) if row["periode_id"] >= 0 else None,
+                document_type_id=int(row["document_type_id"]) if row["document_type_id"] >= 0 else None,
+            )
+        )
+    log_event("search", mode=request.mode, indexes=list(rankings), k=request.k, results=len(results))
+    return SearchResponse(results=results)
+
+
+@app.post("/embed_batch", response_model=BatchEmbeddingResponse)
+async def embed_batch(
+    request: BatchEmbeddingRequest, encoding: Optional[str] = None, dtype: str = "float32"
+):
+    """
+    Embeds many independent texts in one request. Texts are preprocessed,
+    tokenized and run through the model in padded batches, and results come
+    back in input order. If the batch fails, texts are retried one by one so
+    the error is reported only on the items that caused it.
+    """
+    check_encoding(encoding, dtype)
+    require_live_model()
+    if len(request.items) > embed_batch_max_items:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {embed_batch_max_items} items per request, got {len(request.items)}",
+        )
+
+    try:
+        pool = await wait_until_loaded()
+        with stage("preprocess"):
+            texts = await asyncio.to_thread(
+                text_normalizer.normalize_many, [item.text for item in request.items]
+            )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    results = [BatchEmbeddingResult(index=i, id=item.id) for i, item in enumerate(request.items)]
+    try:
+        embeddings = await embedding_cache.get_or_compute_many(
+            texts, lambda missing: pool.embed(missing, lane=BULK)
+        )
+        for result, embedding in zip(results, embeddings):
+            result.embedding = embedding
+    except Exception as e:
+        log_event("embed_batch_retry", sampled=False, level=logging.WARNING, items=len(texts), error=str(e))
+        for result, text in zip(results, texts):
+            try:
+                result.embedding = (await pool.embed([text], lane=BULK))[0]
+            except Exception as item_error:
+                result.error = str(item_error)
+
+    log_event("embed_batch", items=len(texts), errors=sum(r.error is not None for r in results))
+
+    with stage("serialization"):
+        if encoding == "base64":
+            encoded = []
+            for result in results:
+                row = result.model_dump()
+                if result.embedding is not None:
+                    row["embedding"], row["shape"] = to_base64(result.embedding, dtype)
+                    row["dtype"] = dtype
+                encoded.append(row)
+            return JSONResponse({"results": encoded})
+
+        return JSONResponse(BatchEmbeddingResponse(results=results).model_dump())
+
 
 # @app.post("/generate_question", response_model=QuestionResponse)
 # async def generate_question(request: QuestionRequest):
@@ -228,6 +940,128 @@ async def health_check():
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text-format metrics"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.middleware("http")
+async def track_requests(request: Request, call_next):
+    IN_FLIGHT.inc()
+    started = time.perf_counter()
+    try:
+        return await call_next(request)
+    finally:
+        IN_FLIGHT.dec()
+        # Label by route template, not the raw path, so ids and unknown paths share one series
+        route = request.scope.get("route")
+        REQUEST_SECONDS.observe(time.perf_counter() - started, getattr(route, "path", "unmatched"))
+
+
+@app.get("/ready")
+async def readiness_check():
+    """Ready once the model is loaded and warmed up; /health only reports liveness"""
+    if inference_pool is None:
+        status = "failed" if load_error else "loading"
+        return JSONResponse(
+            {"status": status, "detail": str(load_error or ""), "timings": startup_timings},
+            status_code=503,
+        )
+    mismatch = model_mismatch()
+    if mismatch is not None:
+        return JSONResponse(
+            {"status": "model_mismatch", "detail": mismatch, "timings": startup_timings}, status_code=503
+        )
+    return {"status": "ready", "timings": startup_timings}
+
+
+@app.get("/stats")
+async def stats():
+    return {
+        "inference_backend": inference_backend,
+        "startup_timings": startup_timings,
+        "embedding_batcher": embedding_batcher.stats(),
+        "embedding_cache": embedding_cache.stats(),
+        "lanes": inference_pool.scheduler.stats() if inference_pool is not None else None,
+        "document_jobs": await document_jobs.stats() if document_jobs is not None else None,
+        "search_index": search_index.stats() if search_index is not None else None,
+        "keyword_index": keyword_search_index.stats() if keyword_search_index is not None else None,
+        "reembedding": reembedding.stats() if reembedding is not None else None,
+        "live_embedding_model": live_embedding_model,
+    }
+
+
+@app.on_event("startup")
+async def startup():
+    """
+    Load the model in the background so the server answers /health at once;
+    requests that need the model wait for it. Replicas are forked, which is
+    only safe from the main thread, so with INFERENCE_REPLICAS > 1 the load
+    happens before the server starts accepting requests.
+    """
+
+    async def load():
+        global load_error
+        try:
+            if inference_replicas > 1:
+                load_service()
+            else:
+                await asyncio.to_thread(load_service)
+            await document_jobs.start()
+            if reembed_enabled and database_url:
+                start_reembedding()
+        except Exception as e:
+            load_error = e
+            logging.error(f"Error loading embedding model: {str(e)}")
+        finally:
+            service_loaded.set()
+
+    def start_reembedding():
+        global reembedding, reembed_task
+        from sqlalchemy import create_engine
+
+        reembedding = ReembeddingMigration(
+            create_engine(database_url),
+            model_name,
+            reembed_texts,
+            rows_per_second=reembed_rows_per_second,
+            batch_size=reembed_batch_size,
+            on_switch=reembedding_switched,
+            settle_seconds=reembed_settle_seconds,
+        )
+        reembed_task = asyncio.create_task(run_reembedding())
+
+    global document_jobs, search_index_task, model_check_task
+
+    document_jobs = await asyncio.to_thread(open_document_jobs)
+    if inference_replicas > 1:
+        await load()
+    else:
+        asyncio.create_task(load())
+    search_index_task = asyncio.create_task(maintain_search_index())
+    if database_url:
+        model_check_task = asyncio.create_task(watch_live_model())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await embedding_batcher.stop()
+    if document_jobs is not None:
+        await document_jobs.stop()
+    if search_index_task is not None:
+        search_index_task.cancel()
+    if reembed_task is not None:
+        reembed_task.cancel()
+    if model_check_task is not None:
+        model_check_task.cancel()
+    embedding_cache.close()
+    if inference_pool is not None:
+        inference_pool.shutdown()
+
+
+startup_timings["import_seconds"] = time.perf_counter() - _import_started
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000", "http://localhost:3001"],
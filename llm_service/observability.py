@@ -0,0 +1,216 @@
+"""
+Prometheus text-format metrics and sampled structured logging for the
+embedding service.
+"""
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self.samples()
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, *label_values: str) -> None:
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            return [
+                f"{self.name}{_format_labels(self.labels, key)} {value}"
+                for key, value in sorted(self.values.items())
+            ]
+
+
+class Gauge(Metric):
+    """A gauge that is either set directly or read from a callback at scrape time"""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        callback: Optional[Callable[[], float]] = None,
+    ):
+        super().__init__(name, help, labels)
+        self.callback = callback
+        self.values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, *label_values: str) -> None:
+        with self.lock:
+            self.values[label_values] = value
+
+    def inc(self, amount: float = 1.0, *label_values: str) -> None:
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, *label_values: str) -> None:
+        self.inc(-amount, *label_values)
+
+    def samples(self) -> List[str]:
+        if self.callback:
+            return [f"{self.name} {self.callback()}"]
+        with self.lock:
+            return [
+                f"{self.name}{_format_labels(self.labels, key)} {value}"
+                for key, value in sorted(self.values.items())
+            ]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self.counts: Dict[LabelValues, List[int]] = {}
+        self.sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        with self.lock:
+            counts = self.counts.setdefault(label_values, [0] * (len(self.buckets) + 1))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self.sums[label_values] = self.sums.get(label_values, 0.0) + value
+
+    @contextmanager
+    def time(self, *label_values: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self.lock:
+            for key in sorted(self.counts):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), self.counts[key]):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    bucket_label = f'le="{le}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, bucket_label)} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {self.sums[key]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(
+    Histogram(
+        "embedding_stage_seconds",
+        "Time spent per processing stage (preprocess, chunking, tokenize, forward, pooling, serialization)",
+        labels=("stage",),
+    )
+)
+REQUEST_SECONDS = REGISTRY.register(
+    Histogram("embedding_request_seconds", "End-to-end request latency", labels=("path",))
+)
+TOKENS = REGISTRY.register(Counter("embedding_tokens_total", "Tokens run through the model"))
+TOKENS_PER_SECOND = REGISTRY.register(
+    Gauge("embedding_tokens_per_second", "Forward-pass throughput of the most recent model call")
+)
+FORWARD_BATCH_SIZE = REGISTRY.register(
+    Histogram("embedding_forward_batch_size", "Sequences per padded forward pass", buckets=SIZE_BUCKETS)
+)
+QUEUE_BATCH_SIZE = REGISTRY.register(
+    Histogram("embedding_queue_batch_size", "Requests per micro-batch flushed from the queue", buckets=SIZE_BUCKETS)
+)
+IN_FLIGHT = REGISTRY.register(Gauge("embedding_requests_in_flight", "Requests currently being handled"))
+LANE_QUEUE_DEPTH = REGISTRY.register(
+    Gauge("embedding_lane_queue_depth", "Inference jobs waiting for a worker, per priority lane", labels=("lane",))
+)
+LANE_RUNNING = REGISTRY.register(
+    Gauge("embedding_lane_running", "Inference jobs running on a worker, per priority lane", labels=("lane",))
+)
+LANE_WAIT_SECONDS = REGISTRY.register(
+    Histogram("embedding_lane_wait_seconds", "Time inference jobs waited for a worker", labels=("lane",))
+)
+
+
+def stage(name: str):
+    """Time a block as one of the processing stages"""
+    return STAGE_SECONDS.time(name)
+
+
+def record_profile(profile: Dict) -> None:
+    """Record the timings collected by embed_features for one model call"""
+    for name in ("tokenize", "forward", "pooling"):
+        if name in profile:
+            STAGE_SECONDS.observe(profile[name], name)
+    for size in profile.get("batch_sizes", []):
+        FORWARD_BATCH_SIZE.observe(size)
+    tokens = profile.get("tokens", 0)
+    TOKENS.inc(tokens)
+    if profile.get("forward"):
+        TOKENS_PER_SECOND.set(tokens / profile["forward"])
+
+
+# Fraction of routine events that are logged; errors are always logged
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+
+logger = logging.getLogger("llm_service")
+
+
+def log_event(event: str, sampled: bool = True, level: int = logging.INFO, **fields) -> None:
+    """Log one event as a JSON object, keeping only a sample of routine events"""
+    if sampled and random.random() >= LOG_SAMPLE_RATE:
+        return
+    logger.log(level, json.dumps({"event": event, **fields}, ensure_ascii=False, default=str))
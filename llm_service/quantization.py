@@ -0,0 +1,124 @@
+"""
+Compact codes for embeddings and a search path that screens candidates
+with the codes and rescores the best of them with the full vectors.
+
+    float16  2 bytes per dimension
+    int8     1 byte per dimension plus a float32 scale per vector
+    binary   1 bit per dimension (the sign), compared by Hamming distance
+"""
+from typing import Optional, Tuple
+import numpy as np
+
+KINDS = ("float16", "int8", "binary")
+
+# Number of set bits in every byte value
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def normalize(vectors) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def quantize_int8(vectors) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric int8 codes with one scale per vector: vector ≈ codes * scale"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    scales = np.abs(vectors).max(axis=-1) / 127.0
+    scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+    codes = np.clip(np.rint(vectors / scales[..., None]), -127, 127).astype(np.int8)
+    return codes, scales
+
+
+def dequantize_int8(codes: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    return codes.astype(np.float32) * scales[..., None]
+
+
+def binarize(vectors) -> np.ndarray:
+    """Sign bits packed 8 per byte"""
+    return np.packbits(np.asarray(vectors) > 0, axis=-1)
+
+
+def hamming_distances(query_bits: np.ndarray, codes: np.ndarray) -> np.ndarray:
+    return _POPCOUNT[np.bitwise_xor(codes, query_bits)].sum(axis=-1, dtype=np.int32)
+
+
+def _blocked_dot(codes: np.ndarray, query: np.ndarray, block: int = 16384) -> np.ndarray:
+    # numpy has no float16/int8 BLAS; widen a block at a time to float32
+    scores = np.empty(len(codes), dtype=np.float32)
+    for start in range(0, len(codes), block):
+        scores[start : start + block] = codes[start : start + block].astype(np.float32) @ query
+    return scores
+
+
+def int8_scores(codes: np.ndarray, scales: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """Approximate dot products of a float32 query with int8-coded vectors"""
+    return _blocked_dot(codes, query) * scales
+
+
+def code_bytes(kind: str, dim: int) -> int:
+    """Bytes per vector for `kind` ("float32" is the full vector)"""
+    return {
+        "float32": 4 * dim,
+        "float16": 2 * dim,
+        "int8": dim + 4,
+        "binary": -(-dim // 8),
+    }[kind]
+
+
+class QuantizedVectors:
+    """
+    Unit-normalized full vectors plus compact codes of one kind. search()
+    scores every vector by its code, keeps the best `candidates`, and
+    rescores those with the full vectors, so only the codes have to be
+    scanned and only the candidates' full vectors have to be read.
+    """
+
+    def __init__(self, vectors, kind: str):
+        if kind not in KINDS:
+            raise ValueError(f"Unknown quantization: {kind}")
+        self.kind = kind
+        self.vectors = normalize(vectors)
+        self.scales: Optional[np.ndarray] = None
+        if kind == "float16":
+            self.codes = self.vectors.astype(np.float16)
+        elif kind == "int8":
+            self.codes, self.scales = quantize_int8(self.vectors)
+        else:
+            self.codes = binarize(self.vectors)
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    @property
+    def code_nbytes(self) -> int:
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def code_scores(self, query: np.ndarray) -> np.ndarray:
+        """Approximate similarity of a unit query to every vector, higher is closer"""
+        if self.kind == "float16":
+            return _blocked_dot(self.codes, query)
+        if self.kind == "int8":
+            return int8_scores(self.codes, self.scales, query)
+        return -hamming_distances(binarize(query), self.codes)
+
+    def search(self, query, k: int = 10, candidates: Optional[int] = None, rescore: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Indices and cosine similarities of the (approximately) `k` nearest
+        vectors. `candidates` (default 10 * k) are screened by code score;
+        with `rescore` they are ranked again by exact cosine similarity.
+        """
+        query = normalize(query)
+        candidates = min(len(self), max(k, candidates or 10 * k))
+        scores = self.code_scores(query)
+        if candidates < len(self):
+            top = np.argpartition(-scores, candidates - 1)[:candidates]
+        else:
+            top = np.arange(len(self))
+
+        if rescore:
+            similarities = self.vectors[top] @ query
+        else:
+            similarities = scores[top].astype(np.float32)
+        order = np.argsort(-similarities)[:k]
+        return top[order], similarities[order]
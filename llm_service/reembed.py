@@ -0,0 +1,404 @@
+"""
+Re-embedding of the stored chunks in FilContent and taleSegmentChunk after
+the model changes.
+
+Vectors from the new model are written next to the live ones, into
+`embedding_next` and `embedding_next_model`, walking each table in id
+order. Progress is checkpointed in the same transaction as every batch, in
+the `embedding_migration` table, so the walk resumes where it stopped after
+a crash or restart. Writes are throttled to a rows-per-second ceiling so
+the database and the model keep serving production traffic.
+
+Once both tables are done, a single transaction embeds the rows that
+arrived during the walk and swaps the columns by renaming:
+
+    embedding             -> embedding_previous
+    embedding_model       -> embedding_previous_model
+    embedding_next        -> embedding
+    embedding_next_model  -> embedding_model
+
+The database sees either all old or all new vectors. `embedding_model`
+tags every migrated vector with the model that produced it (NULL for
+vectors from before the first migration and for rows stored by clients
+since), and the previous vectors are kept until the next migration.
+
+Service instances still running the old model embed queries and new rows
+with it. Every instance compares its model with live_model() and stops
+serving embeddings when they differ, so the rollout is:
+
+    1. Start one instance with the new MODEL_NAME and REEMBED_MIGRATION=1;
+       it only re-embeds, and refuses embedding requests until the switch.
+    2. After the switch, the old instances stop serving embeddings within
+       their check interval; restart them with the new MODEL_NAME.
+
+Rows stored right after the switch may still hold old-model vectors from
+requests that were already running. After `settle_seconds`, which must
+be longer than the instances' check interval plus the longest request,
+every untagged row stored since the switch is re-embedded.
+
+Rolling back to a model that was live before (A -> B -> A) is a new
+migration: its earlier rows in `embedding_migration` are replaced, and
+everything is re-embedded with it again.
+"""
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+import asyncio
+import logging
+import time
+from sqlalchemy import text
+
+TABLES = ("FilContent", "taleSegmentChunk")
+
+# Switched migrations are kept for reference
+MIGRATION_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS embedding_migration (
+        model TEXT NOT NULL,
+        table_name TEXT NOT NULL,
+        last_id BIGINT NOT NULL DEFAULT 0,
+        rows_done BIGINT NOT NULL DEFAULT 0,
+        status TEXT NOT NULL,
+        started_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (model, table_name)
+    )
+"""
+
+RUNNING = "running"
+# Switched, with rows stored since the switch still to be re-embedded
+SETTLING = "settling"
+SWITCHED = "switched"
+
+
+def vector_literal(vector: Sequence[float]) -> str:
+    return "[" + ",".join(f"{x:.7g}" for x in vector) + "]"
+
+
+def live_model(engine) -> Optional[str]:
+    """Model of the stored embeddings after the latest switch, or None if none has happened"""
+    with engine.connect() as conn:
+        exists = conn.execute(text("SELECT to_regclass('embedding_migration') IS NOT NULL")).scalar()
+        if not exists:
+            return None
+        return conn.execute(
+            text(
+                "SELECT model FROM embedding_migration WHERE status IN (:settling, :switched) "
+                "ORDER BY updated_at DESC LIMIT 1"
+            ),
+            {"settling": SETTLING, "switched": SWITCHED},
+        ).scalar()
+
+
+class ReembeddingMigration:
+    """
+    Re-embeds every stored chunk with `model_name`, see the module
+    docstring. `embed(texts)` returns one vector per text; it should use
+    the bulk lane so interactive requests keep priority. `on_switch` is
+    called after the new vectors have gone live.
+    """
+
+    def __init__(
+        self,
+        engine,
+        model_name: str,
+        embed: Callable[[List[str]], Awaitable[List[List[float]]]],
+        rows_per_second: float = 50.0,
+        batch_size: int = 64,
+        on_switch: Optional[Callable[[], Any]] = None,
+        settle_seconds: float = 120.0,
+    ):
+        self.engine = engine
+        self.model_name = model_name
+        self.embed = embed
+        self.rows_per_second = rows_per_second
+        self.batch_size = max(1, batch_size)
+        self.on_switch = on_switch
+        self.settle_seconds = settle_seconds
+        self.progress: Dict[str, Dict[str, Any]] = {}
+        self.status = "pending"
+        self._next_write = time.monotonic()
+
+    async def run(self) -> None:
+        state = await asyncio.to_thread(self._state)
+        if state in (SETTLING, SWITCHED) and await asyncio.to_thread(live_model, self.engine) != self.model_name:
+            # Rolling back to a model that was live before: migrate again
+            state = None
+        if state == SWITCHED:
+            self.status = SWITCHED
+            return
+        if state != SETTLING:
+            dim = len((await self.embed(["dimension"]))[0])
+            await asyncio.to_thread(self._prepare, dim)
+            self.status = RUNNING
+            for table in TABLES:
+                await self._walk(table)
+            await self._switch()
+        self.status = SETTLING
+        if self.on_switch is not None:
+            self.on_switch()
+        await self._settle()
+        self.status = SWITCHED
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "model": self.model_name,
+            "status": self.status,
+            "rows_per_second": self.rows_per_second,
+            "tables": self.progress,
+        }
+
+    def _state(self) -> Optional[str]:
+        """Status of the migration to this model, None if it has not started"""
+        with self.engine.begin() as conn:
+            conn.execute(text(MIGRATION_TABLE_DDL))
+            statuses = {
+                row[0]
+                for row in conn.execute(
+                    text("SELECT DISTINCT status FROM embedding_migration WHERE model = :model"),
+                    {"model": self.model_name},
+                )
+            }
+        unknown = statuses - {RUNNING, SETTLING, SWITCHED}
+        if unknown:
+            raise RuntimeError(f"Unknown re-embedding status for {self.model_name}: {sorted(unknown)}")
+        if not statuses:
+            return None
+        # Switched only once every table is; the switch itself covers all tables at once
+        if statuses == {SWITCHED}:
+            return SWITCHED
+        if RUNNING in statuses:
+            return RUNNING
+        return SETTLING
+
+    def _prepare(self, dim: int) -> None:
+        """Add the shadow columns, or pick up the checkpoints of an earlier run"""
+        with self.engine.begin() as conn:
+            checkpoints = dict(
+                conn.execute(
+                    text(
+                        "SELECT table_name, last_id FROM embedding_migration "
+                        "WHERE model = :model AND status = :running"
+                    ),
+                    {"model": self.model_name, "running": RUNNING},
+                ).fetchall()
+            )
+            if not checkpoints:
+                # A new migration; unfinished ones for other models are abandoned, and
+                # an earlier migration to this model (before a rollback) is replaced
+                conn.execute(
+                    text(
+                        "DELETE FROM embedding_migration "
+                        "WHERE model = :model OR status NOT IN (:settling, :switched)"
+                    ),
+                    {"model": self.model_name, "settling": SETTLING, "switched": SWITCHED},
+                )
+                for table in TABLES:
+                    conn.execute(
+                        text(
+                            f'ALTER TABLE "{table}" ADD COLUMN IF NOT EXISTS embedding_model TEXT, '
+                            "DROP COLUMN IF EXISTS embedding_next, DROP COLUMN IF EXISTS embedding_next_model"
+                        )
+                    )
+                    conn.execute(
+                        text(
+                            f'ALTER TABLE "{table}" ADD COLUMN embedding_next vector({dim}), '
+                            "ADD COLUMN embedding_next_model TEXT"
+                        )
+                    )
+                    conn.execute(
+                        text(
+                            "INSERT INTO embedding_migration (model, table_name, status) "
+                            "VALUES (:model, :table, :status)"
+                        ),
+                        {"model": self.model_name, "table": table, "status": RUNNING},
+                    )
+                logging.info(f"Starting re-embedding with {self.model_name} ({dim} dimensions)")
+            else:
+                logging.info(f"Resuming re-embedding with {self.model_name} after ids {checkpoints}")
+
+    async def _throttle(self, rows: int) -> None:
+        now = time.monotonic()
+        if self._next_write > now:
+            await asyncio.sleep(self._next_write - now)
+        self._next_write = max(self._next_write, now) + rows / self.rows_per_second
+
+    def _checkpoint(self, table: str) -> Tuple[int, int]:
+        with self.engine.connect() as conn:
+            return tuple(
+                conn.execute(
+                    text(
+                        "SELECT last_id, rows_done FROM embedding_migration "
+                        "WHERE model = :model AND table_name = :table"
+                    ),
+                    {"model": self.model_name, "table": table},
+                ).one()
+            )  # type: ignore[return-value]
+
+    def _next_rows(self, table: str, after_id: int) -> List[Tuple[int, str]]:
+        with self.engine.connect() as conn:
+            return [
+                tuple(row)
+                for row in conn.execute(
+                    text(f'SELECT id, content FROM "{table}" WHERE id > :after_id ORDER BY id LIMIT :limit'),
+                    {"after_id": after_id, "limit": self.batch_size},
+                )
+            ]  # type: ignore[misc]
+
+    def _stale_rows(self, table: str, limit: Optional[int] = None, conn=None) -> List[Tuple[int, str]]:
+        """Rows not yet embedded with the new model, e.g. written behind the walk"""
+        if conn is None:
+            with self.engine.connect() as conn:
+                return self._stale_rows(table, limit, conn)
+        query = f'SELECT id, content FROM "{table}" WHERE embedding_next_model IS DISTINCT FROM :model ORDER BY id'
+        params: Dict[str, Any] = {"model": self.model_name}
+        if limit is not None:
+            query += " LIMIT :limit"
+            params["limit"] = limit
+        return [tuple(row) for row in conn.execute(text(query), params)]  # type: ignore[misc]
+
+    def _write(
+        self, conn, table: str, ids: Sequence[int], vectors: Sequence[Sequence[float]], column: str = "embedding_next"
+    ) -> None:
+        conn.execute(
+            text(
+                f'UPDATE "{table}" SET {column} = CAST(:embedding AS vector), '
+                f"{column}_model = :model WHERE id = :id"
+            ),
+            [
+                {"id": row_id, "embedding": vector_literal(vector), "model": self.model_name}
+                for row_id, vector in zip(ids, vectors)
+            ],
+        )
+
+    def _commit_batch(self, table: str, ids: Sequence[int], vectors: Sequence[Sequence[float]]) -> None:
+        with self.engine.begin() as conn:
+            self._write(conn, table, ids, vectors)
+            conn.execute(
+                text(
+                    "UPDATE embedding_migration SET last_id = GREATEST(last_id, :last_id), "
+                    "rows_done = rows_done + :rows, updated_at = now() WHERE model = :model AND table_name = :table"
+                ),
+                {"last_id": max(ids), "rows": len(ids), "model": self.model_name, "table": table},
+            )
+
+    async def _walk(self, table: str) -> None:
+        last_id, rows_done = await asyncio.to_thread(self._checkpoint, table)
+        progress = self.progress[table] = {"last_id": last_id, "rows_done": rows_done}
+        started = time.perf_counter()
+        while True:
+            rows = await asyncio.to_thread(self._next_rows, table, last_id)
+            if not rows:
+                break
+            await self._throttle(len(rows))
+            ids = [row[0] for row in rows]
+            vectors = await self.embed([row[1] for row in rows])
+            await asyncio.to_thread(self._commit_batch, table, ids, vectors)
+            last_id = ids[-1]
+            progress["last_id"] = last_id
+            progress["rows_done"] += len(rows)
+        logging.info(
+            f"Re-embedded {table} up to id {last_id} ({progress['rows_done']} rows) "
+            f"in {time.perf_counter() - started:.0f}s"
+        )
+
+        # Rows written behind the walk are embedded outside the switch
+        # transaction until only a few are left
+        while True:
+            rows = await asyncio.to_thread(self._stale_rows, table, self.batch_size)
+            if len(rows) < self.batch_size:
+                return
+            await self._throttle(len(rows))
+            vectors = await self.embed([row[1] for row in rows])
+            await asyncio.to_thread(self._commit_batch, table, [row[0] for row in rows], vectors)
+            progress["rows_done"] += len(rows)
+
+    async def _switch(self) -> None:
+        """Embed the last stragglers and swap the columns in one transaction"""
+        loop = asyncio.get_running_loop()
+
+        def switch():
+            with self.engine.begin() as conn:
+                # Readers go on; writers wait until the new columns are live
+                tables = ", ".join(f'"{table}"' for table in TABLES)
+                conn.execute(text(f"LOCK TABLE {tables} IN SHARE MODE"))
+                for table in TABLES:
+                    rows = self._stale_rows(table, conn=conn)
+                    if rows:
+                        future = asyncio.run_coroutine_threadsafe(self.embed([row[1] for row in rows]), loop)
+                        self._write(conn, table, [row[0] for row in rows], future.result())
+                for table in TABLES:
+                    conn.execute(
+                        text(
+                            f'ALTER TABLE "{table}" DROP COLUMN IF EXISTS embedding_previous, '
+                            "DROP COLUMN IF EXISTS embedding_previous_model"
+                        )
+                    )
+                    for old, new in (
+                        ("embedding", "embedding_previous"),
+                        ("embedding_model", "embedding_previous_model"),
+                        ("embedding_next", "embedding"),
+                        ("embedding_next_model", "embedding_model"),
+                    ):
+                        conn.execute(text(f'ALTER TABLE "{table}" RENAME COLUMN {old} TO {new}'))
+                    conn.execute(
+                        text(
+                            f'ALTER TABLE "{table}" ALTER COLUMN embedding_previous DROP NOT NULL, '
+                            "ALTER COLUMN embedding SET NOT NULL"
+                        )
+                    )
+                    # Writers are locked out, so rows past this id were stored after the switch
+                    conn.execute(
+                        text(
+                            f'UPDATE embedding_migration SET last_id = (SELECT COALESCE(MAX(id), 0) FROM "{table}") '
+                            "WHERE model = :model AND table_name = :table"
+                        ),
+                        {"model": self.model_name, "table": table},
+                    )
+                conn.execute(
+                    text("UPDATE embedding_migration SET status = :status, updated_at = now() WHERE model = :model"),
+                    {"status": SETTLING, "model": self.model_name},
+                )
+
+        await asyncio.to_thread(switch)
+        logging.info(f"Switched stored embeddings to {self.model_name}")
+
+    def _untagged_rows(self, table: str, after_id: int) -> List[Tuple[int, str]]:
+        with self.engine.connect() as conn:
+            return [
+                tuple(row)
+                for row in conn.execute(
+                    text(
+                        f'SELECT id, content FROM "{table}" WHERE id > :after_id AND embedding_model IS NULL '
+                        "ORDER BY id LIMIT :limit"
+                    ),
+                    {"after_id": after_id, "limit": self.batch_size},
+                )
+            ]  # type: ignore[misc]
+
+    def _commit_settled(self, table: str, ids: Sequence[int], vectors: Sequence[Sequence[float]]) -> None:
+        with self.engine.begin() as conn:
+            self._write(conn, table, ids, vectors, column="embedding")
+
+    def _mark_switched(self) -> None:
+        with self.engine.begin() as conn:
+            conn.execute(
+                text("UPDATE embedding_migration SET status = :status, updated_at = now() WHERE model = :model"),
+                {"status": SWITCHED, "model": self.model_name},
+            )
+
+    async def _settle(self) -> None:
+        """Re-embed rows stored since the switch, once old instances have stopped embedding"""
+        await asyncio.sleep(self.settle_seconds)
+        for table in TABLES:
+            last_id, _ = await asyncio.to_thread(self._checkpoint, table)
+            settled = 0
+            while True:
+                rows = await asyncio.to_thread(self._untagged_rows, table, last_id)
+                if not rows:
+                    break
+                await self._throttle(len(rows))
+                ids = [row[0] for row in rows]
+                vectors = await self.embed([row[1] for row in rows])
+                await asyncio.to_thread(self._commit_settled, table, ids, vectors)
+                last_id = ids[-1]
+                settled += len(rows)
+            logging.info(f"Re-embedded {settled} rows of {table} stored since the switch")
+        await asyncio.to_thread(self._mark_switched)
@@ -0,0 +1,93 @@
+from collections import deque
+from typing import Any, Deque, Dict, Tuple
+import asyncio
+import time
+from observability import LANE_QUEUE_DEPTH, LANE_RUNNING, LANE_WAIT_SECONDS
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+# In priority order
+LANES = (INTERACTIVE, BULK)
+
+
+class LaneScheduler:
+    """
+    Hands out `workers` inference slots to jobs waiting in priority lanes.
+    Whenever a slot frees up it goes to the oldest interactive job, and only
+    to a bulk job when no interactive job is waiting. Bulk jobs never hold
+    more than `bulk_max_workers` slots at once, so with several workers some
+    are always left for interactive requests. Running jobs are not
+    interrupted; callers keep jobs to one forward batch so an interactive
+    job waits at most that long.
+    """
+
+    def __init__(self, workers: int, bulk_max_workers: int):
+        self.workers = max(1, workers)
+        self.limits = {
+            INTERACTIVE: self.workers,
+            BULK: max(1, min(self.workers, bulk_max_workers)),
+        }
+        self.running = {lane: 0 for lane in LANES}
+        self.waiting: Dict[str, Deque[Tuple[asyncio.Future, float]]] = {lane: deque() for lane in LANES}
+        self.granted = {lane: 0 for lane in LANES}
+        self.wait_seconds = {lane: 0.0 for lane in LANES}
+
+    async def acquire(self, lane: str) -> None:
+        """Wait for a slot in `lane`; every acquire must be paired with release()"""
+        if lane not in self.limits:
+            raise ValueError(f"Unknown lane: {lane}")
+        entry = (asyncio.get_running_loop().create_future(), time.perf_counter())
+        self.waiting[lane].append(entry)
+        self._grant()
+        try:
+            await entry[0]
+        except asyncio.CancelledError:
+            if entry[0].cancelled():
+                try:
+                    self.waiting[lane].remove(entry)
+                except ValueError:
+                    pass
+                LANE_QUEUE_DEPTH.set(len(self.waiting[lane]), lane)
+            else:
+                # Granted just before the caller was cancelled
+                self.release(lane)
+            raise
+
+    def release(self, lane: str) -> None:
+        self.running[lane] -= 1
+        LANE_RUNNING.set(self.running[lane], lane)
+        self._grant()
+
+    def _grant(self) -> None:
+        for lane in LANES:
+            queue = self.waiting[lane]
+            while (
+                queue
+                and sum(self.running.values()) < self.workers
+                and self.running[lane] < self.limits[lane]
+            ):
+                future, queued_at = queue.popleft()
+                if future.done():
+                    continue
+                waited = time.perf_counter() - queued_at
+                self.running[lane] += 1
+                self.granted[lane] += 1
+                self.wait_seconds[lane] += waited
+                LANE_WAIT_SECONDS.observe(waited, lane)
+                future.set_result(None)
+            LANE_QUEUE_DEPTH.set(len(queue), lane)
+            LANE_RUNNING.set(self.running[lane], lane)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            lane: {
+                "max_workers": self.limits[lane],
+                "running": self.running[lane],
+                "queue_depth": len(self.waiting[lane]),
+                "jobs": self.granted[lane],
+                "mean_wait_ms": (
+                    self.wait_seconds[lane] / self.granted[lane] * 1000.0 if self.granted[lane] else 0.0
+                ),
+            }
+            for lane in LANES
+        }
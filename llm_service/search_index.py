@@ -0,0 +1,544 @@
+"""
+In-process approximate nearest-neighbour index over the stored chunk
+embeddings in FilContent and taleSegmentChunk.
+
+The index is an inverted file (IVF): vectors are clustered around `nlist`
+k-means centroids and stored grouped by cluster, and a query only scans the
+`nprobe` clusters whose centroids are closest to it. A snapshot is a
+directory of .npy files that are memory-mapped on load, so a restart does
+not rebuild or read the whole index into memory. Rows added since the
+snapshot are kept in a small in-memory delta that is searched exhaustively
+and merged into the next snapshot.
+
+Snapshots also hold int8 codes of the vectors (see quantization.py).
+Probed rows are screened by their code score and only the best candidates
+are read in full and rescored, so a query touches a quarter of the bytes
+of the full vectors plus the candidates.
+
+Each snapshot also holds one vector per document (file or speech segment):
+the token-weighted mean of its chunk vectors. Two-stage search ranks
+those first and then only scores the chunks of the best documents.
+"""
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+import json
+import logging
+import os
+import shutil
+import time
+import numpy as np
+from quantization import int8_scores, normalize, quantize_int8
+
+SOURCES = ("FilContent", "taleSegmentChunk")
+
+METADATA_DTYPE = np.dtype(
+    [
+        ("source", "u1"),
+        ("row_id", "<i8"),
+        ("parent_id", "<i8"),  # filid or tale_segment_id
+        ("chunk_index", "<i4"),
+        ("version", "<i4"),
+        ("periode_id", "<i4"),  # -1 when unknown
+        ("document_type_id", "<i4"),  # -1 when unknown
+    ]
+)
+
+# Newest version of every file only; the periode of a document is the one of its case
+FIL_CONTENT_QUERY = """
+    SELECT fc.id, fc.filid, fc.chunkindex, fc.version, {embedding}, fc.content,
+           (SELECT MIN(s.periodeid) FROM sagdokument sd JOIN sag s ON s.id = sd.sagid
+            WHERE sd.dokumentid = f.dokumentid) AS periodeid,
+           d.typeid
+    FROM "FilContent" fc
+    JOIN fil f ON f.id = fc.filid
+    LEFT JOIN dokument d ON d.id = f.dokumentid
+    WHERE fc.id > :after_id
+      AND fc.version = (SELECT MAX(version) FROM "FilContent" WHERE filid = fc.filid)
+    ORDER BY fc.id
+    LIMIT :limit
+"""
+
+TALE_SEGMENT_CHUNK_QUERY = """
+    SELECT tc.id, tc.tale_segment_id, tc.chunk_index, 1, {embedding}, tc.content, m.periodeid, NULL
+    FROM "taleSegmentChunk" tc
+    JOIN "taleSegmentRaw" tr ON tr.id = tc.tale_segment_id
+    LEFT JOIN "Møde" m ON m.id = tr."mødeid"
+    WHERE tc.id > :after_id
+    ORDER BY tc.id
+    LIMIT :limit
+"""
+
+
+def fetch_chunks(
+    engine, source: str, after_id: int = 0, page_size: int = 5000, with_vectors: bool = True
+) -> Iterator[Tuple[Optional[np.ndarray], np.ndarray, List[str]]]:
+    """
+    Yield (unit vectors, metadata, chunk texts) pages of rows of `source`
+    with id > `after_id`; without `with_vectors` the embeddings are not read.
+    """
+    from sqlalchemy import text
+
+    template = FIL_CONTENT_QUERY if source == "FilContent" else TALE_SEGMENT_CHUNK_QUERY
+    alias = "fc" if source == "FilContent" else "tc"
+    query = text(template.format(embedding=f"{alias}.embedding::text" if with_vectors else "NULL"))
+    source_code = SOURCES.index(source)
+    while True:
+        with engine.connect() as conn:
+            rows = conn.execute(query, {"after_id": after_id, "limit": page_size}).fetchall()
+        if not rows:
+            return
+        metadata = np.array(
+            [
+                (
+                    source_code,
+                    row_id,
+                    parent_id,
+                    chunk_index,
+                    version,
+                    periode_id if periode_id is not None else -1,
+                    type_id if type_id is not None else -1,
+                )
+                for row_id, parent_id, chunk_index, version, _, _, periode_id, type_id in rows
+            ],
+            dtype=METADATA_DTYPE,
+        )
+        vectors = None
+        if with_vectors:
+            vectors = normalize(
+                np.vstack([np.fromstring(row[4].strip("[]"), sep=",", dtype=np.float32) for row in rows])
+            )
+        yield vectors, metadata, [row[5] for row in rows]
+        after_id = rows[-1][0]
+
+
+def chunk_weights(tokenizer, texts: Sequence[str]) -> np.ndarray:
+    """
+    Token counts of stored chunk texts, for weighting them in document
+    vectors; the same weights as the document embeddings of the API, since
+    chunk texts re-tokenize to the ids that were embedded
+    """
+    if not len(texts):
+        return np.empty(0, dtype=np.float32)
+    input_ids = tokenizer(list(texts), add_special_tokens=False)["input_ids"]
+    return np.array([max(1, len(ids)) for ids in input_ids], dtype=np.float32)
+
+
+def document_vectors(vectors: np.ndarray, weights: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """
+    Unit-length weighted mean of the vectors of each document, where the
+    rows of document i are vectors[starts[i]:starts[i + 1]]
+    """
+    if not len(starts):
+        return np.empty((0, vectors.shape[1]), dtype=np.float32)
+    sums = np.add.reduceat(np.asarray(vectors, dtype=np.float32) * np.asarray(weights)[:, None], starts, axis=0)
+    return normalize(sums)
+
+
+def superseded(new: np.ndarray, existing: np.ndarray) -> np.ndarray:
+    """Indices of FilContent rows in `existing` older than a version in `new` of the same file"""
+    fil_code = SOURCES.index("FilContent")
+    fil = new["source"] == fil_code
+    if not fil.any() or not len(existing):
+        return np.empty(0, dtype=np.int64)
+    newest: Dict[int, int] = {}
+    for parent_id, version in zip(new["parent_id"][fil].tolist(), new["version"][fil].tolist()):
+        newest[parent_id] = max(version, newest.get(parent_id, version))
+    candidates = np.flatnonzero((existing["source"] == fil_code) & np.isin(existing["parent_id"], list(newest)))
+    return np.array(
+        [i for i in candidates if existing["version"][i] < newest[int(existing["parent_id"][i])]],
+        dtype=np.int64,
+    )
+
+
+def save_snapshot(
+    path: str,
+    arrays: Dict[str, np.ndarray],
+    manifest: Dict[str, Any],
+    json_files: Optional[Dict[str, Any]] = None,
+) -> None:
+    """
+    Write .npy files, `json_files` (name -> JSON-serializable value) and a
+    manifest next to `path` and swap them into place
+    """
+    staging = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    for name, array in arrays.items():
+        np.save(os.path.join(staging, f"{name}.npy"), np.asarray(array))
+    for name, value in (json_files or {}).items():
+        with open(os.path.join(staging, f"{name}.json"), "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False)
+    with open(os.path.join(staging, "manifest.json"), "w") as f:
+        json.dump({**manifest, "saved_at": time.time()}, f, indent=2)
+
+    previous = f"{path}.old-{os.getpid()}"
+    if os.path.exists(path):
+        os.rename(path, previous)
+    os.rename(staging, path)
+    # Open memory maps of the previous snapshot stay valid after removal
+    shutil.rmtree(previous, ignore_errors=True)
+
+
+def watermarks(metadata_parts: Sequence[np.ndarray]) -> Dict[str, int]:
+    """Highest row id per source, to fetch only newer rows"""
+    marks = {}
+    for code, source in enumerate(SOURCES):
+        ids = [metadata["row_id"][metadata["source"] == code] for metadata in metadata_parts]
+        marks[source] = int(max((part.max() for part in ids if len(part)), default=0))
+    return marks
+
+
+def kmeans(vectors: np.ndarray, k: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Spherical k-means on unit vectors; returns unit centroids"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = assign(vectors, centroids)
+        counts = np.bincount(assignment, minlength=k)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        nonempty = counts > 0
+        sums = np.zeros_like(centroids)
+        sums[nonempty] = np.add.reduceat(vectors[np.argsort(assignment, kind="stable")], starts[nonempty], axis=0)
+        # Reseed empty clusters with random vectors
+        sums[~nonempty] = vectors[rng.choice(len(vectors), int((~nonempty).sum()))]
+        centroids = normalize(sums)
+    return centroids
+
+
+def assign(vectors: np.ndarray, centroids: np.ndarray, block: int = 16384) -> np.ndarray:
+    """Index of the nearest centroid of every vector"""
+    assignment = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), block):
+        assignment[start : start + block] = np.argmax(vectors[start : start + block] @ centroids.T, axis=1)
+    return assignment
+
+
+class IvfIndex:
+    """
+    Inverted-file index of unit vectors with per-vector metadata. Vectors of
+    cluster `c` are `vectors[offsets[c]:offsets[c + 1]]`; `removed` marks
+    rows superseded by a newer version of the same file, and `weights` are
+    the token counts of the chunks. `codes` and `scales` are the int8 codes
+    of the vectors used to screen candidates, or None to score every probed
+    vector in full.
+
+    `documents` is (vectors, metadata, offsets, rows): the chunks of
+    document `d` are the rows `rows[offsets[d]:offsets[d + 1]]`. It covers
+    the snapshot rows only and is built on first use if the snapshot has
+    none.
+    """
+
+    def __init__(
+        self,
+        centroids: np.ndarray,
+        offsets: np.ndarray,
+        vectors: np.ndarray,
+        metadata: np.ndarray,
+        removed: Optional[np.ndarray] = None,
+        weights: Optional[np.ndarray] = None,
+        documents: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = None,
+        codes: Optional[np.ndarray] = None,
+        scales: Optional[np.ndarray] = None,
+    ):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.vectors = vectors
+        self.metadata = metadata
+        self.removed = np.zeros(len(vectors), dtype=bool) if removed is None else np.array(removed)
+        self.weights = np.ones(len(vectors), dtype=np.float32) if weights is None else weights
+        self._documents = documents
+        self.codes = codes
+        self.scales = scales
+        # (vectors, metadata, removed, weights) of rows added since the
+        # snapshot, replaced as a whole so concurrent searches see a
+        # consistent delta
+        self.delta = (
+            np.empty((0, centroids.shape[1]), dtype=np.float32),
+            np.empty(0, dtype=METADATA_DTYPE),
+            np.empty(0, dtype=bool),
+            np.empty(0, dtype=np.float32),
+        )
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    def __len__(self) -> int:
+        delta_vectors, _, delta_removed, _ = self.delta
+        return int(len(self.vectors) - self.removed.sum() + len(delta_vectors) - delta_removed.sum())
+
+    @property
+    def documents(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        if self._documents is None:
+            # Live chunks grouped by (source, parent_id)
+            live = np.flatnonzero(~self.removed)
+            metadata = np.asarray(self.metadata[live])
+            order = np.lexsort((metadata["chunk_index"], metadata["parent_id"], metadata["source"]))
+            rows, metadata = live[order], metadata[order]
+            first = np.ones(len(rows), dtype=bool)
+            first[1:] = (metadata["source"][1:] != metadata["source"][:-1]) | (
+                metadata["parent_id"][1:] != metadata["parent_id"][:-1]
+            )
+            starts = np.flatnonzero(first)
+            offsets = np.append(starts, len(rows)).astype(np.int64)
+            vectors = document_vectors(np.asarray(self.vectors[rows]), np.asarray(self.weights[rows]), starts)
+            self._documents = (vectors, metadata[starts], offsets, rows.astype(np.int64))
+        return self._documents
+
+    @classmethod
+    def build(
+        cls,
+        vectors: np.ndarray,
+        metadata: np.ndarray,
+        nlist: Optional[int] = None,
+        seed: int = 0,
+        weights: Optional[np.ndarray] = None,
+    ) -> "IvfIndex":
+        if nlist is None:
+            nlist = int(4 * np.sqrt(len(vectors)))
+        nlist = max(1, min(nlist, len(vectors)))
+        # k-means on a sample is enough to place the centroids
+        rng = np.random.default_rng(seed)
+        sample = vectors[rng.choice(len(vectors), min(len(vectors), 64 * nlist), replace=False)]
+        centroids = kmeans(sample, nlist, seed=seed)
+
+        assignment = assign(vectors, centroids)
+        order = np.argsort(assignment, kind="stable")
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=nlist), out=offsets[1:])
+        weights = np.ones(len(vectors), dtype=np.float32) if weights is None else np.asarray(weights, dtype=np.float32)
+        vectors = vectors[order]
+        codes, scales = quantize_int8(vectors)
+        index = cls(centroids, offsets, vectors, metadata[order], weights=weights[order], codes=codes, scales=scales)
+        index.removed[superseded(index.metadata, index.metadata)] = True
+        return index
+
+    @classmethod
+    def load(cls, path: str) -> "IvfIndex":
+        def array(name):
+            file = os.path.join(path, f"{name}.npy")
+            return np.load(file, mmap_mode="r") if os.path.exists(file) else None
+
+        documents = None
+        if os.path.exists(os.path.join(path, "document_vectors.npy")):
+            documents = tuple(
+                array(f"document_{name}") for name in ("vectors", "metadata", "offsets", "rows")
+            )
+        return cls(
+            array("centroids"),
+            np.array(array("offsets")),
+            array("vectors"),
+            array("metadata"),
+            array("removed"),
+            array("weights"),
+            documents,
+            array("codes"),
+            array("scales"),
+        )
+
+    def merged(self) -> "IvfIndex":
+        """A new index with the delta rows moved into their clusters"""
+        delta_vectors, delta_metadata, delta_removed, delta_weights = self.delta
+        if not len(delta_vectors):
+            return self
+        vectors = np.concatenate([self.vectors, delta_vectors])
+        metadata = np.concatenate([self.metadata, delta_metadata])
+        removed = np.concatenate([self.removed, delta_removed])
+        weights = np.concatenate([self.weights, delta_weights])
+        assignment = np.concatenate(
+            [
+                np.repeat(np.arange(self.nlist, dtype=np.int32), np.diff(self.offsets)),
+                assign(delta_vectors, self.centroids),
+            ]
+        )
+        order = np.argsort(assignment, kind="stable")
+        offsets = np.zeros(self.nlist + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=self.nlist), out=offsets[1:])
+        if self.codes is not None:
+            delta_codes, delta_scales = quantize_int8(delta_vectors)
+            codes = np.concatenate([self.codes, delta_codes])[order]
+            scales = np.concatenate([self.scales, delta_scales])[order]
+        else:
+            codes, scales = quantize_int8(vectors[order])
+        return IvfIndex(
+            self.centroids,
+            offsets,
+            vectors[order],
+            metadata[order],
+            removed[order],
+            weights[order],
+            codes=codes,
+            scales=scales,
+        )
+
+    def save(self, path: str, manifest: Optional[Dict[str, Any]] = None) -> None:
+        """Write a snapshot (delta included) next to `path` and swap it into place"""
+        index = self.merged()
+        arrays = {
+            name: getattr(index, name) for name in ("centroids", "offsets", "vectors", "metadata", "removed", "weights")
+        }
+        # Snapshots written before codes existed get them on their next save
+        arrays["codes"], arrays["scales"] = (
+            (index.codes, index.scales) if index.codes is not None else quantize_int8(np.asarray(index.vectors))
+        )
+        for name, array in zip(("vectors", "metadata", "offsets", "rows"), index.documents):
+            arrays[f"document_{name}"] = array
+        save_snapshot(path, arrays, {**(manifest or {}), **index.stats()})
+
+    def watermarks(self) -> Dict[str, int]:
+        return watermarks([self.metadata, self.delta[1]])
+
+    def add(self, vectors: np.ndarray, metadata: np.ndarray, weights: Optional[np.ndarray] = None) -> None:
+        """Add rows to the delta; older versions of the same files are removed"""
+        delta_vectors, delta_metadata, delta_removed, delta_weights = self.delta
+        if weights is None:
+            weights = np.ones(len(vectors), dtype=np.float32)
+        delta_metadata = np.concatenate([delta_metadata, metadata])
+        delta_removed = np.concatenate([delta_removed, np.zeros(len(vectors), dtype=bool)])
+        delta_removed[superseded(metadata, delta_metadata)] = True
+        self.delta = (
+            np.concatenate([delta_vectors, vectors.astype(np.float32)]),
+            delta_metadata,
+            delta_removed,
+            np.concatenate([delta_weights, np.asarray(weights, dtype=np.float32)]),
+        )
+        self.removed[superseded(metadata, self.metadata)] = True
+
+    def _mask(self, metadata: np.ndarray, removed: np.ndarray, filters: Dict[str, Optional[Sequence]]) -> np.ndarray:
+        mask = ~np.asarray(removed)
+        if filters.get("sources"):
+            mask &= np.isin(metadata["source"], [SOURCES.index(s) for s in filters["sources"]])
+        if filters.get("periode_ids"):
+            mask &= np.isin(metadata["periode_id"], filters["periode_ids"])
+        if filters.get("document_type_ids"):
+            mask &= np.isin(metadata["document_type_id"], filters["document_type_ids"])
+        return mask
+
+    def search(
+        self,
+        query: np.ndarray,
+        k: int = 10,
+        nprobe: int = 16,
+        sources: Optional[Sequence[str]] = None,
+        periode_ids: Optional[Sequence[int]] = None,
+        document_type_ids: Optional[Sequence[int]] = None,
+        documents: Optional[int] = None,
+        candidates: Optional[int] = None,
+    ) -> List[Tuple[np.void, float]]:
+        """
+        (metadata, cosine similarity) of the best `k` rows matching the
+        filters. If the probed clusters hold fewer than `k` matches, more
+        clusters are probed. With `documents`, the clusters are not probed;
+        instead the chunks of the `documents` best matching documents are
+        scored. With codes, `candidates` (default 10 * k) rows are kept by
+        code score and rescored with the full vectors.
+        """
+        query = normalize(query)
+        filters = {"sources": sources, "periode_ids": periode_ids, "document_type_ids": document_type_ids}
+
+        # The delta is small and searched in full
+        scores: List[np.ndarray] = []
+        rows: List[np.ndarray] = []
+        delta_vectors, delta_metadata, delta_removed, _ = self.delta
+        if len(delta_vectors):
+            mask = self._mask(delta_metadata, delta_removed, filters)
+            scores.append((delta_vectors[mask] @ query).astype(np.float32))
+            rows.append(delta_metadata[mask])
+
+        if documents:
+            snapshot_rows = self._search_documents(query, documents, filters)
+        else:
+            snapshot_rows = self._search_clusters(query, k, nprobe, filters)
+        if len(snapshot_rows):
+            snapshot_rows, snapshot_scores = self._score(snapshot_rows, query, max(k, candidates or 10 * k))
+            scores.append(snapshot_scores)
+            rows.append(np.asarray(self.metadata[snapshot_rows]))
+
+        if not scores:
+            return []
+        all_scores = np.concatenate(scores)
+        all_rows = np.concatenate(rows)
+        top = np.argsort(-all_scores)[:k]
+        return [(all_rows[i], float(all_scores[i])) for i in top]
+
+    def _score(self, rows: np.ndarray, query: np.ndarray, candidates: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Cosine similarity of snapshot rows (sorted). With codes, only the best
+        `candidates` by code score are read in full and rescored.
+        """
+        if self.codes is not None and len(rows) > candidates:
+            screened = int8_scores(np.asarray(self.codes[rows]), np.asarray(self.scales[rows]), query)
+            rows = np.sort(rows[np.argpartition(-screened, candidates - 1)[:candidates]])
+        return rows, (np.asarray(self.vectors[rows]) @ query).astype(np.float32)
+
+    def _search_clusters(self, query, k, nprobe, filters) -> np.ndarray:
+        """Snapshot rows matching the filters in the probed clusters"""
+        ranked_lists = np.argsort(-(self.centroids @ query))
+        nprobe = max(1, min(nprobe, self.nlist))
+        probed = 0
+        found: List[np.ndarray] = []
+        while True:
+            for cluster in ranked_lists[probed:nprobe]:
+                start, end = int(self.offsets[cluster]), int(self.offsets[cluster + 1])
+                if start == end:
+                    continue
+                mask = self._mask(np.asarray(self.metadata[start:end]), self.removed[start:end], filters)
+                found.append(start + np.flatnonzero(mask))
+            probed = nprobe
+            if sum(len(part) for part in found) >= k or nprobe >= self.nlist:
+                break
+            nprobe = min(self.nlist, nprobe * 2)
+        return np.sort(np.concatenate(found)) if found else np.empty(0, dtype=np.int64)
+
+    def _search_documents(self, query, documents, filters) -> np.ndarray:
+        """Snapshot rows matching the filters among the chunks of the best documents"""
+        document_vectors, document_metadata, offsets, document_rows = self.documents
+        candidates = np.flatnonzero(
+            self._mask(document_metadata, np.zeros(len(document_metadata), dtype=bool), filters)
+        )
+        if not len(candidates):
+            return np.empty(0, dtype=np.int64)
+        document_scores = np.asarray(document_vectors[candidates]) @ query
+        if documents < len(candidates):
+            candidates = candidates[np.argpartition(-document_scores, documents - 1)[:documents]]
+        chunk_rows = np.sort(
+            np.concatenate([document_rows[offsets[d] : offsets[d + 1]] for d in candidates])
+        )
+        mask = self._mask(np.asarray(self.metadata[chunk_rows]), self.removed[chunk_rows], filters)
+        return chunk_rows[mask]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "vectors": len(self),
+            "nlist": self.nlist,
+            "documents": len(self._documents[0]) if self._documents is not None else None,
+            "delta": int(len(self.delta[0])),
+            "removed": int(self.removed.sum() + self.delta[2].sum()),
+            "dim": int(self.centroids.shape[1]),
+            "codes": "int8" if self.codes is not None else None,
+        }
+
+
+def build_from_database(engine, tokenizer, nlist: Optional[int] = None) -> IvfIndex:
+    """Read every stored chunk embedding and build a new index"""
+    vectors, metadata, weights = [], [], []
+    for source in SOURCES:
+        for page_vectors, page_metadata, texts in fetch_chunks(engine, source):
+            vectors.append(page_vectors)
+            metadata.append(page_metadata)
+            weights.append(chunk_weights(tokenizer, texts))
+    if not vectors:
+        raise RuntimeError("No chunk embeddings found to index")
+    started = time.perf_counter()
+    index = IvfIndex.build(np.concatenate(vectors), np.concatenate(metadata), nlist, weights=np.concatenate(weights))
+    logging.info(f"Built search index of {len(index)} vectors in {time.perf_counter() - started:.1f}s")
+    return index
+
+
+def refresh_from_database(index: IvfIndex, engine, tokenizer) -> int:
+    """Add rows stored since the index was last updated; returns the number added"""
+    added = 0
+    for source, after_id in index.watermarks().items():
+        for vectors, metadata, texts in fetch_chunks(engine, source, after_id):
+            index.add(vectors, metadata, chunk_weights(tokenizer, texts))
+            added += len(vectors)
+    return added
@@ -0,0 +1,67 @@
+import random
+
+import pytest
+from chunking import chunk_document
+from search_index import chunk_weights
+
+WORDS = (
+    "folketinget vedtog lovforslaget om ændring af skatteloven udvalget har behandlet "
+    "beslutningsforslaget ministeren blev spurgt om regeringens plan for den grønne omstilling "
+    "kommunerne skal sikre at borgerne får hjælp inden for rimelig tid"
+).split()
+
+
+@pytest.fixture(scope="module")
+def tokenizer():
+    tokenizers = pytest.importorskip("tokenizers")
+    transformers = pytest.importorskip("transformers")
+
+    # A small vocabulary, so most words are split into word pieces
+    wordpiece = tokenizers.Tokenizer(tokenizers.models.WordPiece(unk_token="[UNK]"))
+    wordpiece.normalizer = tokenizers.normalizers.BertNormalizer(lowercase=True, strip_accents=False)
+    wordpiece.pre_tokenizer = tokenizers.pre_tokenizers.BertPreTokenizer()
+    wordpiece.train_from_iterator(
+        [" ".join(WORDS)] * 10,
+        tokenizers.trainers.WordPieceTrainer(vocab_size=80, special_tokens=["[PAD]", "[UNK]", "[CLS]", "[SEP]"]),
+    )
+    return transformers.PreTrainedTokenizerFast(tokenizer_object=wordpiece, unk_token="[UNK]")
+
+
+def document(seed, words=2000):
+    rng = random.Random(seed)
+    return " ".join(rng.choice(WORDS) + ("." if rng.random() < 0.1 else "") for _ in range(words))
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_chunk_text_tokenizes_to_its_ids(tokenizer, seed):
+    for chunk in chunk_document(tokenizer, document(seed), chunk_size=64, overlap=10):
+        assert tokenizer(chunk.text, add_special_tokens=False)["input_ids"] == chunk.input_ids
+
+
+def test_index_weights_match_response_token_counts(tokenizer):
+    # The stored index and the API response weigh chunks the same way
+    chunks = chunk_document(tokenizer, document(1), chunk_size=64, overlap=10)
+    weights = chunk_weights(tokenizer, [chunk.text for chunk in chunks])
+    assert weights.tolist() == [len(chunk.input_ids) for chunk in chunks]
+
+
+def test_windows_fit_and_cover_the_text(tokenizer):
+    text = document(0)
+    chunks = chunk_document(tokenizer, text, chunk_size=64, overlap=10)
+    assert all(len(chunk.input_ids) <= 62 for chunk in chunks)
+    assert chunks[0].start_char == 0 and chunks[-1].end_char == len(text)
+    assert all(b.start_char < a.end_char for a, b in zip(chunks, chunks[1:]))
+    assert all(chunk.text == text[chunk.start_char : chunk.end_char] for chunk in chunks)
+
+
+def test_word_longer_than_window_is_still_cut(tokenizer):
+    # Under WordPiece's 100 character limit, so it is split into pieces rather than [UNK]
+    word = "folketinget" * 8
+    chunks = chunk_document(tokenizer, word, chunk_size=8, overlap=2)
+    assert len(chunks) > 1
+    assert all(len(chunk.input_ids) <= 6 for chunk in chunks)
+    assert sum(len(chunk.input_ids) for chunk in chunks) >= len(tokenizer(word, add_special_tokens=False)["input_ids"])
+
+
+def test_empty_text_gives_one_empty_chunk(tokenizer):
+    assert [chunk.text for chunk in chunk_document(tokenizer, "")] == [""]
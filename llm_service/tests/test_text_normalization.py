@@ -0,0 +1,82 @@
+import re
+
+import pytest
+from text_normalization import DanishTextNormalizer, load_danish_stopwords
+
+STOPWORDS = load_danish_stopwords()
+
+
+def legacy_preprocess_text(text):
+    """preprocess_danish_text as it was before DanishTextNormalizer"""
+    text = text.lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    words = text.split()
+    words = [word for word in words if word not in STOPWORDS]
+    text = " ".join(words)
+    text = re.sub(r"<[^>]*>", "", text)
+    return text
+
+
+UNTAGGED = [
+    "Folketinget vedtog i dag lovforslaget om ændring af skatteloven.",
+    "Ministeren blev spurgt om regeringens plan for den grønne omstilling.",
+    "Forslag til lov om ændring af lov om social service (L 123).",
+    "Afstemningen om B 45 blev udskudt til næste møde i salen.",
+    "  Udvalget   har\tbehandlet\n\nbeslutningsforslaget og indstiller det til forkastelse.  ",
+    "§ 5, stk. 2, affattes således: »Kommunalbestyrelsen skal ...«",
+    "ÆØÅ æøå Og OG og Folketinget FOLKETINGET",
+    "",
+    "   \n\t ",
+]
+
+# Tags surrounded by whitespace, where both pipelines keep the same words
+TAGGED = [
+    '<p class="tekst"> Forslag til lov om ændring af lov om social service </p>',
+    "<html> <body> <h1> Betænkning </h1> <p> Udvalget har behandlet lovforslaget </p> </body> </html>",
+    "Spørgsmålet drejer sig om ventetider <br> i sundhedsvæsenet",
+]
+
+
+@pytest.fixture(scope="module")
+def normalizer():
+    return DanishTextNormalizer(STOPWORDS)
+
+
+@pytest.mark.parametrize("text", UNTAGGED)
+def test_matches_legacy_without_tags(normalizer, text):
+    assert normalizer.normalize(text) == legacy_preprocess_text(text)
+
+
+@pytest.mark.parametrize("text", TAGGED)
+def test_matches_legacy_words_with_separated_tags(normalizer, text):
+    assert normalizer.normalize(text) == " ".join(legacy_preprocess_text(text).split())
+
+
+def test_separated_tag_leaves_no_double_space(normalizer):
+    # The legacy pipeline removed a tag word after joining, leaving its spaces behind
+    text = "ventetider <br> sundhedsvæsenet"
+    assert legacy_preprocess_text(text) == "ventetider  sundhedsvæsenet"
+    assert normalizer.normalize(text) == "ventetider sundhedsvæsenet"
+
+
+def test_tag_between_words_becomes_a_space(normalizer):
+    # The legacy pipeline removed tags after joining, gluing the neighbours together
+    text = "lovforslaget<br>vedtaget"
+    assert legacy_preprocess_text(text) == "lovforslagetvedtaget"
+    assert normalizer.normalize(text) == "lovforslaget vedtaget"
+
+
+def test_stopword_next_to_tag_is_dropped(normalizer):
+    # The legacy pipeline saw "og<b>" as one word, so the stopword survived
+    text = "skat og<b>afgifter</b>"
+    assert legacy_preprocess_text(text) == "skat ogafgifter"
+    assert normalizer.normalize(text) == "skat afgifter"
+
+
+def test_tag_with_spaces_is_removed_whole(normalizer):
+    text = 'Udvalget <span class="note" title="til og med">betænkning</span>'
+    assert normalizer.normalize(text) == "udvalget betænkning"
+
+
+def test_normalize_many(normalizer):
+    assert normalizer.normalize_many(UNTAGGED) == [legacy_preprocess_text(text) for text in UNTAGGED]
@@ -0,0 +1,27 @@
+import numpy as np
+from wire_format import binary_document_response, unpack_document
+
+
+def test_binary_document_response_keeps_chunk_metadata():
+    vectors = np.random.default_rng(0).standard_normal((3, 8)).astype(np.float32)
+    fields = {"status": "success", "chunks": ["første", "anden æøå", "tredje"], "document_embedding": [0.5] * 8}
+    response = binary_document_response(fields, vectors, "float32")
+
+    header, decoded = unpack_document(response.body)
+    assert header["chunks"] == fields["chunks"]
+    assert header["document_embedding"] == fields["document_embedding"]
+    assert header["shape"] == [3, 8]
+    assert response.headers["X-Embedding-Shape"] == "3,8"
+    np.testing.assert_array_equal(decoded, vectors)
+
+
+def test_binary_document_response_float16():
+    vectors = np.random.default_rng(1).standard_normal((2, 4)).astype(np.float32)
+    header, decoded = unpack_document(binary_document_response({"chunks": ["a", "b"]}, vectors, "float16").body)
+    assert header["dtype"] == "float16"
+    np.testing.assert_allclose(decoded, vectors, atol=1e-2)
+
+
+def test_binary_document_response_without_chunks():
+    header, decoded = unpack_document(binary_document_response({"chunks": []}, [], "float32").body)
+    assert header["chunks"] == [] and decoded.size == 0
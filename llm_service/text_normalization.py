@@ -0,0 +1,55 @@
+from typing import Iterable, List, Optional, Set
+import os
+import re
+
+# Parliamentary-specific stopwords on top of the Danish list
+PARLIAMENTARY_STOPWORDS = {
+    "folketinget",
+    "minister",
+    "lovforslag",
+    "beslutningsforslag",
+    "udvalg",
+    "afstemning",
+    "paragraf",
+    "stk",
+    "behandling",
+    "møde",
+    "dagsorden",
+}
+
+TAG_PATTERN = re.compile(r"<[^>]*>")
+
+# NLTK's Danish stopword list, bundled so startup needs no download
+STOPWORDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "danish_stopwords.txt")
+
+
+def load_danish_stopwords(path: Optional[str] = None) -> Set[str]:
+    """Danish stopwords from the bundled list plus the parliamentary ones"""
+    with open(path or STOPWORDS_PATH, encoding="utf-8") as f:
+        stopwords = {line.strip() for line in f if line.strip()}
+    return stopwords | PARLIAMENTARY_STOPWORDS
+
+
+class DanishTextNormalizer:
+    """
+    Normalizes text for embedding: strips HTML tags, lowercases, collapses
+    whitespace and drops stopwords. Tags are removed before the text is
+    split into words, so tags containing spaces or stopwords are removed
+    whole instead of being split apart, and the word split and stopword
+    filter happen in one pass over the text.
+    """
+
+    def __init__(self, stopwords: Iterable[str]):
+        self.stopwords = frozenset(stopwords)
+
+    def normalize(self, text: str) -> str:
+        # A tag separates the words around it
+        if "<" in text:
+            text = TAG_PATTERN.sub(" ", text)
+        # str.split() without arguments splits on (and collapses) any whitespace
+        stopwords = self.stopwords
+        return " ".join([word for word in text.lower().split() if word not in stopwords])
+
+    def normalize_many(self, texts: Iterable[str]) -> List[str]:
+        normalize = self.normalize
+        return [normalize(text) for text in texts]
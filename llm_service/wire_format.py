@@ -0,0 +1,137 @@
+"""
+Compact encodings of embeddings on the wire, next to plain JSON lists.
+
+Raw binary: send `Accept: application/x-float32` (or `application/x-float16`)
+and the body is the packed little-endian vectors, row after row, with the
+shape in the `X-Embedding-Shape` header (e.g. "768" or "12,768"). Document
+responses (chunks plus vectors) start with a 4-byte little-endian length
+and that many bytes of UTF-8 JSON holding every field of the JSON response
+except the vectors (`chunks`, `original_text`, `document_embedding`, ...),
+followed by the packed chunk vectors; `unpack_document` reads one back.
+
+Base64 in JSON: pass `?encoding=base64&dtype=float16` (or float32) and each
+embedding field holds the base64 of the packed little-endian values, with
+`dtype` and `shape` fields next to it.
+
+Quantized codes: pass `?quantize=int8,binary` (any of float16, int8,
+binary) and JSON responses get a `quantized` field with the base64 codes of
+each kind next to the full vectors (see quantization.py). int8 codes come
+with the per-vector `scale`; binary codes are the sign bits packed 8 per
+byte, with `shape` counting dimensions.
+"""
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import base64
+import json
+import struct
+import numpy as np
+from fastapi import HTTPException
+from fastapi.responses import Response
+from quantization import KINDS, binarize, quantize_int8
+
+DTYPES = {"float32": "<f4", "float16": "<f2"}
+BINARY_MEDIA_TYPES = {
+    "application/x-float32": "float32",
+    "application/x-float16": "float16",
+}
+
+
+def binary_dtype(accept: Optional[str]) -> Optional[str]:
+    """Return the dtype of the first binary media type in an Accept header"""
+    if not accept:
+        return None
+    for part in accept.split(","):
+        media_type = part.split(";")[0].strip().lower()
+        if media_type in BINARY_MEDIA_TYPES:
+            return BINARY_MEDIA_TYPES[media_type]
+    return None
+
+
+def check_encoding(encoding: Optional[str], dtype: str) -> None:
+    if encoding not in (None, "json", "base64"):
+        raise HTTPException(status_code=400, detail=f"Unknown encoding: {encoding}")
+    if dtype not in DTYPES:
+        raise HTTPException(status_code=400, detail=f"Unknown dtype: {dtype}")
+
+
+def parse_quantize(quantize: Optional[str]) -> List[str]:
+    kinds = [kind.strip() for kind in quantize.split(",") if kind.strip()] if quantize else []
+    for kind in kinds:
+        if kind not in KINDS:
+            raise HTTPException(status_code=400, detail=f"Unknown quantization: {kind}")
+    return kinds
+
+
+def quantized_codes(vectors, kinds: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+    """Base64 codes of `vectors` (one vector or a list of them) for each kind"""
+    array = np.asarray(vectors, dtype=np.float32)
+    codes: Dict[str, Dict[str, Any]] = {}
+    for kind in kinds:
+        if kind == "float16":
+            data, shape = to_base64(array, "float16")
+            codes[kind] = {"data": data, "shape": shape}
+        elif kind == "int8":
+            values, scales = quantize_int8(array)
+            codes[kind] = {
+                "data": base64.b64encode(values.tobytes()).decode("ascii"),
+                "scale": scales.tolist(),
+                "shape": list(array.shape),
+            }
+        else:
+            codes[kind] = {
+                "data": base64.b64encode(binarize(array).tobytes()).decode("ascii"),
+                "shape": list(array.shape),
+            }
+    return codes
+
+
+def pack(vectors, dtype: str) -> Tuple[bytes, Tuple[int, ...]]:
+    array = np.asarray(vectors, dtype=DTYPES[dtype])
+    return array.tobytes(), array.shape
+
+
+def to_base64(vectors, dtype: str) -> Tuple[str, List[int]]:
+    data, shape = pack(vectors, dtype)
+    return base64.b64encode(data).decode("ascii"), list(shape)
+
+
+def binary_response(vectors, dtype: str) -> Response:
+    data, shape = pack(vectors, dtype)
+    return Response(
+        content=data,
+        media_type=f"application/x-{dtype}",
+        headers={
+            "X-Embedding-Shape": ",".join(str(n) for n in shape),
+            "X-Embedding-Dtype": dtype,
+        },
+    )
+
+
+def binary_document_response(fields: Dict[str, Any], vectors, dtype: str) -> Response:
+    """Length-prefixed JSON `fields` followed by the packed `vectors`"""
+    data, shape = pack(vectors, dtype)
+    header = json.dumps({**fields, "dtype": dtype, "shape": list(shape)}).encode("utf-8")
+    return Response(
+        content=struct.pack("<I", len(header)) + header + data,
+        media_type=f"application/x-{dtype}",
+        headers={
+            "X-Embedding-Shape": ",".join(str(n) for n in shape),
+            "X-Embedding-Dtype": dtype,
+            "X-Embedding-Header-Length": str(len(header)),
+        },
+    )
+
+
+def unpack_document(body: bytes) -> Tuple[Dict[str, Any], np.ndarray]:
+    """Split a binary document response into its JSON fields and vectors"""
+    (length,) = struct.unpack_from("<I", body)
+    fields = json.loads(body[4:4 + length].decode("utf-8"))
+    return fields, unpack(body[4 + length:], fields["dtype"], fields["shape"])
+
+
+def unpack(data: bytes, dtype: str, shape: Sequence[int]) -> np.ndarray:
+    """Decode raw or base64-decoded bytes back into a float32 array"""
+    return np.frombuffer(data, dtype=DTYPES[dtype]).reshape(shape).astype(np.float32)
+
+
+def from_base64(data: str, dtype: str, shape: Sequence[int]) -> np.ndarray:
+    return unpack(base64.b64decode(data), dtype, shape)